@@ -0,0 +1,156 @@
+import threading
+import time
+from collections import Counter
+from django.conf import settings
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+
+class RenderCapacityExceeded(APIException):
+    """
+    Raised when an upload cannot be admitted for thumbnail rendering.
+
+    DRF's exception handler turns ``wait`` into a ``Retry-After`` header.
+    """
+
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = "The server is busy processing uploads. Please retry later."
+    default_code = "render_capacity_exceeded"
+
+    def __init__(self, wait, detail=None, code=None):
+        self.wait = wait
+        super().__init__(detail, code)
+
+
+class RenderAdmission:
+    """
+    Per-process admission control for CPU-bound thumbnail rendering.
+
+    At most ``MAX_CONCURRENT`` uploads render at once and at most
+    ``MAX_QUEUED`` more wait up to ``QUEUE_TIMEOUT`` seconds for a slot;
+    anything beyond that is rejected straight away with RenderCapacityExceeded.
+    A subscription plan can lower both limits for its own users through
+    ``max_concurrent_renders`` and ``max_queued_renders``. Serving requests
+    never wait here, so the CPU left over by the render limit stays reserved
+    for them: thumbnails rendered on their first serve only take one of the
+    separate ``MAX_LAZY`` slots if one is free, through ``try_acquire_lazy``.
+
+    Limits are read from ``settings.RENDER_ADMISSION`` on every call.
+    """
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._active = Counter()
+        self._queued = Counter()
+        self._lazy = 0
+
+    def _limits(self, subscription_plan):
+        config = settings.RENDER_ADMISSION
+        max_concurrent = config["MAX_CONCURRENT"]
+        max_queued = config["MAX_QUEUED"]
+        plan_concurrent = getattr(subscription_plan, "max_concurrent_renders", None)
+        plan_queued = getattr(subscription_plan, "max_queued_renders", None)
+        return (
+            max_concurrent,
+            max_queued,
+            min(max_concurrent, plan_concurrent)
+            if plan_concurrent is not None
+            else max_concurrent,
+            min(max_queued, plan_queued) if plan_queued is not None else max_queued,
+        )
+
+    def _has_slot(self, plan_id, max_concurrent, plan_concurrent):
+        return (
+            sum(self._active.values()) < max_concurrent
+            and self._active[plan_id] < plan_concurrent
+        )
+
+    def _reject(self):
+        raise RenderCapacityExceeded(wait=settings.RENDER_ADMISSION["RETRY_AFTER"])
+
+    def acquire(self, subscription_plan):
+        """
+        Wait for a render slot.
+
+        Blocks the calling thread while queued; call it from a worker thread,
+        never from the event loop.
+
+        Args:
+            subscription_plan (CustomSubscriptionPlan): The uploader's plan.
+
+        Raises:
+            RenderCapacityExceeded: If the queue is full or the wait timed out.
+        """
+        plan_id = getattr(subscription_plan, "pk", None)
+        max_concurrent, max_queued, plan_concurrent, plan_queued = self._limits(
+            subscription_plan
+        )
+        with self._condition:
+            if self._has_slot(plan_id, max_concurrent, plan_concurrent):
+                self._active[plan_id] += 1
+                return
+            if (
+                sum(self._queued.values()) >= max_queued
+                or self._queued[plan_id] >= plan_queued
+            ):
+                self._reject()
+
+            self._queued[plan_id] += 1
+            deadline = time.monotonic() + settings.RENDER_ADMISSION["QUEUE_TIMEOUT"]
+            try:
+                while not self._has_slot(plan_id, max_concurrent, plan_concurrent):
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._reject()
+                    self._condition.wait(remaining)
+            finally:
+                self._queued[plan_id] -= 1
+            self._active[plan_id] += 1
+
+    def release(self, subscription_plan):
+        """
+        Give back a render slot taken with ``acquire``.
+
+        Args:
+            subscription_plan (CustomSubscriptionPlan): The uploader's plan.
+        """
+        with self._condition:
+            self._active[getattr(subscription_plan, "pk", None)] -= 1
+            self._condition.notify_all()
+
+    def try_acquire_lazy(self):
+        """
+        Take a slot for rendering a thumbnail on its first serve, without
+        waiting.
+
+        Returns:
+            bool: Whether a slot was taken; give it back with ``release_lazy``.
+        """
+        with self._condition:
+            if self._lazy >= settings.RENDER_ADMISSION["MAX_LAZY"]:
+                return False
+            self._lazy += 1
+            return True
+
+    def release_lazy(self):
+        """
+        Give back a slot taken with ``try_acquire_lazy``.
+        """
+        with self._condition:
+            self._lazy -= 1
+
+    def stats(self):
+        """
+        Get the current number of rendering and queued uploads.
+
+        Returns:
+            dict: The ``active`` and ``queued`` counts.
+        """
+        with self._condition:
+            return {
+                "active": sum(self._active.values()),
+                "queued": sum(self._queued.values()),
+            }
+
+
+render_admission = RenderAdmission()
@@ -0,0 +1,137 @@
+"""
+Dominant colours and search by colour.
+
+Each image keeps its few dominant colours as ImageColour rows, filed under
+one of 64 bins (4 levels per RGB channel) and indexed by owner and bin. A
+search only reads the rows of the bins that can hold a colour within the
+requested distance, so its cost follows the number of matches rather than
+the size of the library.
+"""
+
+import math
+from django.db import transaction
+
+LEVELS = 4
+BIN_WIDTH = 256 // LEVELS
+PALETTE_SIZE = 5
+# Colours covering less of the image than this are not searched.
+MIN_SHARE = 0.05
+DEFAULT_SEARCH_DISTANCE = 60
+MAX_SEARCH_DISTANCE = 160
+MAX_SEARCH_RESULTS = 200
+
+
+def bins_within(rgb, distance):
+    """
+    Get the bins holding colours that may be within a distance of a colour.
+
+    Args:
+        rgb (tuple): The red, green and blue values.
+        distance (float): The largest Euclidean distance in RGB space.
+
+    Returns:
+        list: The bins.
+    """
+    bins = []
+    for index in range(LEVELS**3):
+        levels = (index // LEVELS**2, index // LEVELS % LEVELS, index % LEVELS)
+        gap = 0
+        for level, value in zip(levels, rgb):
+            low, high = level * BIN_WIDTH, (level + 1) * BIN_WIDTH - 1
+            gap += max(low - value, 0, value - high) ** 2
+        if gap <= distance**2:
+            bins.append(index)
+    return bins
+
+
+def parse_colour(value):
+    """
+    Parse a hex colour such as ``ff8800`` or ``#ff8800``.
+
+    Args:
+        value (str): The colour.
+
+    Returns:
+        tuple: The red, green and blue values.
+
+    Raises:
+        ValueError: If the colour is not six hex digits.
+    """
+    value = value.removeprefix("#")
+    if len(value) != 6:
+        raise ValueError("Expected a colour such as ff8800.")
+    packed = int(value, 16)
+    return packed >> 16, packed >> 8 & 0xFF, packed & 0xFF
+
+
+def to_hex(packed):
+    """
+    Format a packed ``0xRRGGBB`` colour.
+
+    Args:
+        packed (int): The colour.
+
+    Returns:
+        str: The colour as ``#rrggbb``.
+    """
+    return f"#{packed:06x}"
+
+
+def store(instance, palette):
+    """
+    Replace the dominant colours of an image.
+
+    Args:
+        instance (Image): The image.
+        palette (list): ``(bin, (red, green, blue), share)`` tuples from
+            ``imaging.dominant_colours``.
+    """
+    from .models import ImageColour
+
+    with transaction.atomic():
+        ImageColour.objects.filter(image=instance).delete()
+        ImageColour.objects.bulk_create(
+            ImageColour(
+                image=instance,
+                user_id=instance.user_id,
+                bin=bin,
+                rgb=red << 16 | green << 8 | blue,
+                share=share,
+            )
+            for bin, (red, green, blue), share in palette
+        )
+
+
+def search(user_id, rgb, distance=DEFAULT_SEARCH_DISTANCE, limit=50):
+    """
+    Rank a user's images by how close their dominant colours come to a colour.
+
+    Args:
+        user_id (int): The ID of the user whose images are searched.
+        rgb (tuple): The red, green and blue values to look for.
+        distance (float): The largest Euclidean distance in RGB space.
+        limit (int): The most images returned.
+
+    Returns:
+        list: ``(image ID, packed colour, share, distance)`` tuples, closest
+        first and, at equal distance, by largest share.
+    """
+    from .models import ImageColour
+
+    rows = ImageColour.objects.filter(
+        user_id=user_id, bin__in=bins_within(rgb, distance), share__gte=MIN_SHARE
+    ).values_list("image_id", "rgb", "share")
+    best = {}
+    for image_id, packed, share in rows:
+        colour = (packed >> 16, packed >> 8 & 0xFF, packed & 0xFF)
+        colour_distance = math.dist(colour, rgb)
+        if colour_distance > distance:
+            continue
+        match = (round(colour_distance, 1), -share, packed)
+        if image_id not in best or match < best[image_id]:
+            best[image_id] = match
+    ranked = sorted(best.items(), key=lambda item: (item[1], item[0]))[:limit]
+    return [
+        (image_id, packed, -share, colour_distance)
+        for image_id, (colour_distance, share, packed) in ranked
+    ]
@@ -0,0 +1,205 @@
+"""
+Read-replica routing for read-only views.
+
+Views using ``ReplicaReadMixin`` (serve-image, transform and image detail)
+read from one of the aliases in ``READ_REPLICAS["ALIASES"]`` for safe
+methods; everything else, and every write, goes to ``default``. The replica
+is chosen once per request, so a request sees one consistent copy.
+
+Replicas lag behind the primary, so a user whose images or profile were
+just written is pinned to the primary for ``READ_REPLICAS["PIN_SECONDS"]``
+seconds: an upload followed by a detail or serve request reads what was
+written. The pin lives in the cache, so it holds across workers.
+
+Each process checks a replica at most every
+``READ_REPLICAS["HEALTH_CHECK_INTERVAL"]`` seconds. A replica that cannot be
+queried, or that is more than ``READ_REPLICAS["MAX_LAG"]`` seconds behind
+(measured on PostgreSQL standbys), gets no reads until a later check passes;
+with no healthy replica, reads fall back to ``default``. The results are
+exported at /metrics/ as ``imagecraft_db_replica_healthy`` and
+``imagecraft_db_replica_lag_seconds``.
+
+With no replicas configured, the views cost nothing more.
+"""
+
+import logging
+import random
+import threading
+import time
+from contextvars import ContextVar
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+from rest_framework.permissions import SAFE_METHODS
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# The replica the current request reads from, if any.
+_replica = ContextVar("replica", default=None)
+
+# Alias -> (monotonic time of the last check, whether it passed).
+_health = {}
+_health_lock = threading.Lock()
+
+# Replay lag of a PostgreSQL standby; zero when it has replayed all it has
+# received, since the last replayed transaction may be old on an idle primary.
+# NULL, so zero, on a server that is not a standby.
+POSTGRES_LAG_QUERY = """
+    SELECT COALESCE(
+        CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) END,
+        0
+    )
+"""
+
+
+def pin_key(user_id):
+    return f"db_pin_{user_id}"
+
+
+def pin(user_id):
+    """
+    Send a user's reads to the primary for ``READ_REPLICAS["PIN_SECONDS"]``.
+
+    Args:
+        user_id (int): The user whose data was written.
+    """
+    config = settings.READ_REPLICAS
+    if config["ALIASES"]:
+        cache.set(pin_key(user_id), True, config["PIN_SECONDS"])
+
+
+def measure_lag(alias):
+    """
+    Query a replica for how far it is behind the primary.
+
+    Args:
+        alias (str): The database alias.
+
+    Returns:
+        float: The lag in seconds; 0 where it cannot be measured.
+
+    Raises:
+        DatabaseError: If the replica cannot be queried.
+    """
+    connection = connections[alias]
+    with connection.cursor() as cursor:
+        if connection.vendor == "postgresql":
+            cursor.execute(POSTGRES_LAG_QUERY)
+            return float(cursor.fetchone()[0])
+        cursor.execute("SELECT 1")
+        return 0.0
+
+
+def check_replica(alias):
+    """
+    Check a replica and record the result in the metrics.
+
+    Args:
+        alias (str): The database alias.
+
+    Returns:
+        bool: Whether the replica may serve reads.
+    """
+    try:
+        lag = measure_lag(alias)
+    except DatabaseError:
+        logger.warning("Read replica %s is unavailable", alias, exc_info=True)
+        metrics.set_gauge("imagecraft_db_replica_healthy", 0, database=alias)
+        return False
+    healthy = lag <= settings.READ_REPLICAS["MAX_LAG"]
+    if not healthy:
+        logger.warning("Read replica %s is %.1f s behind", alias, lag)
+    metrics.set_gauge("imagecraft_db_replica_lag_seconds", lag, database=alias)
+    metrics.set_gauge("imagecraft_db_replica_healthy", int(healthy), database=alias)
+    return healthy
+
+
+def is_healthy(alias):
+    """
+    Get whether a replica passed its last check, checking it again if due.
+
+    Args:
+        alias (str): The database alias.
+
+    Returns:
+        bool: Whether the replica may serve reads.
+    """
+    now = time.monotonic()
+    with _health_lock:
+        checked = _health.get(alias)
+        due = (
+            checked is None
+            or now - checked[0] >= settings.READ_REPLICAS["HEALTH_CHECK_INTERVAL"]
+        )
+        if due:
+            # Claim the check so concurrent requests keep the last result.
+            _health[alias] = (now, checked[1] if checked else False)
+    if not due:
+        return checked[1]
+    healthy = check_replica(alias)
+    with _health_lock:
+        _health[alias] = (now, healthy)
+    return healthy
+
+
+def choose_replica(user):
+    """
+    Choose the replica a user's read-only request reads from.
+
+    Args:
+        user (User): The requester.
+
+    Returns:
+        str: A healthy replica alias, or None to read from the primary.
+    """
+    aliases = settings.READ_REPLICAS["ALIASES"]
+    if not aliases or (user.is_authenticated and cache.get(pin_key(user.pk))):
+        return None
+    healthy = [alias for alias in aliases if is_healthy(alias)]
+    return random.choice(healthy) if healthy else None
+
+
+class ReplicaReadMixin:
+    """
+    Read from a replica in safe-method requests; see ImageCraftApp.db_router.
+
+    The replica is chosen once the requester is authenticated, so
+    authentication itself reads from the primary.
+    """
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        if request.method in SAFE_METHODS:
+            self._replica_token = _replica.set(choose_replica(request.user))
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        token = getattr(self, "_replica_token", None)
+        if token is not None:
+            _replica.reset(token)
+            self._replica_token = None
+        return super().finalize_response(request, response, *args, **kwargs)
+
+
+class ReplicaRouter:
+    """
+    Database router sending reads in ``ReplicaReadMixin`` views to replicas.
+    """
+
+    def db_for_read(self, model, **hints):
+        # Explicitly the primary elsewhere, also for objects read from a
+        # replica, which Django would otherwise keep reading from there.
+        return _replica.get() or DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same rows as the primary.
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db in settings.READ_REPLICAS["ALIASES"]:
+            return False
+        return None
@@ -0,0 +1,104 @@
+"""
+Near-duplicate detection with perceptual hashes.
+
+Every image stores a 64-bit difference hash of its Basic thumbnail, both
+whole and split into four 16-bit chunks held in indexed columns
+(multi-index hashing). Two hashes within Hamming distance ``d`` agree to
+within ``d // 4`` bits on at least one chunk, so candidates are found with
+indexed lookups of the chunk values that close to the query's, and only
+those rows are compared bit by bit.
+"""
+
+import itertools
+from django.db.models import Q
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+CHUNK_BITS = 16
+CHUNK_FIELDS = ["phash_0", "phash_1", "phash_2", "phash_3"]
+HASH_BITS = CHUNK_BITS * len(CHUNK_FIELDS)
+# Enumerating chunk values stays cheap up to two flipped bits per chunk.
+MAX_DISTANCE = 3 * len(CHUNK_FIELDS) - 1
+
+# What uploads do about near-duplicates of images already in the library.
+POLICIES = ("allow", "warn", "reject")
+
+
+class DuplicateImage(APIException):
+    """
+    Raised when an upload is rejected as a near-duplicate.
+    """
+
+    status_code = status.HTTP_409_CONFLICT
+    default_detail = "This image is a near-duplicate of one in your library."
+    default_code = "duplicate_image"
+
+
+def hash_fields(value):
+    """
+    Get the Image field values storing a hash.
+
+    Args:
+        value (int): The unsigned 64-bit hash.
+
+    Returns:
+        dict: The whole hash (as a signed 64-bit integer, which the database
+        column holds) under ``phash`` and its chunks under ``phash_0`` to
+        ``phash_3``, most significant first.
+    """
+    fields = {"phash": value - (1 << HASH_BITS) if value >> (HASH_BITS - 1) else value}
+    for index, field in enumerate(CHUNK_FIELDS):
+        shift = HASH_BITS - CHUNK_BITS * (index + 1)
+        fields[field] = (value >> shift) & ((1 << CHUNK_BITS) - 1)
+    return fields
+
+
+def unsigned(phash):
+    """
+    Get the unsigned hash from the stored ``phash`` value.
+
+    Args:
+        phash (int): The stored, signed hash.
+
+    Returns:
+        int: The unsigned 64-bit hash.
+    """
+    return phash & ((1 << HASH_BITS) - 1)
+
+
+def _neighbours(chunk, distance):
+    values = [chunk]
+    for flipped in range(1, distance + 1):
+        for bits in itertools.combinations(range(CHUNK_BITS), flipped):
+            values.append(chunk ^ sum(1 << bit for bit in bits))
+    return values
+
+
+def find_near_duplicates(queryset, phash, distance, exclude=None):
+    """
+    Find the images whose hash is within a Hamming distance of a hash.
+
+    Args:
+        queryset (QuerySet): The images to search, e.g. one user's library.
+        phash (int): The stored hash to compare with.
+        distance (int): The largest Hamming distance, at most MAX_DISTANCE.
+        exclude (int, optional): An image ID to leave out.
+
+    Returns:
+        list: ``(image ID, distance)`` pairs, closest first.
+    """
+    value = unsigned(phash)
+    chunks = hash_fields(value)
+    radius = distance // len(CHUNK_FIELDS)
+    candidates = Q()
+    for field in CHUNK_FIELDS:
+        candidates |= Q(**{f"{field}__in": _neighbours(chunks[field], radius)})
+    rows = queryset.filter(candidates).values_list("pk", "phash")
+    if exclude is not None:
+        rows = rows.exclude(pk=exclude)
+    matches = []
+    for pk, other in rows:
+        other_distance = (value ^ unsigned(other)).bit_count()
+        if other_distance <= distance:
+            matches.append((pk, other_distance))
+    return sorted(matches, key=lambda match: (match[1], match[0]))
@@ -0,0 +1,101 @@
+"""
+Integration with the nginx ``proxy_cache`` in front of serve-image.
+
+Responses tell nginx how long to keep them with ``X-Accel-Expires``, never
+beyond the moment the link expires. Serve URLs carry the image's
+``cache_version``, so bumping it on regeneration or expiry changes makes every
+cached copy unreachable at once. Where nginx has the ngx_cache_purge module,
+``EDGE_CACHE_PURGE_URL`` additionally lets the app evict entries right away,
+which also covers deleted images.
+"""
+
+import logging
+import math
+import threading
+import urllib.request
+from django.conf import settings
+from django.db.models import F
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+PURGE_TIMEOUT = 2
+
+
+def serve_cache_ttl(expiration_date, link_expires):
+    """
+    Get how long a serve-image response may be cached.
+
+    Args:
+        expiration_date (datetime): When the served image's link expires.
+        link_expires (bool): Whether the image's link expiry applies to the
+            requesting user.
+
+    Returns:
+        int: The TTL in seconds; 0 disables caching.
+    """
+    ttl = settings.SERVE_CACHE_MAX_TTL
+    if link_expires and expiration_date:
+        remaining = (expiration_date - timezone.now()).total_seconds()
+        ttl = min(ttl, max(0, math.floor(remaining)))
+    return ttl
+
+
+def set_cache_headers(response, ttl):
+    """
+    Add the caching headers of a serve-image response.
+
+    Args:
+        response (HttpResponse): The response.
+        ttl (int): The TTL in seconds.
+
+    Returns:
+        HttpResponse: The response.
+    """
+    response["X-Accel-Expires"] = str(ttl)
+    response["Cache-Control"] = f"private, max-age={ttl}" if ttl else "no-store"
+    return response
+
+
+def purge(image_pk):
+    """
+    Ask nginx to evict the cached responses of an image, if purging is configured.
+
+    Runs in a background thread so callers never wait on nginx.
+
+    Args:
+        image_pk (int): The ID of the image.
+    """
+    base_url = settings.EDGE_CACHE_PURGE_URL
+    if not base_url:
+        return
+
+    def send():
+        request = urllib.request.Request(
+            f"{base_url.rstrip('/')}/serve-image/{image_pk}/*", method="PURGE"
+        )
+        try:
+            urllib.request.urlopen(request, timeout=PURGE_TIMEOUT).close()
+        except OSError as e:
+            # 404 means nothing was cached; anything else expires by TTL.
+            if getattr(e, "code", None) != 404:
+                logger.warning("Could not purge image %s from nginx: %s", image_pk, e)
+
+    threading.Thread(target=send, daemon=True).start()
+
+
+def invalidate(instance):
+    """
+    Invalidate every cached response of an image.
+
+    Bumps the image's ``cache_version`` in the database and on the instance,
+    then purges nginx.
+
+    Args:
+        instance (Image): The image.
+    """
+    type(instance).objects.filter(pk=instance.pk).update(
+        cache_version=F("cache_version") + 1
+    )
+    instance.cache_version += 1
+    purge(instance.pk)
@@ -0,0 +1,359 @@
+"""
+Per-image processing events pushed to clients over server-sent events.
+
+Events are published on a channel per user from wherever processing happens
+(request handlers, executor threads, management commands) and delivered to
+every open event stream of that user. Each stream holds a small bounded
+queue, so an idle connection costs one suspended coroutine and an empty
+queue.
+
+``PROGRESS_EVENTS["BACKEND"]`` selects how events travel:
+
+* ``InProcessBackend`` delivers events only to streams of the same process.
+  Enough with a single worker.
+* ``PostgresBackend`` sends them through PostgreSQL ``NOTIFY``; every worker
+  listens on one shared connection and fans them out to its own streams.
+  A lost connection is reopened in the background; while that fails, open
+  streams get an ``interrupted`` event, since events are being missed.
+"""
+
+import asyncio
+import contextlib
+import json
+import logging
+import threading
+from collections import defaultdict
+from functools import lru_cache
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+RECEIVED = "received"
+VARIANT = "variant"
+FAILED = "failed"
+# Sent to every stream of a process whose events may have been lost.
+INTERRUPTED = "interrupted"
+# Seconds between attempts to reopen a lost listener connection; the last
+# one repeats.
+RECONNECT_DELAYS = (1, 2, 5, 10, 30)
+
+
+class Subscription:
+    """
+    The queue of events waiting to be sent on one stream.
+
+    When the client reads slower than events arrive, the oldest event is
+    dropped rather than letting the queue grow.
+    """
+
+    def __init__(self, loop, queue_size):
+        self.loop = loop
+        self.queue = asyncio.Queue(queue_size)
+
+    def deliver(self, event):
+        """
+        Queue an event; safe to call from any thread.
+
+        Args:
+            event (dict): The event.
+        """
+        try:
+            self.loop.call_soon_threadsafe(self._put, event)
+        except RuntimeError:
+            # The stream's event loop has been closed.
+            pass
+
+    def _put(self, event):
+        if self.queue.full():
+            self.queue.get_nowait()
+        self.queue.put_nowait(event)
+
+    async def get(self, timeout):
+        """
+        Wait for the next event.
+
+        Args:
+            timeout (float): Seconds to wait.
+
+        Returns:
+            dict: The event, or None if none arrived in time.
+        """
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+
+class Broker:
+    """
+    In-process publish/subscribe of events by channel.
+    """
+
+    def __init__(self, queue_size):
+        self.queue_size = queue_size
+        self._subscriptions = defaultdict(set)
+        self._lock = threading.Lock()
+
+    def publish(self, channel, event):
+        """
+        Deliver an event to every subscription of a channel.
+
+        Args:
+            channel (int): The channel, a user ID.
+            event (dict): The event.
+        """
+        with self._lock:
+            subscriptions = list(self._subscriptions.get(channel, ()))
+        for subscription in subscriptions:
+            subscription.deliver(event)
+
+    def broadcast(self, event):
+        """
+        Deliver an event to every subscription of every channel.
+
+        Args:
+            event (dict): The event.
+        """
+        with self._lock:
+            subscriptions = [
+                subscription
+                for channel_subscriptions in self._subscriptions.values()
+                for subscription in channel_subscriptions
+            ]
+        for subscription in subscriptions:
+            subscription.deliver(event)
+
+    @contextlib.contextmanager
+    def subscribe(self, channel):
+        """
+        Subscribe to a channel for the duration of the block.
+
+        Must be called on the event loop that reads the subscription.
+
+        Args:
+            channel (int): The channel, a user ID.
+
+        Yields:
+            Subscription: The subscription.
+        """
+        subscription = Subscription(asyncio.get_running_loop(), self.queue_size)
+        with self._lock:
+            self._subscriptions[channel].add(subscription)
+        try:
+            yield subscription
+        finally:
+            with self._lock:
+                subscriptions = self._subscriptions[channel]
+                subscriptions.discard(subscription)
+                if not subscriptions:
+                    del self._subscriptions[channel]
+
+    def subscriber_count(self):
+        """
+        Count the open subscriptions of all channels.
+
+        Returns:
+            int: The number of subscriptions.
+        """
+        with self._lock:
+            return sum(
+                len(subscriptions) for subscriptions in self._subscriptions.values()
+            )
+
+
+class InProcessBackend:
+    """
+    Deliver events to the streams of the publishing process only.
+    """
+
+    def __init__(self, queue_size):
+        self.broker = Broker(queue_size)
+
+    def publish(self, channel, event):
+        """
+        Publish an event.
+
+        Args:
+            channel (int): The channel, a user ID.
+            event (dict): The event; must be JSON serializable.
+        """
+        self.broker.publish(channel, event)
+
+    @contextlib.asynccontextmanager
+    async def subscribe(self, channel):
+        """
+        Subscribe to a channel for the duration of the block.
+
+        Args:
+            channel (int): The channel, a user ID.
+
+        Yields:
+            Subscription: The subscription.
+        """
+        with self.broker.subscribe(channel) as subscription:
+            yield subscription
+
+
+class PostgresBackend(InProcessBackend):
+    """
+    Deliver events to the streams of every worker through PostgreSQL NOTIFY.
+
+    Events are sent with ``pg_notify`` on the Django database connection, so
+    events published inside a transaction are only delivered once it
+    commits. Each process opens a single asyncpg connection listening for
+    them, the first time a stream is opened, and reopens it in the
+    background if it is lost while streams are open.
+    """
+
+    notify_channel = "imagecraft_events"
+
+    def __init__(self, queue_size):
+        super().__init__(queue_size)
+        self._connection = None
+        self._connect_lock = asyncio.Lock()
+        self._reconnecting = None
+
+    def publish(self, channel, event):
+        """
+        Publish an event.
+
+        Args:
+            channel (int): The channel, a user ID.
+            event (dict): The event; must be JSON serializable.
+        """
+        from django.db import connection
+
+        payload = json.dumps({"channel": channel, "event": event})
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT pg_notify(%s, %s)", [self.notify_channel, payload])
+
+    @contextlib.asynccontextmanager
+    async def subscribe(self, channel):
+        """
+        Subscribe to a channel for the duration of the block.
+
+        Args:
+            channel (int): The channel, a user ID.
+
+        Yields:
+            Subscription: The subscription.
+        """
+        await self._listen()
+        with self.broker.subscribe(channel) as subscription:
+            yield subscription
+
+    def _listening(self):
+        return self._connection is not None and not self._connection.is_closed()
+
+    async def _listen(self):
+        if self._listening():
+            return
+        async with self._connect_lock:
+            if not self._listening():
+                await self._connect()
+
+    async def _connect(self):
+        import asyncpg
+
+        database = settings.DATABASES["default"]
+        connection = await asyncpg.connect(
+            host=database.get("HOST") or None,
+            port=database.get("PORT") or None,
+            user=database.get("USER") or None,
+            password=database.get("PASSWORD") or None,
+            database=database.get("NAME") or None,
+        )
+        connection.add_termination_listener(self._on_terminated)
+        await connection.add_listener(self.notify_channel, self._on_notify)
+        self._connection = connection
+
+    def _on_notify(self, connection, pid, notify_channel, payload):
+        message = json.loads(payload)
+        self.broker.publish(message["channel"], message["event"])
+
+    def _on_terminated(self, connection):
+        logger.warning("Lost the progress events listener connection.")
+        if self._connection is not connection:
+            return
+        self._connection = None
+        if self._reconnecting is None or self._reconnecting.done():
+            self._reconnecting = asyncio.ensure_future(self._reconnect())
+
+    async def _reconnect(self):
+        """
+        Reopen the listener connection, backing off between attempts.
+
+        Gives up once no stream is open; the next one connects again. Open
+        streams get an ``interrupted`` event after the first failed attempt.
+        """
+        attempt = 0
+        while self.broker.subscriber_count():
+            await asyncio.sleep(
+                RECONNECT_DELAYS[min(attempt, len(RECONNECT_DELAYS) - 1)]
+            )
+            try:
+                await self._listen()
+            except Exception:
+                logger.warning(
+                    "Could not reopen the progress events listener connection.",
+                    exc_info=True,
+                )
+                if not attempt:
+                    self.broker.broadcast(
+                        {
+                            "event": INTERRUPTED,
+                            "detail": "Progress events are unavailable; "
+                            "reload to see the current state.",
+                        }
+                    )
+                attempt += 1
+            else:
+                logger.info("Reopened the progress events listener connection.")
+                return
+
+
+@lru_cache(maxsize=None)
+def get_backend():
+    """
+    Get the configured events backend of this process.
+
+    Returns:
+        InProcessBackend: The backend.
+    """
+    config = settings.PROGRESS_EVENTS
+    return import_string(config["BACKEND"])(config["QUEUE_SIZE"])
+
+
+def publish(instance, event, **data):
+    """
+    Publish a processing event of an image to its owner's streams.
+
+    Failures are logged and never propagate, so a broken backend cannot fail
+    an upload.
+
+    Args:
+        instance (Image): The image.
+        event (str): ``received``, ``variant`` or ``failed``.
+        data: Extra event fields.
+    """
+    try:
+        get_backend().publish(
+            instance.user_id, {"event": event, "image": instance.pk, **data}
+        )
+    except Exception:
+        logger.exception("Could not publish %s event of image %s.", event, instance.pk)
+
+
+def format_event(event):
+    """
+    Encode an event as a server-sent event.
+
+    Args:
+        event (dict): The event.
+
+    Returns:
+        bytes: The ``event`` and ``data`` lines of the message.
+    """
+    data = {key: value for key, value in event.items() if key != "event"}
+    return f"event: {event['event']}\ndata: {json.dumps(data)}\n\n".encode()
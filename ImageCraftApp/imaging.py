@@ -0,0 +1,533 @@
+import base64
+import functools
+import math
+from io import BytesIO
+import numpy as np
+from PIL import Image as PILImage, ImageCms, ImageOps, features
+from .colours import LEVELS as COLOUR_LEVELS, PALETTE_SIZE
+
+# Modes an embedded ICC profile can be converted from, and the mode produced.
+ICC_OUTPUT_MODES = {"RGB": "RGB", "RGBA": "RGBA", "CMYK": "RGB"}
+
+PLACEHOLDER_SIZE = 20
+PLACEHOLDER_QUALITY = 40
+
+SPRITE_QUALITY = 85
+
+# Frame delay used when an animation does not set one, in milliseconds.
+DEFAULT_FRAME_DURATION = 100
+
+# A difference hash compares each of 8 rows of 9 grey pixels with its neighbour.
+DHASH_SIZE = 8
+
+# Like Image.thumbnail, reduce to no less than twice the target size before
+# the final antialiased resize.
+REDUCING_GAP = 2
+# Modes Image.reduce accepts, and so the only ones the banded path handles.
+BANDED_MODES = {"L", "LA", "RGB", "RGBA", "CMYK", "I", "F"}
+# Formats decoded through libvips, which shrinks them while it streams the
+# file, when they are over the budget and pyvips is installed.
+VIPS_FORMATS = {"PNG", "WEBP", "GIF", "TIFF"}
+# Pillow modes of 8-bit libvips images, by band count.
+VIPS_MODES = {1: "L", 2: "LA", 3: "RGB", 4: "RGBA"}
+
+# How check_pixel_budget says an image fits the budget.
+DECODE_FULL = "full"
+DECODE_BANDS = "bands"
+DECODE_VIPS = "vips"
+
+
+class ImageTooLarge(ValueError):
+    """
+    Raised when an image exceeds the pixel limits it is processed under.
+    """
+
+
+@functools.lru_cache(maxsize=1)
+def _srgb_profile():
+    return ImageCms.ImageCmsProfile(ImageCms.createProfile("sRGB"))
+
+
+@functools.lru_cache(maxsize=32)
+def _srgb_transform(icc_profile, mode):
+    """
+    Build the colour transform from an embedded ICC profile to sRGB.
+
+    Transforms are cached per distinct profile, so photos from the same camera
+    or editor only pay for building the transform once per process.
+
+    Args:
+        icc_profile (bytes): The embedded ICC profile.
+        mode (str): The mode of the image the profile is embedded in.
+
+    Returns:
+        ImageCmsTransform: The colour transform.
+    """
+    return ImageCms.buildTransform(
+        ImageCms.ImageCmsProfile(BytesIO(icc_profile)),
+        _srgb_profile(),
+        mode,
+        ICC_OUTPUT_MODES[mode],
+    )
+
+
+def normalize(image):
+    """
+    Prepare a decoded image for re-encoding as a thumbnail.
+
+    Applies the EXIF orientation, converts pixels described by an embedded ICC
+    profile to sRGB and drops EXIF, XMP and ICC metadata. Cheapest when called
+    on an already downscaled image.
+
+    Args:
+        image (PIL.Image.Image): The decoded image.
+
+    Returns:
+        PIL.Image.Image: The upright, sRGB image without metadata.
+    """
+    icc_profile = image.info.get("icc_profile")
+    image = ImageOps.exif_transpose(image)
+    if icc_profile and image.mode in ICC_OUTPUT_MODES:
+        try:
+            transform = _srgb_transform(icc_profile, image.mode)
+        except (ImageCms.PyCMSError, OSError):
+            # A broken or mismatched profile: keep the pixels as they are.
+            pass
+        else:
+            image = ImageCms.applyTransform(image, transform)
+    image.info = {}
+    return image
+
+
+def flatten(image):
+    """
+    Convert an image to a mode JPEG can store.
+
+    Palette, transparent and other modes are converted to RGB, with
+    transparent areas composited over white rather than turned black.
+
+    Args:
+        image (PIL.Image.Image): The image.
+
+    Returns:
+        PIL.Image.Image: The image in mode RGB or L, keeping its ``info``.
+    """
+    if image.mode in ("RGB", "L"):
+        return image
+    if "A" in image.getbands() or "transparency" in image.info:
+        rgba = image.convert("RGBA")
+        flattened = PILImage.new("RGB", image.size, "white")
+        flattened.paste(rgba, mask=rgba.getchannel("A"))
+    else:
+        flattened = image.convert("RGB")
+    flattened.info = image.info
+    return flattened
+
+
+def is_animated(path):
+    """
+    Check whether an image file holds more than one frame.
+
+    Args:
+        path (str): The file path to the image.
+
+    Returns:
+        bool: True for animated GIF, WebP and PNG files.
+    """
+    # Only these formats animate; others are not opened a second time.
+    with open(path, "rb") as f:
+        header = f.read(16)
+    if not (
+        header.startswith((b"GIF8", b"\x89PNG"))
+        or (header.startswith(b"RIFF") and header[8:12] == b"WEBP")
+    ):
+        return False
+    with PILImage.open(path) as image:
+        return getattr(image, "is_animated", False)
+
+
+def animation_format():
+    """
+    Get the format animated thumbnails are encoded in.
+
+    Returns:
+        str: ``WEBP`` when Pillow can write animated WebP, else ``GIF``.
+    """
+    return "WEBP" if features.check("webp_anim") else "GIF"
+
+
+def render_animation(path, sizes, max_frames, decode_pixels, quality):
+    """
+    Render animated thumbnails of several sizes, one source frame at a time.
+
+    Frames are decoded in order and each kept frame is downscaled as soon as
+    it is decoded, so the source costs one frame of memory however long the
+    animation is. Animations longer than ``max_frames`` are decimated: every
+    n-th frame is kept and shown for the time of the frames dropped after it,
+    so playback keeps its speed.
+
+    Args:
+        path (str): The file path to the animated original.
+        sizes (iterable): The thumbnail sizes to render.
+        max_frames (int): The most frames a thumbnail keeps.
+        decode_pixels (int): The most pixels a source frame may have.
+        quality (int): The WebP quality.
+
+    Returns:
+        dict: Mapping of size to the animated thumbnail as BytesIO object.
+
+    Raises:
+        ImageTooLarge: If a frame has more than ``decode_pixels`` pixels.
+    """
+    sizes = sorted(set(sizes), reverse=True)
+    frames = {size: [] for size in sizes}
+    durations = []
+    with PILImage.open(path) as image:
+        if image.width * image.height > decode_pixels:
+            raise ImageTooLarge(
+                f"An animation of {image.width}x{image.height} pixels is too "
+                "large to process."
+            )
+        step = math.ceil(image.n_frames / max_frames)
+        loop = image.info.get("loop", 0)
+        for index in range(image.n_frames):
+            image.seek(index)
+            # WebP sets the frame duration once the frame is loaded.
+            image.load()
+            duration = image.info.get("duration") or DEFAULT_FRAME_DURATION
+            if index % step:
+                durations[-1] += duration
+                continue
+            durations.append(duration)
+            frame = image.convert("RGBA")
+            frame.thumbnail((sizes[0], sizes[0]))
+            frame = normalize(frame)
+            for size in sizes:
+                frame.thumbnail((size, size))
+                frames[size].append(frame.copy())
+
+    output_format = animation_format()
+    options = {"quality": quality} if output_format == "WEBP" else {"disposal": 2}
+    rendered = {}
+    for size, size_frames in frames.items():
+        thumbnail_io = BytesIO()
+        size_frames[0].save(
+            thumbnail_io,
+            output_format,
+            save_all=True,
+            append_images=size_frames[1:],
+            duration=durations,
+            loop=loop,
+            **options,
+        )
+        thumbnail_io.seek(0)
+        rendered[size] = thumbnail_io
+    return rendered
+
+
+def _raw_stride(tile, mode):
+    rawmode, stride = tile[3][0], tile[3][1]
+    if stride:
+        return stride
+    width = tile[1][2] - tile[1][0]
+    try:
+        return len(PILImage.new(mode, (width, 1)).tobytes("raw", rawmode))
+    except (ValueError, OSError):
+        return None
+
+
+def _can_decode_in_bands(image, band_pixels):
+    return (
+        image.mode in BANDED_MODES
+        and bool(image.tile)
+        and all(
+            tile[0] == "raw" and _raw_stride(tile, image.mode) for tile in image.tile
+        )
+        and image.width <= band_pixels
+    )
+
+
+def _reduction_factor(image, size):
+    return max(1, max(image.size) // (size * REDUCING_GAP))
+
+
+@functools.lru_cache(maxsize=1)
+def _vips():
+    try:
+        import pyvips
+    except (ImportError, OSError):
+        return None
+    return pyvips
+
+
+def check_pixel_budget(image, size, decode_pixels, max_pixels=None):
+    """
+    Check, from the header alone, that an image can be thumbnailed within limits.
+
+    Applies the same JPEG draft mode as ``open_within_budget``, so call it on
+    an image that is not going to be loaded afterwards.
+
+    Args:
+        image (PIL.Image.Image): The image, opened but not loaded.
+        size (int): The largest thumbnail size that will be rendered.
+        decode_pixels (int): The most pixels decoded into memory at once, or
+            None if the resize engine streams.
+        max_pixels (int, optional): The most pixels the image may have.
+
+    Returns:
+        str: How the image is decoded: ``DECODE_FULL`` (possibly at a reduced
+        JPEG scale), ``DECODE_BANDS`` or ``DECODE_VIPS``.
+
+    Raises:
+        ImageTooLarge: If the image has too many pixels, or its format cannot be
+            decoded within ``decode_pixels``.
+    """
+    width, height = image.size
+    if max_pixels is not None and width * height > max_pixels:
+        raise ImageTooLarge(
+            f"The image has {width * height} pixels; at most {max_pixels} are allowed."
+        )
+    if decode_pixels is None or width * height <= decode_pixels:
+        return DECODE_FULL
+    # JPEG decodes straight to 1/2, 1/4 or 1/8 scale.
+    image.draft(image.mode, (size * REDUCING_GAP, size * REDUCING_GAP))
+    if image.width * image.height <= decode_pixels:
+        return DECODE_FULL
+    if _can_decode_in_bands(image, decode_pixels // 2):
+        return DECODE_BANDS
+    if image.format in VIPS_FORMATS and _vips() is not None:
+        return DECODE_VIPS
+    raise ImageTooLarge(
+        f"A {image.format} image of {width}x{height} pixels is too large to process."
+    )
+
+
+def _decode_rows(image, tile, top, bottom, stride):
+    _, (x0, y0, x1, y1), offset, (rawmode, _, *orientation) = tile
+    orientation = orientation[0] if orientation else 1
+    rows = bottom - top
+    # Bottom-up rasters store the last row first.
+    first = top - y0 if orientation >= 0 else y1 - bottom
+    image.fp.seek(offset + first * stride)
+    data = image.fp.read(rows * stride)
+    return PILImage.frombytes(
+        image.mode, (x1 - x0, rows), data, "raw", rawmode, stride, orientation
+    )
+
+
+def _reduce_in_bands(image, size, band_pixels):
+    factor = _reduction_factor(image, size)
+    width, height = image.size
+    band_height = max(factor, band_pixels // width // factor * factor)
+    reduced = PILImage.new(
+        image.mode, (math.ceil(width / factor), math.ceil(height / factor))
+    )
+    tiles = [(tile, _raw_stride(tile, image.mode)) for tile in image.tile]
+    for top in range(0, height, band_height):
+        bottom = min(top + band_height, height)
+        band = PILImage.new(image.mode, (width, bottom - top))
+        for tile, stride in tiles:
+            x0, y0, _, y1 = tile[1]
+            rows = max(top, y0), min(bottom, y1)
+            if rows[0] < rows[1]:
+                band.paste(
+                    _decode_rows(image, tile, *rows, stride), (x0, rows[0] - top)
+                )
+        reduced.paste(band.reduce(factor), (0, top // factor))
+    reduced.info = dict(image.info)
+    return reduced
+
+
+def _decode_with_vips(path, size):
+    """
+    Decode an image through libvips, shrunk to twice the thumbnail size.
+
+    libvips streams the file and shrinks it on the fly, applying the EXIF
+    orientation and converting to sRGB, so the result needs no normalizing.
+
+    Args:
+        path (str): The file path to the image.
+        size (int): The largest thumbnail size that will be rendered.
+
+    Returns:
+        PIL.Image.Image: The downscaled image, without metadata.
+    """
+    target = size * REDUCING_GAP
+    image = _vips().Image.thumbnail(
+        path, target, height=target, size="down", export_profile="srgb"
+    )
+    if image.format != "uchar":
+        # 16-bit PNG and TIFF.
+        image = image.colourspace("b-w" if image.bands < 3 else "srgb")
+    image = image.cast("uchar")
+    mode = VIPS_MODES[image.bands]
+    return PILImage.frombytes(
+        mode, (image.width, image.height), image.write_to_memory()
+    )
+
+
+def open_within_budget(path, size, decode_pixels):
+    """
+    Decode an image for thumbnailing without holding more than a set number of
+    pixels in memory.
+
+    Small images are decoded as usual and JPEGs are decoded at a reduced
+    scale. Larger uncompressed rasters (TIFF, BMP, PPM) are read a band of rows
+    at a time, and each band is box-reduced before the next is read. Larger
+    PNG, WebP, GIF and other TIFF files are decoded through libvips if pyvips
+    is installed.
+
+    Args:
+        path (str): The file path to the image.
+        size (int): The largest thumbnail size that will be rendered.
+        decode_pixels (int): The most pixels decoded into memory at once.
+
+    Returns:
+        PIL.Image.Image: The loaded image, possibly already downscaled.
+
+    Raises:
+        ImageTooLarge: If the image cannot be decoded within the budget.
+    """
+    image = PILImage.open(path)
+    try:
+        decode = check_pixel_budget(image, size, decode_pixels)
+        if decode == DECODE_BANDS:
+            with image:
+                return _reduce_in_bands(image, size, decode_pixels // 2)
+        if decode == DECODE_VIPS:
+            image.close()
+            return _decode_with_vips(path, size)
+        image.load()
+    except Exception:
+        image.close()
+        raise
+    return image
+
+
+def placeholder_data_uri(image, size=PLACEHOLDER_SIZE):
+    """
+    Encode a tiny low-quality preview of the image as an inline data URI.
+
+    Clients render it (stretched and blurred) while the real thumbnail loads,
+    saving a round trip. Pass an already downscaled image: the box reduction
+    then touches only a few thousand pixels.
+
+    Args:
+        image (PIL.Image.Image): The downscaled image.
+        size (int): The longest side of the placeholder in pixels.
+
+    Returns:
+        str: The placeholder as a ``data:`` URI.
+    """
+    preview = image.convert("RGB")
+    preview.thumbnail((size, size), PILImage.Resampling.BOX)
+    preview_io = BytesIO()
+    if features.check("webp"):
+        preview.save(preview_io, "WEBP", quality=PLACEHOLDER_QUALITY)
+        content_type = "image/webp"
+    else:
+        preview.save(preview_io, "JPEG", quality=PLACEHOLDER_QUALITY)
+        content_type = "image/jpeg"
+    encoded = base64.b64encode(preview_io.getvalue()).decode("ascii")
+    return f"data:{content_type};base64,{encoded}"
+
+
+def dhash(image):
+    """
+    Compute the 64-bit difference hash of an image.
+
+    Similar-looking images (re-saved, rescaled or recompressed copies) get
+    hashes a small Hamming distance apart. Pass an already downscaled image:
+    reducing it to 9x8 grey pixels is then nearly free.
+
+    Args:
+        image (PIL.Image.Image): The downscaled image.
+
+    Returns:
+        int: The unsigned hash; bit set where a pixel is brighter than the
+        pixel to its right.
+    """
+    pixels = (
+        image.convert("L")
+        .resize((DHASH_SIZE + 1, DHASH_SIZE), PILImage.Resampling.BOX)
+        .tobytes()
+    )
+    value = 0
+    for row in range(DHASH_SIZE):
+        offset = row * (DHASH_SIZE + 1)
+        for column in range(offset, offset + DHASH_SIZE):
+            value = value << 1 | (pixels[column] > pixels[column + 1])
+    return value
+
+
+def dominant_colours(image, count=PALETTE_SIZE):
+    """
+    Extract the dominant colours and the colour histogram of an image.
+
+    Pixels are counted into 64 bins (4 levels per channel) with vectorized
+    NumPy operations; the colour of a bin is the mean of its pixels. Pass an
+    already downscaled image.
+
+    Args:
+        image (PIL.Image.Image): The downscaled image.
+        count (int): The most colours returned.
+
+    Returns:
+        tuple: The palette, a list of ``(bin, (red, green, blue), share)``
+        tuples by decreasing share, and the histogram as 64 bytes, each the
+        share of its bin scaled to 0-255.
+    """
+    pixels = np.asarray(image.convert("RGB"), dtype=np.uint32).reshape(-1, 3)
+    shift = 8 - (COLOUR_LEVELS - 1).bit_length()
+    levels = pixels >> shift
+    bins = (levels[:, 0] * COLOUR_LEVELS + levels[:, 1]) * COLOUR_LEVELS + levels[:, 2]
+    bin_count = COLOUR_LEVELS**3
+    counts = np.bincount(bins, minlength=bin_count)
+    sums = np.stack(
+        [
+            np.bincount(bins, weights=pixels[:, channel], minlength=bin_count)
+            for channel in range(3)
+        ],
+        axis=1,
+    )
+    shares = counts / len(pixels)
+    top = np.argsort(counts, kind="stable")[::-1][:count]
+    palette = [
+        (
+            int(index),
+            tuple(int(value) for value in np.rint(sums[index] / counts[index])),
+            float(shares[index]),
+        )
+        for index in top
+        if counts[index]
+    ]
+    histogram = np.rint(shares * 255).astype(np.uint8).tobytes()
+    return palette, histogram
+
+
+def compose_sprite(paths, tile_size, quality=SPRITE_QUALITY):
+    """
+    Paste thumbnails into a single grid image.
+
+    Args:
+        paths (list): The file paths to the thumbnails, in grid order.
+        tile_size (int): The side of a grid cell; thumbnails are fitted into it.
+        quality (int): The JPEG quality of the sprite.
+
+    Returns:
+        tuple: The sprite as JPEG bytes and a list of ``(x, y, width, height)``
+        boxes, one per path.
+    """
+    columns = max(1, math.ceil(math.sqrt(len(paths))))
+    rows = max(1, math.ceil(len(paths) / columns))
+    sprite = PILImage.new("RGB", (columns * tile_size, rows * tile_size), "white")
+    boxes = []
+    for index, path in enumerate(paths):
+        x, y = (index % columns) * tile_size, (index // columns) * tile_size
+        with PILImage.open(path) as tile:
+            tile.thumbnail((tile_size, tile_size))
+            sprite.paste(tile.convert("RGB"), (x, y))
+            boxes.append((x, y, tile.width, tile.height))
+    sprite_io = BytesIO()
+    sprite.save(sprite_io, "JPEG", quality=quality)
+    return sprite_io.getvalue(), boxes
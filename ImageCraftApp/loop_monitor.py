@@ -0,0 +1,201 @@
+"""
+Event loop lag and executor saturation monitoring.
+
+A heartbeat coroutine wakes every ``LOOP_MONITOR["INTERVAL"]`` seconds and
+records how late it woke up: that delay is the time other callbacks held
+the loop. A watchdog thread notices when the heartbeat is overdue by more
+than ``LOOP_MONITOR["BLOCKED_THRESHOLD"]`` and, while the loop is still
+blocked, logs the task that is running and the stack of the loop thread,
+which points at the blocking call.
+
+The loop's default executor, which runs ``sync_to_async(...,
+thread_sensitive=False)`` and ``run_in_executor(None, ...)`` calls, is
+replaced with one that records how long calls wait for a thread and how many
+are queued and running.
+
+Everything is exported at /metrics/:
+
+* ``imagecraft_event_loop_lag_seconds`` (histogram) and
+  ``imagecraft_event_loop_last_lag_seconds``
+* ``imagecraft_event_loop_blocked_total``
+* ``imagecraft_executor_wait_seconds`` (histogram)
+* ``imagecraft_executor_queued``, ``imagecraft_executor_busy`` and
+  ``imagecraft_executor_workers``
+* ``imagecraft_sync_request_threads``: requests holding a thread for their
+  synchronous code (asgiref gives each request its own).
+"""
+
+import asyncio
+import logging
+import sys
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from asgiref.sync import SyncToAsync
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+
+
+class MonitoredExecutor(ThreadPoolExecutor):
+    """
+    Thread pool recording how long calls wait for a thread.
+
+    Attributes:
+        workers (int): The most threads the pool starts.
+        queued (int): Calls submitted but not started.
+        busy (int): Calls running.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.workers = self._max_workers
+        self.queued = 0
+        self.busy = 0
+        self._counts_lock = threading.Lock()
+
+    def submit(self, fn, /, *args, **kwargs):
+        submitted = time.monotonic()
+        with self._counts_lock:
+            self.queued += 1
+
+        def run():
+            metrics.observe(
+                "imagecraft_executor_wait_seconds",
+                time.monotonic() - submitted,
+                BUCKETS,
+            )
+            with self._counts_lock:
+                self.queued -= 1
+                self.busy += 1
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                with self._counts_lock:
+                    self.busy -= 1
+
+        try:
+            return super().submit(run)
+        except RuntimeError:
+            with self._counts_lock:
+                self.queued -= 1
+            raise
+
+
+class LoopMonitor:
+    """
+    Monitors one event loop; see the module docstring.
+
+    Attributes:
+        interval (float): Seconds between heartbeats.
+        threshold (float): Lag in seconds past which the loop counts as blocked.
+        executor (MonitoredExecutor): The loop's default executor.
+    """
+
+    def __init__(self, interval, threshold):
+        self.interval = interval
+        self.threshold = threshold
+        self.executor = None
+        self._loop = None
+        self._loop_thread = None
+        self._due = None
+        self._stopped = threading.Event()
+
+    def start(self, loop=None):
+        """
+        Start monitoring; must be called on the loop's thread.
+
+        Args:
+            loop (AbstractEventLoop): The loop; the running one by default.
+        """
+        self._loop = loop or asyncio.get_running_loop()
+        self._loop_thread = threading.get_ident()
+        self.executor = MonitoredExecutor(thread_name_prefix="asyncio")
+        self._loop.set_default_executor(self.executor)
+        self._due = time.monotonic() + self.interval
+        self._heartbeat = self._loop.create_task(self._beat())
+        threading.Thread(target=self._watch, name="loop-monitor", daemon=True).start()
+
+    def stop(self):
+        """
+        Stop the heartbeat and the watchdog.
+        """
+        self._stopped.set()
+        self._loop.call_soon_threadsafe(self._heartbeat.cancel)
+
+    async def _beat(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            lag = max(time.monotonic() - self._due, 0.0)
+            self._due = time.monotonic() + self.interval
+            self.record(lag)
+
+    def record(self, lag):
+        """
+        Record a heartbeat's lag and the executor's state.
+
+        Args:
+            lag (float): How late the heartbeat woke up, in seconds.
+        """
+        metrics.observe("imagecraft_event_loop_lag_seconds", lag, BUCKETS)
+        metrics.set_gauge("imagecraft_event_loop_last_lag_seconds", lag)
+        if lag > self.threshold:
+            metrics.inc("imagecraft_event_loop_blocked_total")
+        metrics.set_gauge("imagecraft_executor_queued", self.executor.queued)
+        metrics.set_gauge("imagecraft_executor_busy", self.executor.busy)
+        metrics.set_gauge("imagecraft_executor_workers", self.executor.workers)
+        metrics.set_gauge(
+            "imagecraft_sync_request_threads",
+            len(SyncToAsync.context_to_thread_executor),
+        )
+
+    def _watch(self):
+        reported = None
+        while not self._stopped.wait(self.threshold / 2):
+            due = self._due
+            blocked_for = time.monotonic() - due
+            if not self._loop.is_running():
+                continue
+            if blocked_for > self.threshold and due != reported:
+                reported = due
+                self.report_blocked(blocked_for)
+
+    def report_blocked(self, blocked_for):
+        """
+        Log what the loop thread is doing while it is blocked.
+
+        Args:
+            blocked_for (float): Seconds the loop has been blocked so far.
+        """
+        frame = sys._current_frames().get(self._loop_thread)
+        if frame is None:
+            return
+        task = asyncio.current_task(self._loop)
+        logger.warning(
+            "Event loop blocked for %.0f ms so far, in %s:\n%s",
+            blocked_for * 1000,
+            task.get_coro().__qualname__ if task is not None else "a callback",
+            "".join(traceback.format_stack(frame)),
+        )
+
+
+_monitor = None
+_monitor_lock = threading.Lock()
+
+
+def ensure_started(config):
+    """
+    Start monitoring the running loop, once per process.
+
+    Args:
+        config (dict): ``settings.LOOP_MONITOR``.
+    """
+    global _monitor
+    with _monitor_lock:
+        if _monitor is not None or not config["ENABLED"]:
+            return
+        _monitor = LoopMonitor(config["INTERVAL"], config["BLOCKED_THRESHOLD"])
+        _monitor.start()
@@ -0,0 +1,77 @@
+import os
+import time
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+from ImageCraftApp.models import Image, UserProfile
+from ImageCraftApp.thumbnails import ensure_variants, missing_variants
+
+
+class Command(BaseCommand):
+    """
+    Generate thumbnail variants missing after subscription plan upgrades.
+
+    Runs at low CPU priority and pauses between images so it can share the
+    host with the web workers. Variants requested by clients in the meantime
+    are rendered lazily by the serializer.
+    """
+
+    help = "Backfill thumbnail variants missing after subscription plan upgrades."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=100,
+            help="Number of images fetched from the database per query.",
+        )
+        parser.add_argument(
+            "--sleep",
+            type=float,
+            default=0.1,
+            help="Seconds to pause after each rendered image.",
+        )
+        parser.add_argument(
+            "--niceness",
+            type=int,
+            default=10,
+            help="Increment added to the process niceness before rendering.",
+        )
+        parser.add_argument(
+            "--limit",
+            type=int,
+            default=None,
+            help="Stop after rendering this many images.",
+        )
+
+    def handle(self, *args, **options):
+        if options["niceness"] and hasattr(os, "nice"):
+            os.nice(options["niceness"])
+
+        plans = {
+            profile.user_id: profile.subscription_plan
+            for profile in UserProfile.objects.select_related(
+                "subscription_plan"
+            ).filter(subscription_plan__premium_thumbnail_size__isnull=False)
+        }
+        images = (
+            Image.objects.filter(user_id__in=plans)
+            .filter(Q(thumbnail_Premium="") | Q(thumbnail_Premium__isnull=True))
+            .order_by("pk")
+        )
+
+        rendered = 0
+        for instance in images.iterator(chunk_size=options["batch_size"]):
+            if options["limit"] is not None and rendered >= options["limit"]:
+                break
+            subscription_plan = plans[instance.user_id]
+            if not missing_variants(instance, subscription_plan):
+                continue
+            try:
+                ensure_variants(instance, subscription_plan)
+            except (OSError, ValueError) as e:
+                self.stderr.write(f"Image {instance.pk}: {e}")
+                continue
+            rendered += 1
+            time.sleep(options["sleep"])
+
+        self.stdout.write(self.style.SUCCESS(f"Backfilled {rendered} image(s)."))
@@ -0,0 +1,53 @@
+import re
+from collections import Counter
+from django.core.management.base import BaseCommand, CommandError
+
+CACHE_STATUS = re.compile(
+    r'"[A-Z]+ (?P<path>\S+)[^"]*" \d{3} \S+ cache=(?P<status>\S+)'
+)
+# Statuses of responses nginx answered from its cache without a full upstream
+# round trip.
+SERVED_FROM_CACHE = {"HIT", "STALE", "UPDATING", "REVALIDATED"}
+
+
+class Command(BaseCommand):
+    """
+    Report the hit ratio of the nginx serve-image cache from its access log.
+
+    Reads lines written with the ``cache`` log format of the shipped nginx
+    config. Requests to locations without a cache are ignored.
+    """
+
+    help = "Report the nginx serve-image cache hit ratio from an access log."
+
+    def add_arguments(self, parser):
+        parser.add_argument("log_file", help="Path of the nginx access log.")
+        parser.add_argument(
+            "--prefix",
+            default="/serve-image/",
+            help="Only count requests whose path starts with this prefix.",
+        )
+
+    def handle(self, *args, **options):
+        statuses = Counter()
+        try:
+            with open(options["log_file"], errors="replace") as log:
+                for line in log:
+                    match = CACHE_STATUS.search(line)
+                    if (
+                        match
+                        and match["status"] != "-"
+                        and match["path"].startswith(options["prefix"])
+                    ):
+                        statuses[match["status"]] += 1
+        except OSError as e:
+            raise CommandError(f"Could not read {options['log_file']}: {e}")
+
+        total = sum(statuses.values())
+        if not total:
+            self.stdout.write("No cached requests found.")
+            return
+        for status, count in statuses.most_common():
+            self.stdout.write(f"{status:<12}{count:>10}")
+        hits = sum(statuses[status] for status in SERVED_FROM_CACHE)
+        self.stdout.write(f"Hit ratio: {hits / total:.1%} of {total} requests")
@@ -0,0 +1,45 @@
+from django.core.management.base import BaseCommand
+from PIL import Image as PILImage
+from ImageCraftApp import colours
+from ImageCraftApp.imaging import dominant_colours
+from ImageCraftApp.models import Image
+
+
+class Command(BaseCommand):
+    """
+    Extract the dominant colours of images uploaded before they were stored.
+
+    Colours are extracted from the stored Basic thumbnails, so no original is
+    decoded. Images without a Basic thumbnail get them when it is rendered.
+    """
+
+    help = "Extract missing dominant colours from the Basic thumbnails."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=500,
+            help="Number of images fetched from the database per query.",
+        )
+
+    def handle(self, *args, **options):
+        images = (
+            Image.objects.filter(colour_histogram__isnull=True)
+            .exclude(thumbnail_Basic="")
+            .exclude(thumbnail_Basic__isnull=True)
+            .only("pk", "user_id", "thumbnail_Basic")
+            .order_by("pk")
+        )
+        extracted = 0
+        for image in images.iterator(chunk_size=options["batch_size"]):
+            try:
+                with PILImage.open(image.thumbnail_Basic.path) as thumbnail:
+                    palette, histogram = dominant_colours(thumbnail)
+            except OSError as exc:
+                self.stderr.write(f"Image {image.pk}: {exc}")
+                continue
+            Image.objects.filter(pk=image.pk).update(colour_histogram=histogram)
+            colours.store(image, palette)
+            extracted += 1
+        self.stdout.write(f"Extracted the colours of {extracted} images.")
@@ -0,0 +1,44 @@
+from django.core.management.base import BaseCommand
+from PIL import Image as PILImage
+from ImageCraftApp.duplicates import hash_fields
+from ImageCraftApp.imaging import dhash
+from ImageCraftApp.models import Image
+
+
+class Command(BaseCommand):
+    """
+    Compute the perceptual hashes of images uploaded before they were stored.
+
+    Hashes are computed from the stored Basic thumbnails, so no original is
+    decoded. Images without a Basic thumbnail are hashed when it is rendered.
+    """
+
+    help = "Compute missing perceptual hashes from the Basic thumbnails."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=500,
+            help="Number of images fetched from the database per query.",
+        )
+
+    def handle(self, *args, **options):
+        images = (
+            Image.objects.filter(phash__isnull=True)
+            .exclude(thumbnail_Basic="")
+            .exclude(thumbnail_Basic__isnull=True)
+            .only("pk", "thumbnail_Basic")
+            .order_by("pk")
+        )
+        hashed = 0
+        for image in images.iterator(chunk_size=options["batch_size"]):
+            try:
+                with PILImage.open(image.thumbnail_Basic.path) as thumbnail:
+                    fields = hash_fields(dhash(thumbnail))
+            except OSError as exc:
+                self.stderr.write(f"Image {image.pk}: {exc}")
+                continue
+            Image.objects.filter(pk=image.pk).update(**fields)
+            hashed += 1
+        self.stdout.write(f"Hashed {hashed} images.")
@@ -0,0 +1,31 @@
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from ImageCraftApp.profiling import RESPONSE_HEADER, make_token
+
+
+class Command(BaseCommand):
+    """
+    Issue a token that turns on profiling for the requests carrying it.
+
+    Tokens are signed with the secret key and name the staff member they were
+    issued to, which is logged with every profile taken.
+    """
+
+    help = "Issue a request profiling token for a staff member."
+
+    def add_arguments(self, parser):
+        parser.add_argument("username", help="The staff member the token is for.")
+
+    def handle(self, *args, **options):
+        if not User.objects.filter(
+            username=options["username"], is_staff=True
+        ).exists():
+            raise CommandError(f"{options['username']} is not a staff member.")
+        token = make_token(options["username"])
+        self.stdout.write(token)
+        self.stderr.write(
+            f"Send it as the {RESPONSE_HEADER} header or the profile query "
+            f"parameter within {settings.PROFILER['TOKEN_MAX_AGE']} seconds. "
+            f"Profiles are written to {settings.PROFILER['DIR']}."
+        )
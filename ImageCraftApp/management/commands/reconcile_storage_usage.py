@@ -0,0 +1,55 @@
+from django.core.management.base import BaseCommand
+from ImageCraftApp.models import Image, UserProfile
+from ImageCraftApp.usage import USAGE_FIELDS, image_usage, record
+
+COUNTERS = ["image_count", *USAGE_FIELDS.values()]
+
+
+class Command(BaseCommand):
+    """
+    Recompute storage usage from the stored files and repair drifted counters.
+
+    Each user's counters are read just before their files are measured and
+    corrected by the difference, so uploads that land meanwhile are not lost.
+    """
+
+    help = "Repair per-user storage usage counters from the stored files."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Report drift without changing any counters.",
+        )
+
+    def handle(self, *args, **options):
+        repaired = 0
+        profiles = UserProfile.objects.exclude(user=None).order_by("pk")
+        for profile in profiles.iterator():
+            recorded = dict(
+                zip(
+                    COUNTERS,
+                    UserProfile.objects.filter(pk=profile.pk).values_list(*COUNTERS)[0],
+                )
+            )
+            actual = dict.fromkeys(COUNTERS, 0)
+            for image in Image.objects.filter(user_id=profile.user_id).iterator():
+                actual["image_count"] += 1
+                for counter, size in image_usage(image).items():
+                    actual[counter] += size
+
+            drift = {
+                counter: actual[counter] - recorded[counter]
+                for counter in COUNTERS
+                if actual[counter] != recorded[counter]
+            }
+            if not drift:
+                continue
+            repaired += 1
+            self.stdout.write(f"User {profile.user_id}: {drift}")
+            if not options["dry_run"]:
+                images = drift.pop("image_count", 0)
+                record(profile.user_id, images=images, **drift)
+
+        verb = "Found" if options["dry_run"] else "Repaired"
+        self.stdout.write(f"{verb} drift for {repaired} users.")
@@ -0,0 +1,185 @@
+import io
+import json
+import random
+from datetime import timedelta
+from importlib import import_module
+from django.conf import settings
+from django.contrib.auth import BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY
+from django.contrib.auth.models import User
+from django.core.files.base import ContentFile
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from PIL import Image as PILImage
+from ImageCraftApp.models import CustomSubscriptionPlan, Image, UserProfile
+from ImageCraftApp.signals import create_subscription_plan
+from ImageCraftApp.thumbnails import generate_variants, variant_sizes
+
+PLANS = ["Basic", "Premium", "Enterprise"]
+
+
+def make_jpeg(size, seed):
+    """
+    Draw a JPEG with blocks of random colours, distinct for every seed.
+
+    Args:
+        size (tuple): The width and height.
+        seed (str): The random seed.
+
+    Returns:
+        bytes: The encoded image.
+    """
+    rng = random.Random(seed)
+    image = PILImage.new("RGB", size)
+    block = max(size) // 8 or 1
+    for x in range(0, size[0], block):
+        for y in range(0, size[1], block):
+            colour = tuple(rng.randrange(256) for _ in range(3))
+            image.paste(colour, (x, y, x + block, y + block))
+    buffer = io.BytesIO()
+    image.save(buffer, "JPEG", quality=85)
+    return buffer.getvalue()
+
+
+def served_variants(plan):
+    """
+    Get the serve-image variants a plan is entitled to.
+
+    Args:
+        plan (CustomSubscriptionPlan): The plan.
+
+    Returns:
+        list: The variant names.
+    """
+    variants = ["Basic"]
+    if plan.premium_thumbnail_size:
+        variants.append("Premium")
+    if plan.original_file:
+        variants.append("original")
+    return variants
+
+
+def create_session(user):
+    """
+    Log a user in on a new session, as the login view would.
+
+    Args:
+        user (User): The user.
+
+    Returns:
+        str: The session key, the value of the session cookie.
+    """
+    session = import_module(settings.SESSION_ENGINE).SessionStore()
+    session[SESSION_KEY] = str(user.pk)
+    session[BACKEND_SESSION_KEY] = "django.contrib.auth.backends.ModelBackend"
+    session[HASH_SESSION_KEY] = user.get_session_auth_hash()
+    session.create()
+    return session.session_key
+
+
+class Command(BaseCommand):
+    """
+    Create users on every subscription plan, with images, for load tests.
+
+    The default plans are created if there are none. Users are named
+    ``<prefix>-<plan>-<n>`` and reused when they exist, so the command can be
+    rerun; missing images are topped up. Every user also gets images whose
+    links have already expired. The credentials and image IDs are written to
+    stdout as JSON, with a logged-in session per user so that clients need not
+    send the password (and pay for hashing it) on every request.
+    ``benchmarks/load_test.py`` reads it.
+    """
+
+    help = "Create load-test users on every subscription plan and print them as JSON."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--plans",
+            default=",".join(PLANS),
+            help="Comma-separated subscription plan names.",
+        )
+        parser.add_argument(
+            "--users-per-plan",
+            type=int,
+            default=2,
+            help="Number of users seeded on each plan.",
+        )
+        parser.add_argument(
+            "--images",
+            type=int,
+            default=5,
+            help="Number of images with valid links per user.",
+        )
+        parser.add_argument(
+            "--expired-images",
+            type=int,
+            default=1,
+            help="Number of images with expired links per user.",
+        )
+        parser.add_argument(
+            "--size",
+            default="1600x1200",
+            help="Dimensions of the seeded images, as WIDTHxHEIGHT.",
+        )
+        parser.add_argument("--prefix", default="loadtest")
+        parser.add_argument("--password", default="loadtest-password")
+
+    def get_plan(self, name):
+        if not CustomSubscriptionPlan.objects.exists():
+            create_subscription_plan()
+        plan = CustomSubscriptionPlan.objects.filter(name=name).first()
+        if plan is None:
+            raise CommandError(f"There is no subscription plan named {name!r}.")
+        return plan
+
+    def seed_images(self, user, plan, count, expired, size):
+        existing = list(
+            Image.objects.filter(
+                user=user, title__startswith="expired" if expired else "load"
+            )
+            .order_by("pk")
+            .values_list("pk", flat=True)
+        )
+        for index in range(len(existing), count):
+            title = f"{'expired' if expired else 'load'}-{index}"
+            image = Image(title=title, user=user, link_expiration_time=30000)
+            if expired:
+                image.expiration_date = timezone.now() - timedelta(days=1)
+            image.image.save(
+                f"{user.username}-{title}.jpg",
+                ContentFile(make_jpeg(size, f"{user.username}-{title}")),
+            )
+            generate_variants(image, variant_sizes(plan))
+            existing.append(image.pk)
+        return existing[:count]
+
+    def handle(self, *args, **options):
+        size = tuple(int(value) for value in options["size"].split("x"))
+        users = []
+        for plan_name in options["plans"].split(","):
+            plan = self.get_plan(plan_name)
+            for number in range(options["users_per_plan"]):
+                username = f"{options['prefix']}-{plan_name.lower()}-{number}"
+                user, _ = User.objects.get_or_create(username=username)
+                user.set_password(options["password"])
+                user.save()
+                UserProfile.objects.update_or_create(
+                    user=user, defaults={"subscription_plan": plan}
+                )
+                users.append(
+                    {
+                        "username": username,
+                        "password": options["password"],
+                        "session": create_session(user),
+                        "plan": plan.name,
+                        "variants": served_variants(plan),
+                        "images": self.seed_images(
+                            user, plan, options["images"], False, size
+                        ),
+                        "expired_images": self.seed_images(
+                            user, plan, options["expired_images"], True, size
+                        ),
+                        # Plans with expiring links may serve expired links.
+                        "expired_status": 200 if plan.expiring_links else 403,
+                    }
+                )
+        self.stdout.write(json.dumps({"users": users}, indent=2))
@@ -0,0 +1,206 @@
+import os
+import shutil
+import time
+import uuid
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Q
+from ImageCraftApp import serve_index
+from ImageCraftApp.models import Image
+from ImageCraftApp.storage import SHARDED_NAME, is_sharded
+
+FIELDS = list(serve_index.VARIANT_FIELDS.values())
+
+
+def unsharded():
+    """
+    Get the images with a file outside the sharded layout, or no storage key.
+
+    Returns:
+        QuerySet: The images.
+    """
+    condition = Q(storage_key__isnull=True)
+    for field_name in FIELDS:
+        condition |= Q(**{f"{field_name}__gt": ""}) & ~Q(
+            **{f"{field_name}__regex": SHARDED_NAME.pattern}
+        )
+    return Image.objects.filter(condition)
+
+
+def link(source, target):
+    """
+    Give a file a second name, copying it where hard links are not possible.
+
+    Args:
+        source (str): The path of the file.
+        target (str): The new path; replaced if it exists.
+
+    Raises:
+        FileNotFoundError: If the file does not exist.
+    """
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    try:
+        os.link(source, target)
+    except FileExistsError:
+        # Left by an interrupted run.
+        os.remove(target)
+        os.link(source, target)
+    except FileNotFoundError:
+        raise
+    except OSError:
+        # Across file systems, or where hard links are not supported.
+        shutil.copy2(source, target)
+
+
+class Command(BaseCommand):
+    """
+    Move image files from the flat ``images/`` directory to the sharded layout.
+
+    Runs while the app serves. Each file is first linked under its new name,
+    then the image row is switched to the new names with an UPDATE that only
+    matches if the row still holds the old ones, so files re-rendered in the
+    meantime are never lost; such images are left for a later run. Rows are
+    updated a batch per transaction, and the old names are only deleted
+    after the next batch, once requests that looked them up have finished.
+    Interrupted runs pick up where they stopped.
+    """
+
+    help = "Move image files from the flat images/ directory to the sharded layout."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=100,
+            help="Number of images moved per transaction.",
+        )
+        parser.add_argument(
+            "--sleep",
+            type=float,
+            default=0.5,
+            help="Seconds to pause after each batch.",
+        )
+        parser.add_argument(
+            "--limit",
+            type=int,
+            default=None,
+            help="Stop after moving this many images.",
+        )
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Only count the images left to move.",
+        )
+
+    def link_files(self, image, storage):
+        """
+        Link the files of an image under their sharded names.
+
+        Args:
+            image (Image): The image, with its key set.
+            storage (Storage): The media storage.
+
+        Returns:
+            dict: Mapping of Image field name to the old and the new name of
+            every linked file.
+        """
+        renamed = {}
+        for field_name in FIELDS:
+            old_name = getattr(image, field_name).name
+            if not old_name or is_sharded(old_name):
+                continue
+            field = Image._meta.get_field(field_name)
+            new_name = field.upload_to(image, os.path.basename(old_name))
+            try:
+                link(storage.path(old_name), storage.path(new_name))
+            except FileNotFoundError:
+                self.stderr.write(f"Image {image.pk}: {old_name} is missing.")
+                continue
+            renamed[field_name] = (old_name, new_name)
+        return renamed
+
+    def switch(self, image, loaded_key, renamed):
+        """
+        Point an image row at the new names, if it still holds the old ones.
+
+        Args:
+            image (Image): The image, with its new key set.
+            loaded_key (UUID): The key the row held, or None.
+            renamed (dict): What ``link_files`` returned.
+
+        Returns:
+            bool: Whether the row was updated.
+        """
+        matches = {field_name: old for field_name, (old, _) in renamed.items()}
+        if loaded_key is None:
+            matches["storage_key__isnull"] = True
+        else:
+            matches["storage_key"] = loaded_key
+        updates = {field_name: new for field_name, (_, new) in renamed.items()}
+        return bool(
+            Image.objects.filter(pk=image.pk, **matches).update(
+                storage_key=image.storage_key, **updates
+            )
+        )
+
+    def discard(self, image, renamed, storage):
+        """
+        Delete the new names of an image whose row changed while moving,
+        unless the row now uses them.
+        """
+        current = Image.objects.filter(pk=image.pk).values_list(*FIELDS).first() or ()
+        for _, new_name in renamed.values():
+            if new_name not in current:
+                storage.delete(new_name)
+
+    def handle(self, *args, **options):
+        images = unsharded().only("pk", "storage_key", *FIELDS).order_by("pk")
+        if options["dry_run"]:
+            self.stdout.write(f"{images.count()} image(s) to move.")
+            return
+
+        storage = Image._meta.get_field("image").storage
+        moved = skipped = 0
+        last_pk = 0
+        retired = []
+        while options["limit"] is None or moved < options["limit"]:
+            batch_size = options["batch_size"]
+            if options["limit"] is not None:
+                batch_size = min(batch_size, options["limit"] - moved)
+            batch = list(images.filter(pk__gt=last_pk)[:batch_size])
+            if not batch:
+                break
+            last_pk = batch[-1].pk
+
+            linked = []
+            for image in batch:
+                loaded_key = image.storage_key
+                image.storage_key = loaded_key or uuid.uuid4()
+                linked.append((image, loaded_key, self.link_files(image, storage)))
+            switched = []
+            with transaction.atomic():
+                for image, loaded_key, renamed in linked:
+                    if self.switch(image, loaded_key, renamed):
+                        switched.append(renamed)
+                        transaction.on_commit(
+                            lambda pk=image.pk: serve_index.invalidate(pk)
+                        )
+                    else:
+                        self.discard(image, renamed, storage)
+                        skipped += 1
+            moved += len(switched)
+
+            # The previous batch's old names have been unreferenced for a
+            # whole batch by now.
+            for name in retired:
+                storage.delete(name)
+            retired = [old for renamed in switched for old, _ in renamed.values()]
+            time.sleep(options["sleep"])
+        for name in retired:
+            storage.delete(name)
+
+        self.stdout.write(self.style.SUCCESS(f"Moved {moved} image(s)."))
+        if skipped:
+            self.stdout.write(
+                f"Skipped {skipped} image(s) changed while moving; run it again."
+            )
@@ -0,0 +1,115 @@
+import time
+from datetime import timedelta
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from ImageCraftApp.models import Image
+from ImageCraftApp.tiering import COLD_PREFIX, cold_name, move_original
+
+
+def cold_candidates(days):
+    """
+    Get the images whose original is hot but not served for a number of days.
+
+    Images never served count from their upload.
+
+    Args:
+        days (int): The days without a serve.
+
+    Returns:
+        QuerySet: The images.
+    """
+    cutoff = timezone.now() - timedelta(days=days)
+    return (
+        Image.objects.alias(last_served=Coalesce("original_served_at", "created_at"))
+        .filter(last_served__lt=cutoff)
+        .exclude(Q(image="") | Q(image__startswith=COLD_PREFIX))
+    )
+
+
+class Command(BaseCommand):
+    """
+    Move originals not served for a while to the cold storage tier.
+
+    Runs while the app serves; see ImageCraftApp.tiering. Each original is
+    copied to the cold tier, and the image row is switched to the cold name
+    only if it still holds the hot one. The hot copies are deleted after the
+    next batch, once requests that looked them up have finished.
+    """
+
+    help = "Move originals not served for a while to the cold storage tier."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--days",
+            type=int,
+            default=None,
+            help="Days without a serve after which an original is moved "
+            "(default STORAGE_TIERS['COLD_AFTER_DAYS']).",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=100,
+            help="Number of images fetched from the database per query.",
+        )
+        parser.add_argument(
+            "--sleep",
+            type=float,
+            default=0.5,
+            help="Seconds to pause after each batch.",
+        )
+        parser.add_argument(
+            "--limit",
+            type=int,
+            default=None,
+            help="Stop after moving this many originals.",
+        )
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Only count the originals to move.",
+        )
+
+    def handle(self, *args, **options):
+        days = options["days"]
+        if days is None:
+            days = settings.STORAGE_TIERS["COLD_AFTER_DAYS"]
+        images = cold_candidates(days).order_by("pk").values_list("pk", "image")
+        if options["dry_run"]:
+            self.stdout.write(f"{images.count()} original(s) to move.")
+            return
+
+        storage = Image._meta.get_field("image").storage
+        moved = 0
+        last_pk = 0
+        retired = []
+        while options["limit"] is None or moved < options["limit"]:
+            batch = list(images.filter(pk__gt=last_pk)[: options["batch_size"]])
+            if not batch:
+                break
+            last_pk = batch[-1][0]
+            demoted = []
+            for pk, name in batch:
+                if options["limit"] is not None and moved >= options["limit"]:
+                    break
+                try:
+                    if move_original(pk, name, cold_name(name)):
+                        demoted.append(name)
+                        moved += 1
+                except OSError as exc:
+                    self.stderr.write(f"Image {pk}: {exc}")
+            # The previous batch's hot copies have been unreferenced for a
+            # whole batch by now.
+            for name in retired:
+                storage.delete(name)
+            retired = demoted
+            time.sleep(options["sleep"])
+        for name in retired:
+            storage.delete(name)
+
+        self.stdout.write(
+            self.style.SUCCESS(f"Moved {moved} original(s) to the cold tier.")
+        )
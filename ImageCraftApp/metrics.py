@@ -0,0 +1,196 @@
+import json
+import os
+import threading
+from collections import defaultdict
+from django.conf import settings
+
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+
+def _format(name, labels, value):
+    if labels:
+        rendered = ",".join(f'{label}="{text}"' for label, text in labels)
+        name = f"{name}{{{rendered}}}"
+    return f"{name} {value:g}"
+
+
+class Metrics:
+    """
+    In-process counters, gauges and histograms rendered in the Prometheus
+    text format.
+
+    With ``settings.METRICS_DIR`` set (gunicorn sets it for its workers), each
+    process periodically writes a snapshot to ``<pid>.json`` in that directory
+    and ``render`` merges the snapshots of all workers, so any worker can
+    answer a scrape. Counters of exited workers are kept by
+    ``mark_process_dead``; their gauges are dropped.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = defaultdict(float)
+        self._gauges = {}
+
+    def inc(self, name, value=1, **labels):
+        """
+        Increase a counter.
+
+        Args:
+            name (str): The metric name.
+            value (float): The amount to add.
+            labels: The metric labels.
+        """
+        with self._lock:
+            self._counters[_key(name, labels)] += value
+
+    def set_gauge(self, name, value, **labels):
+        """
+        Set a gauge to the given value.
+
+        Args:
+            name (str): The metric name.
+            value (float): The current value.
+            labels: The metric labels.
+        """
+        with self._lock:
+            self._gauges[_key(name, labels)] = value
+
+    def observe(self, name, value, buckets, **labels):
+        """
+        Record an observation in a histogram.
+
+        The histogram is kept as counters (``<name>_bucket`` per upper bound,
+        ``<name>_sum`` and ``<name>_count``), so it merges across processes
+        like any other counter.
+
+        Args:
+            name (str): The metric name.
+            value (float): The observed value.
+            buckets (tuple): The bucket upper bounds, ascending.
+            labels: The metric labels.
+        """
+        with self._lock:
+            for bound in (*buckets, float("inf")):
+                le = "+Inf" if bound == float("inf") else f"{bound:g}"
+                bucket = _key(f"{name}_bucket", {**labels, "le": le})
+                self._counters[bucket] += value <= bound
+            self._counters[_key(f"{name}_sum", labels)] += value
+            self._counters[_key(f"{name}_count", labels)] += 1
+
+    def snapshot(self):
+        """
+        Get the current values of this process.
+
+        Returns:
+            dict: Lists of ``[name, labels, value]`` under ``counters`` and ``gauges``.
+        """
+        with self._lock:
+            return {
+                kind: [[name, list(labels), value] for (name, labels), value in values]
+                for kind, values in (
+                    ("counters", self._counters.items()),
+                    ("gauges", self._gauges.items()),
+                )
+            }
+
+    def flush(self):
+        """
+        Write this process's snapshot to the metrics directory, if configured.
+        """
+        directory = getattr(settings, "METRICS_DIR", None)
+        if not directory:
+            return
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"{os.getpid()}.json")
+        with open(f"{path}.tmp", "w") as f:
+            json.dump(self.snapshot(), f)
+        os.replace(f"{path}.tmp", path)
+
+    def _snapshots(self):
+        directory = getattr(settings, "METRICS_DIR", None)
+        if not directory:
+            return [(str(os.getpid()), self.snapshot())]
+        self.flush()
+        snapshots = []
+        for filename in sorted(os.listdir(directory)):
+            if not filename.endswith(".json"):
+                continue
+            try:
+                with open(os.path.join(directory, filename)) as f:
+                    snapshots.append((filename[:-5], json.load(f)))
+            except (OSError, ValueError):
+                continue
+        return snapshots
+
+    def render(self):
+        """
+        Render the metrics of all processes.
+
+        Counters are summed across processes; gauges get a ``pid`` label.
+
+        Returns:
+            str: The metrics in the Prometheus text exposition format.
+        """
+        counters = defaultdict(float)
+        gauges = {}
+        for pid, snapshot in self._snapshots():
+            for name, labels, value in snapshot["counters"]:
+                counters[(name, tuple(map(tuple, labels)))] += value
+            for name, labels, value in snapshot["gauges"]:
+                labels = tuple(sorted([*map(tuple, labels), ("pid", pid)]))
+                gauges[(name, labels)] = value
+
+        histograms = {
+            name[: -len("_bucket")] for name, _ in counters if name.endswith("_bucket")
+        }
+        lines = []
+        for kind, values in (("counter", counters), ("gauge", gauges)):
+            typed = set()
+            for (name, labels), value in sorted(values.items()):
+                family, family_kind = name, kind
+                base, _, suffix = name.rpartition("_")
+                if base in histograms and suffix in ("bucket", "sum", "count"):
+                    family, family_kind = base, "histogram"
+                if family not in typed:
+                    lines.append(f"# TYPE {family} {family_kind}")
+                    typed.add(family)
+                lines.append(_format(name, labels, value))
+        return "\n".join(lines) + "\n"
+
+
+def mark_process_dead(pid, directory):
+    """
+    Fold the counters of an exited process into the archive and drop its gauges.
+
+    Args:
+        pid (int): The process ID of the exited worker.
+        directory (str): The metrics directory.
+    """
+    path = os.path.join(directory, f"{pid}.json")
+    archive_path = os.path.join(directory, "archive.json")
+    try:
+        with open(path) as f:
+            counters = json.load(f)["counters"]
+    except (OSError, ValueError):
+        return
+    try:
+        with open(archive_path) as f:
+            archive = json.load(f)
+    except (OSError, ValueError):
+        archive = {"counters": [], "gauges": []}
+
+    merged = defaultdict(float)
+    for name, labels, value in archive["counters"] + counters:
+        merged[(name, tuple(map(tuple, labels)))] += value
+    archive["counters"] = [
+        [name, list(labels), value] for (name, labels), value in merged.items()
+    ]
+    with open(f"{archive_path}.tmp", "w") as f:
+        json.dump(archive, f)
+    os.replace(f"{archive_path}.tmp", archive_path)
+    os.remove(path)
+
+
+metrics = Metrics()
@@ -0,0 +1,133 @@
+import asyncio
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from . import loop_monitor, profiling
+
+# Scope key of the asyncio.Event set once the client has disconnected.
+DISCONNECT_SCOPE_KEY = "imagecraft.disconnected"
+
+
+def client_disconnected(request):
+    """
+    Check whether the client of a request has gone away.
+
+    Args:
+        request: The HTTP request.
+
+    Returns:
+        bool: True once ClientDisconnectMiddleware saw the client disconnect;
+        always False outside ASGI.
+    """
+    scope = getattr(request, "scope", None) or {}
+    disconnected = scope.get(DISCONNECT_SCOPE_KEY)
+    return disconnected is not None and disconnected.is_set()
+
+
+class ClientDisconnectMiddleware:
+    """
+    ASGI middleware exposing client disconnects to streaming responses.
+
+    Django reads the request body and never calls ``receive`` again, so a
+    streaming response keeps producing data for a client that has gone away.
+    Once the body is read, this middleware keeps listening for
+    ``http.disconnect`` and sets an asyncio.Event stored in the scope, which
+    views check through ``client_disconnected``.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        disconnected = asyncio.Event()
+        scope[DISCONNECT_SCOPE_KEY] = disconnected
+        watcher = None
+
+        async def watch():
+            while True:
+                message = await receive()
+                if message["type"] == "http.disconnect":
+                    disconnected.set()
+                    return
+
+        async def receive_body():
+            nonlocal watcher
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                disconnected.set()
+            elif not message.get("more_body", False) and watcher is None:
+                watcher = asyncio.ensure_future(watch())
+            return message
+
+        try:
+            await self.app(scope, receive_body, send)
+        finally:
+            if watcher is not None:
+                watcher.cancel()
+
+
+class LoopMonitorMiddleware:
+    """
+    ASGI middleware starting the event loop monitor of ImageCraftApp.loop_monitor.
+
+    The monitor needs the worker's running loop, which exists only once the
+    server calls the application, so it is started on the first request.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.started = False
+
+    async def __call__(self, scope, receive, send):
+        if not self.started:
+            self.started = True
+            loop_monitor.ensure_started(settings.LOOP_MONITOR)
+        return await self.app(scope, receive, send)
+
+
+class ProfilingMiddleware:
+    """
+    Profile requests asked for by staff, and a random sample of the others.
+
+    See ImageCraftApp.profiling. Works in both sync and async chains, so it
+    never adds a thread switch. Placed after AuthenticationMiddleware so that
+    signed-in staff can use ``?profile=1``. Streaming responses are profiled
+    until their headers are ready.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        reason = profiling.should_profile(request)
+        profile = reason and profiling.start(request, reason)
+        if not profile:
+            return self.get_response(request)
+        response = None
+        try:
+            response = self.get_response(request)
+        finally:
+            profiling.finish(profile, response)
+        return response
+
+    async def __acall__(self, request):
+        reason = profiling.should_profile(request)
+        profile = reason and profiling.start(request, reason)
+        if not profile:
+            return await self.get_response(request)
+        response = None
+        try:
+            response = await self.get_response(request)
+        finally:
+            profiling.finish(profile, response)
+        return response
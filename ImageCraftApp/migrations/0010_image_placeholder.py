@@ -0,0 +1,17 @@
+# Generated by Django 4.2.5 on 2026-10-19 02:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("ImageCraftApp", "0009_alter_image_thumbnail_basic_and_more"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="image",
+            name="placeholder",
+            field=models.TextField(blank=True, default=""),
+        ),
+    ]
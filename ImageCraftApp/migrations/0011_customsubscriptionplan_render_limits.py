@@ -0,0 +1,22 @@
+# Generated by Django 4.2.5 on 2026-10-19 02:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("ImageCraftApp", "0010_image_placeholder"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="customsubscriptionplan",
+            name="max_concurrent_renders",
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="customsubscriptionplan",
+            name="max_queued_renders",
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+    ]
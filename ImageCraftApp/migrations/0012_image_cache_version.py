@@ -0,0 +1,17 @@
+# Generated by Django 4.2.5 on 2026-10-19 02:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("ImageCraftApp", "0011_customsubscriptionplan_render_limits"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="image",
+            name="cache_version",
+            field=models.PositiveIntegerField(default=1),
+        ),
+    ]
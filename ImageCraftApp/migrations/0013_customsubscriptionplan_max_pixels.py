@@ -0,0 +1,17 @@
+# Generated by Django 4.2.5 on 2026-10-19 02:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("ImageCraftApp", "0012_image_cache_version"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="customsubscriptionplan",
+            name="max_pixels",
+            field=models.PositiveBigIntegerField(blank=True, null=True),
+        ),
+    ]
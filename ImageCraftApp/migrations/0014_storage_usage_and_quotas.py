@@ -0,0 +1,42 @@
+# Generated by Django 4.2.5 on 2026-10-19 02:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("ImageCraftApp", "0013_customsubscriptionplan_max_pixels"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="customsubscriptionplan",
+            name="max_images",
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="customsubscriptionplan",
+            name="max_storage_bytes",
+            field=models.PositiveBigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="userprofile",
+            name="image_count",
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="userprofile",
+            name="original_bytes",
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="userprofile",
+            name="thumbnail_basic_bytes",
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="userprofile",
+            name="thumbnail_premium_bytes",
+            field=models.BigIntegerField(default=0),
+        ),
+    ]
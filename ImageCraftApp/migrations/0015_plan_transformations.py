@@ -0,0 +1,22 @@
+# Generated by Django 4.2.5 on 2026-10-19 02:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("ImageCraftApp", "0014_storage_usage_and_quotas"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="customsubscriptionplan",
+            name="max_transform_size",
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="customsubscriptionplan",
+            name="transformations",
+            field=models.BooleanField(default=False),
+        ),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 4.2.5 on 2026-10-19 02:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("ImageCraftApp", "0015_plan_transformations"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="image",
+            name="phash",
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="image",
+            name="phash_0",
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="image",
+            name="phash_1",
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="image",
+            name="phash_2",
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="image",
+            name="phash_3",
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name="image",
+            index=models.Index(fields=["user", "phash_0"], name="image_user_phash_0"),
+        ),
+        migrations.AddIndex(
+            model_name="image",
+            index=models.Index(fields=["user", "phash_1"], name="image_user_phash_1"),
+        ),
+        migrations.AddIndex(
+            model_name="image",
+            index=models.Index(fields=["user", "phash_2"], name="image_user_phash_2"),
+        ),
+        migrations.AddIndex(
+            model_name="image",
+            index=models.Index(fields=["user", "phash_3"], name="image_user_phash_3"),
+        ),
+    ]
@@ -0,0 +1,62 @@
+# Generated by Django 4.2.5 on 2026-10-19 02:43
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ("ImageCraftApp", "0016_image_perceptual_hash"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="image",
+            name="colour_histogram",
+            field=models.BinaryField(blank=True, null=True),
+        ),
+        migrations.CreateModel(
+            name="ImageColour",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("bin", models.PositiveSmallIntegerField()),
+                ("rgb", models.PositiveIntegerField()),
+                ("share", models.FloatField()),
+                (
+                    "image",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="colours",
+                        to="ImageCraftApp.image",
+                    ),
+                ),
+                (
+                    "user",
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        fields=["user", "bin", "share"],
+                        name="ImageCraftA_user_id_e71312_idx",
+                    )
+                ],
+            },
+        ),
+    ]
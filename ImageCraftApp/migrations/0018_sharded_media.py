@@ -0,0 +1,53 @@
+# Generated by Django 4.2.5 on 2026-10-19 03:13
+
+import ImageCraftApp.storage
+from django.db import migrations, models
+import uuid
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("ImageCraftApp", "0017_dominant_colours"),
+    ]
+
+    operations = [
+        # Added without a default first, so that existing images are left
+        # without a key for shard_media instead of all sharing one.
+        migrations.AddField(
+            model_name="image",
+            name="storage_key",
+            field=models.UUIDField(blank=True, editable=False, null=True),
+        ),
+        migrations.AlterField(
+            model_name="image",
+            name="storage_key",
+            field=models.UUIDField(
+                blank=True, default=uuid.uuid4, editable=False, null=True
+            ),
+        ),
+        migrations.AlterField(
+            model_name="image",
+            name="image",
+            field=models.ImageField(
+                upload_to=ImageCraftApp.storage.ShardedPath("original")
+            ),
+        ),
+        migrations.AlterField(
+            model_name="image",
+            name="thumbnail_Basic",
+            field=models.ImageField(
+                blank=True,
+                null=True,
+                upload_to=ImageCraftApp.storage.ShardedPath("Basic"),
+            ),
+        ),
+        migrations.AlterField(
+            model_name="image",
+            name="thumbnail_Premium",
+            field=models.ImageField(
+                blank=True,
+                null=True,
+                upload_to=ImageCraftApp.storage.ShardedPath("Premium"),
+            ),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 4.2.5 on 2026-10-19 03:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("ImageCraftApp", "0018_sharded_media"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="image",
+            name="original_served_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="image",
+            name="serve_count",
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+    ]
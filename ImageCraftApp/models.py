@@ -1,8 +1,11 @@
+import uuid
 from django.db import models
 from django.contrib.auth.models import User
 from django.core.validators import MaxValueValidator, MinValueValidator
 from datetime import timedelta
 from django.utils import timezone
+from .edge_cache import purge
+from .storage import ShardedPath
 
 
 class CustomSubscriptionPlan(models.Model):
@@ -11,6 +14,14 @@ class CustomSubscriptionPlan(models.Model):
     premium_thumbnail_size = models.PositiveIntegerField(blank=True, null=True)
     original_file = models.BooleanField(default=False)
     expiring_links = models.BooleanField(default=False)
+    max_concurrent_renders = models.PositiveIntegerField(blank=True, null=True)
+    max_queued_renders = models.PositiveIntegerField(blank=True, null=True)
+    max_pixels = models.PositiveBigIntegerField(blank=True, null=True)
+    max_images = models.PositiveIntegerField(blank=True, null=True)
+    max_storage_bytes = models.PositiveBigIntegerField(blank=True, null=True)
+    transformations = models.BooleanField(default=False)
+    # Longest side of a transformed image; defaults to the largest thumbnail.
+    max_transform_size = models.PositiveIntegerField(blank=True, null=True)
 
     def __str__(self):
         return self.name
@@ -21,15 +32,36 @@ class UserProfile(models.Model):
     subscription_plan = models.ForeignKey(
         CustomSubscriptionPlan, on_delete=models.SET_NULL, null=True, blank=True
     )
+    # Storage usage, maintained incrementally by ImageCraftApp.usage.
+    image_count = models.BigIntegerField(default=0)
+    original_bytes = models.BigIntegerField(default=0)
+    thumbnail_basic_bytes = models.BigIntegerField(default=0)
+    thumbnail_premium_bytes = models.BigIntegerField(default=0)
 
+    @property
+    def storage_bytes(self):
+        return (
+            self.original_bytes
+            + self.thumbnail_basic_bytes
+            + self.thumbnail_premium_bytes
+        )
 
-class Image(models.Model):
-    images = "images/"
 
+class Image(models.Model):
     title = models.CharField(max_length=100)
-    image = models.ImageField(upload_to=images)
-    thumbnail_Basic = models.ImageField(upload_to=images, null=True, blank=True)
-    thumbnail_Premium = models.ImageField(upload_to=images, null=True, blank=True)
+    # Names the directory of the image's files; see ImageCraftApp.storage.
+    # Null for images stored before, until shard_media moves their files.
+    storage_key = models.UUIDField(
+        null=True, blank=True, editable=False, default=uuid.uuid4
+    )
+    image = models.ImageField(upload_to=ShardedPath("original"))
+    thumbnail_Basic = models.ImageField(
+        upload_to=ShardedPath("Basic"), null=True, blank=True
+    )
+    thumbnail_Premium = models.ImageField(
+        upload_to=ShardedPath("Premium"), null=True, blank=True
+    )
+    placeholder = models.TextField(blank=True, default="")
     created_at = models.DateTimeField(auto_now_add=True)
     link_expiration_time = models.PositiveIntegerField(
         default=300,
@@ -44,13 +76,71 @@ class Image(models.Model):
     )
     expiration_date = models.DateTimeField(null=True, blank=True)
     user = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True)
+    # Part of every serve-image URL; bumped to invalidate cached responses.
+    cache_version = models.PositiveIntegerField(default=1)
+    # Difference hash of the Basic thumbnail, whole and in the 16-bit chunks
+    # ImageCraftApp.duplicates looks near-duplicates up by.
+    phash = models.BigIntegerField(null=True, blank=True)
+    phash_0 = models.PositiveIntegerField(null=True, blank=True)
+    phash_1 = models.PositiveIntegerField(null=True, blank=True)
+    phash_2 = models.PositiveIntegerField(null=True, blank=True)
+    phash_3 = models.PositiveIntegerField(null=True, blank=True)
+    # Share of each of the 64 colour bins of ImageCraftApp.colours, 0-255.
+    colour_histogram = models.BinaryField(null=True, blank=True)
+    # Serve-image hits and when the original was last served, flushed in
+    # batches by ImageCraftApp.tiering.
+    serve_count = models.PositiveBigIntegerField(default=0)
+    original_served_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["user", field], name=f"image_user_{field}")
+            for field in ("phash_0", "phash_1", "phash_2", "phash_3")
+        ]
 
     def __str__(self):
         return self.title
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        if "expiration_date" in instance.__dict__:
+            # Remembered so that a changed expiry can invalidate cached responses.
+            instance._loaded_expiration_date = instance.expiration_date
+        return instance
+
     def save(self, *args, **kwargs):
         if not self.expiration_date:
             self.expiration_date = timezone.now() + timedelta(
                 seconds=self.link_expiration_time
             )
+        expiry_changed = (
+            "_loaded_expiration_date" in self.__dict__
+            and self.expiration_date != self._loaded_expiration_date
+        )
+        if expiry_changed:
+            # Serve-image URLs issued under the old expiry must miss the cache.
+            self.cache_version += 1
+            if kwargs.get("update_fields") is not None:
+                kwargs["update_fields"] = {*kwargs["update_fields"], "cache_version"}
         super(Image, self).save(*args, **kwargs)
+        if expiry_changed:
+            self._loaded_expiration_date = self.expiration_date
+            purge(self.pk)
+
+
+class ImageColour(models.Model):
+    """
+    A dominant colour of an image, indexed for search by colour.
+    """
+
+    image = models.ForeignKey(Image, on_delete=models.CASCADE, related_name="colours")
+    # The image's owner, so searches use the index without a join.
+    user = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True)
+    bin = models.PositiveSmallIntegerField()
+    # Packed as 0xRRGGBB.
+    rgb = models.PositiveIntegerField()
+    share = models.FloatField()
+
+    class Meta:
+        indexes = [models.Index(fields=["user", "bin", "share"])]
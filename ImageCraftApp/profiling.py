@@ -0,0 +1,277 @@
+"""
+On-demand sampling profiler for single requests.
+
+While a request is profiled, a background thread samples the Python stacks
+working on it every ``PROFILER["INTERVAL"]`` seconds. Under ASGI these are
+the event loop thread while the request's task is the one running, and the
+threads running ``sync_to_async`` calls awaited by that task, which asgiref
+records in ``SyncToAsync.launch_map``. Outside ASGI the thread handling the
+request is sampled. Other requests served meanwhile are left out.
+
+Profiles are written as collapsed stacks, one ``frame;frame;frame count``
+line per distinct stack, which flamegraph.pl, inferno and speedscope read
+directly. Only the newest ``PROFILER["MAX_FILES"]`` profiles are kept.
+
+Staff request a profile with a token from ``manage.py profile_token``, sent
+in the ``X-Profile`` header or the ``profile`` query parameter; signed-in
+staff may also pass ``profile=1``. ``PROFILER["SAMPLE_RATE"]`` additionally
+profiles that fraction of all requests, keeping those slower than
+``PROFILER["MIN_DURATION"]``. Requests that are not profiled cost a header
+lookup and, with sampling on, one random number.
+"""
+
+import asyncio
+import logging
+import os
+import random
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+from asgiref.sync import SyncToAsync
+from django.conf import settings
+from django.core import signing
+
+logger = logging.getLogger(__name__)
+
+TOKEN_SALT = "ImageCraftApp.profiling"
+QUERY_PARAM = "profile"
+RESPONSE_HEADER = "X-Profile"
+EXTENSION = ".folded"
+
+# Why a request is profiled.
+REQUESTED = "requested"
+SAMPLED = "sampled"
+
+_active = 0
+_active_lock = threading.Lock()
+
+
+def make_token(username):
+    """
+    Sign a profiling token for a staff member.
+
+    Args:
+        username (str): Who the profiles are requested by, for the logs.
+
+    Returns:
+        str: The token, valid for ``PROFILER["TOKEN_MAX_AGE"]`` seconds.
+    """
+    return signing.TimestampSigner(salt=TOKEN_SALT).sign(username)
+
+
+def requested_by(request):
+    """
+    Get who asked for a request to be profiled.
+
+    Args:
+        request (HttpRequest): The request.
+
+    Returns:
+        str: The staff username, or None if no valid token or flag was sent.
+    """
+    value = request.META.get("HTTP_X_PROFILE")
+    if value is None:
+        if f"{QUERY_PARAM}=" not in request.META.get("QUERY_STRING", ""):
+            return None
+        value = request.GET.get(QUERY_PARAM, "")
+    if value == "1":
+        user = getattr(request, "user", None)
+        return user.get_username() if user is not None and user.is_staff else None
+    try:
+        return signing.TimestampSigner(salt=TOKEN_SALT).unsign(
+            value, max_age=settings.PROFILER["TOKEN_MAX_AGE"]
+        )
+    except signing.BadSignature:
+        logger.warning("Ignoring an invalid profiling token for %s", request.path)
+        return None
+
+
+def should_profile(request):
+    """
+    Decide whether to profile a request.
+
+    Args:
+        request (HttpRequest): The request.
+
+    Returns:
+        str: REQUESTED, SAMPLED or None.
+    """
+    username = requested_by(request)
+    if username is not None:
+        logger.info("Profiling %s %s for %s", request.method, request.path, username)
+        return REQUESTED
+    rate = settings.PROFILER["SAMPLE_RATE"]
+    if rate and random.random() < rate:
+        return SAMPLED
+    return None
+
+
+def frame_name(code):
+    """
+    Name a stack frame by function, file and first line.
+    """
+    filename = os.path.basename(code.co_filename)
+    return f"{code.co_qualname} ({filename}:{code.co_firstlineno})"
+
+
+class Profile:
+    """
+    Samples the stacks working on the current request or task.
+
+    Use as a context manager around the work to profile. It must be entered
+    on the thread, and in the task if any, handling the request.
+
+    Attributes:
+        label (str): The root frame of every stack, e.g. ``GET /upload/``.
+        reason (str): REQUESTED or SAMPLED.
+        counts (Counter): Number of samples per folded stack.
+        duration (float): Seconds between entering and leaving.
+    """
+
+    def __init__(self, label, interval, reason=REQUESTED):
+        self.label = label
+        self.reason = reason
+        self.interval = interval
+        self.counts = Counter()
+        self.duration = 0.0
+        self._stopped = threading.Event()
+        self._sampler = threading.Thread(target=self._run, name="profiler", daemon=True)
+        self._thread = threading.get_ident()
+        try:
+            self._loop = asyncio.get_running_loop()
+            self._task = asyncio.current_task()
+        except RuntimeError:
+            self._loop = self._task = None
+
+    def __enter__(self):
+        self._started = time.perf_counter()
+        self._sampler.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.duration = time.perf_counter() - self._started
+        self._stopped.set()
+        self._sampler.join()
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            frames = sys._current_frames()
+            for ident in self._working_threads():
+                if ident in frames:
+                    self.counts[self._fold(frames[ident])] += 1
+
+    def _working_threads(self):
+        if self._task is None:
+            return {self._thread}
+        threads = {
+            thread.ident
+            for thread, task in SyncToAsync.launch_map.copy().items()
+            if task is self._task
+        }
+        if asyncio.current_task(self._loop) is self._task:
+            threads.add(self._thread)
+        return threads
+
+    def _fold(self, frame):
+        names = []
+        while frame is not None:
+            names.append(frame_name(frame.f_code))
+            frame = frame.f_back
+        names.append(self.label)
+        return ";".join(reversed(names))
+
+    def write(self, directory, max_files):
+        """
+        Write the collapsed stacks and drop the oldest profiles past the cap.
+
+        Args:
+            directory (str): Where profiles are kept.
+            max_files (int): How many profiles to keep.
+
+        Returns:
+            str: The file name.
+        """
+        os.makedirs(directory, exist_ok=True)
+        slug = re.sub(r"[^A-Za-z0-9]+", "-", self.label).strip("-")
+        name = (
+            f"{datetime.now():%Y%m%dT%H%M%S%f}-{os.getpid()}-{slug}"
+            f"-{self.duration * 1000:.0f}ms{EXTENSION}"
+        )
+        with open(os.path.join(directory, name), "w") as profile_file:
+            for stack, count in self.counts.most_common():
+                profile_file.write(f"{stack} {count}\n")
+        prune(directory, max_files)
+        return name
+
+
+def prune(directory, max_files):
+    """
+    Delete all but the newest profiles in a directory.
+
+    Args:
+        directory (str): Where profiles are kept.
+        max_files (int): How many profiles to keep.
+    """
+    # Names start with the time they were written, so they sort by age.
+    names = sorted(
+        (name for name in os.listdir(directory) if name.endswith(EXTENSION)),
+        reverse=True,
+    )
+    for name in names[max_files:]:
+        try:
+            os.remove(os.path.join(directory, name))
+        except FileNotFoundError:
+            # Pruned by another worker.
+            pass
+
+
+def start(request, reason):
+    """
+    Start profiling a request, unless too many are being profiled already.
+
+    Args:
+        request (HttpRequest): The request.
+        reason (str): REQUESTED or SAMPLED.
+
+    Returns:
+        Profile: The entered profile, or None.
+    """
+    global _active
+    with _active_lock:
+        if _active >= settings.PROFILER["MAX_ACTIVE"]:
+            return None
+        _active += 1
+    label = f"{request.method} {request.path}"
+    return Profile(label, settings.PROFILER["INTERVAL"], reason).__enter__()
+
+
+def finish(profile, response):
+    """
+    Stop profiling a request and write the profile if it is kept.
+
+    Explicitly requested profiles are always kept and named in the
+    ``X-Profile`` response header. Sampled ones are kept when the request took
+    at least ``PROFILER["MIN_DURATION"]`` seconds.
+
+    Args:
+        profile (Profile): The profile returned by ``start``.
+        response (HttpResponse): The response, or None if the view raised.
+    """
+    global _active
+    profile.__exit__(None, None, None)
+    with _active_lock:
+        _active -= 1
+    config = settings.PROFILER
+    if profile.reason == SAMPLED and profile.duration < config["MIN_DURATION"]:
+        return
+    try:
+        name = profile.write(config["DIR"], config["MAX_FILES"])
+    except OSError:
+        logger.exception("Could not write the profile of %s", profile.label)
+        return
+    logger.info("Profiled %s (%s) to %s", profile.label, profile.reason, name)
+    if profile.reason == REQUESTED and response is not None:
+        response[RESPONSE_HEADER] = name
@@ -0,0 +1,35 @@
+import orjson
+from rest_framework.utils.encoders import JSONEncoder
+from rest_framework.renderers import BaseRenderer
+
+# Types orjson does not know (Decimal, lazy translations, querysets...) are
+# converted the way DRF's JSONRenderer converts them.
+_default = JSONEncoder().default
+
+
+class ORJSONRenderer(BaseRenderer):
+    """
+    Render JSON with orjson, several times faster than the standard library.
+
+    Output is compact UTF-8, like DRF's JSONRenderer with its default settings.
+    """
+
+    media_type = "application/json"
+    format = "json"
+    charset = None
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        """
+        Render the data as JSON.
+
+        Args:
+            data: The data to render.
+            accepted_media_type (str, optional): The negotiated media type.
+            renderer_context (dict, optional): The view, request and response.
+
+        Returns:
+            bytes: The JSON document, or empty bytes for no data.
+        """
+        if data is None:
+            return b""
+        return orjson.dumps(data, default=_default, option=orjson.OPT_NON_STR_KEYS)
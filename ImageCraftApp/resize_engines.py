@@ -0,0 +1,154 @@
+"""
+Thumbnail resize engines.
+
+``settings.THUMBNAIL_ENGINE`` selects the engine: ``"pillow"`` (the default)
+or ``"vips"``, which needs pyvips and libvips. libvips shrinks while it
+decodes and streams the rest, so it is faster and far lighter on memory for
+large originals. If the configured engine cannot be loaded, Pillow is used.
+"""
+
+import functools
+import logging
+from io import BytesIO
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+logger = logging.getLogger(__name__)
+
+# Pillow's default, so both engines produce comparable files.
+JPEG_QUALITY = 75
+
+
+class PillowEngine:
+    """
+    Resize with Pillow, bounding decode memory with the pixel budget.
+    """
+
+    name = "pillow"
+
+    def __init__(self, decode_pixels=None):
+        """
+        Args:
+            decode_pixels (int, optional): The most pixels decoded into memory
+                at once; defaults to ``settings.THUMBNAIL_DECODE_PIXELS``.
+        """
+        self._decode_pixels = decode_pixels
+
+    @property
+    def decode_pixels(self):
+        """
+        int: The most pixels of an original this engine holds in memory at once.
+        """
+        return self._decode_pixels or settings.THUMBNAIL_DECODE_PIXELS
+
+    def render(self, path, sizes):
+        """
+        Render JPEG thumbnails of several sizes from a single decode of the original.
+
+        The original is scaled down to the largest size once, normalized (EXIF
+        orientation, sRGB, no metadata) on those few pixels while its ICC
+        profile still applies to them, then flattened onto white if it has
+        transparency, and every smaller size is derived from the previous
+        result.
+
+        Args:
+            path (str): The file path to the original image.
+            sizes (iterable): The thumbnail sizes to render.
+
+        Returns:
+            dict: Mapping of size to the thumbnail image as BytesIO object.
+
+        Raises:
+            ImageTooLarge: If the original cannot be decoded within the budget.
+        """
+        from .imaging import flatten, normalize, open_within_budget
+
+        sizes = sorted(set(sizes), reverse=True)
+        rendered = {}
+        with open_within_budget(path, sizes[0], self.decode_pixels) as image:
+            image.thumbnail((sizes[0], sizes[0]))
+            image = flatten(normalize(image))
+        for size in sizes:
+            image.thumbnail((size, size))
+            thumbnail_io = BytesIO()
+            image.save(thumbnail_io, "JPEG", quality=JPEG_QUALITY)
+            thumbnail_io.seek(0)
+            rendered[size] = thumbnail_io
+        return rendered
+
+
+class VipsEngine:
+    """
+    Resize with libvips through pyvips.
+    """
+
+    name = "vips"
+    # libvips streams the original, so no pixel budget applies.
+    decode_pixels = None
+
+    def __init__(self):
+        """
+        Raises:
+            ImportError: If pyvips is not installed.
+            OSError: If libvips cannot be loaded.
+        """
+        import pyvips
+
+        self.pyvips = pyvips
+
+    def render(self, path, sizes):
+        """
+        Render JPEG thumbnails of several sizes.
+
+        The largest size is produced with shrink-on-load, EXIF autorotation and
+        conversion to sRGB in one pass; smaller sizes are derived from it.
+
+        Args:
+            path (str): The file path to the original image.
+            sizes (iterable): The thumbnail sizes to render.
+
+        Returns:
+            dict: Mapping of size to the thumbnail image as BytesIO object.
+        """
+        sizes = sorted(set(sizes), reverse=True)
+        image = self.pyvips.Image.thumbnail(
+            path, sizes[0], height=sizes[0], size="down", export_profile="srgb"
+        )
+        if image.hasalpha():
+            image = image.flatten()
+        rendered = {}
+        for size in sizes:
+            image = image.thumbnail_image(size, height=size, size="down")
+            rendered[size] = BytesIO(image.jpegsave_buffer(Q=JPEG_QUALITY, strip=True))
+        return rendered
+
+
+ENGINES = {engine.name: engine for engine in (PillowEngine, VipsEngine)}
+
+
+@functools.lru_cache(maxsize=None)
+def _load_engine(name):
+    try:
+        engine_class = ENGINES[name]
+    except KeyError:
+        raise ImproperlyConfigured(
+            f"Unknown THUMBNAIL_ENGINE {name!r}; choose one of {sorted(ENGINES)}."
+        )
+    try:
+        return engine_class()
+    except (ImportError, OSError) as e:
+        logger.warning("Thumbnail engine %r unavailable (%s); using Pillow.", name, e)
+        return PillowEngine()
+
+
+def get_engine():
+    """
+    Get the configured resize engine, falling back to Pillow.
+
+    Returns:
+        PillowEngine | VipsEngine: The engine.
+
+    Raises:
+        ImproperlyConfigured: If ``settings.THUMBNAIL_ENGINE`` names no engine.
+    """
+    return _load_engine(settings.THUMBNAIL_ENGINE)
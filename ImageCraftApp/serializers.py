@@ -1,8 +1,11 @@
 from rest_framework import serializers
+from django.conf import settings
 from django.contrib.auth.models import User
 from django.core.cache import cache
 from .models import Image, UserProfile, CustomSubscriptionPlan
 
+SERVE_URL_TEMPLATE = "{}/serve-image/{}/{}/?v={}"
+
 
 class ImageSerializer(serializers.HyperlinkedModelSerializer):
     """
@@ -11,17 +14,18 @@ class ImageSerializer(serializers.HyperlinkedModelSerializer):
 
     class Meta:
         model = Image
-        fields = ["title", "image", "link_expiration_time"]
+        fields = ["title", "image", "link_expiration_time", "placeholder"]
+        read_only_fields = ["placeholder"]
 
-    def get_original_file(self, user_id):
+    def get_subscription_plan(self, user_id):
         """
-        Get the original file for the given user ID.
+        Get the subscription plan for the given user ID.
 
         Args:
             user_id (int): The ID of the user.
 
         Returns:
-            str: The path to the original file.
+            CustomSubscriptionPlan: The user's subscription plan.
 
         Raises:
             UserProfile.DoesNotExist: If the UserProfile is not found for the given user.
@@ -31,53 +35,148 @@ class ImageSerializer(serializers.HyperlinkedModelSerializer):
             user_profile = UserProfile.objects.select_related("subscription_plan").get(
                 user_id=user_id
             )
-            return user_profile.subscription_plan.original_file
         except UserProfile.DoesNotExist:
             raise UserProfile.DoesNotExist("UserProfile not found for the given user.")
-        except CustomSubscriptionPlan.DoesNotExist:
+        if user_profile.subscription_plan is None:
             raise CustomSubscriptionPlan.DoesNotExist(
                 "CustomSubscriptionPlan not found for the given user."
             )
+        return user_profile.subscription_plan
+
+    def validate_image(self, value):
+        """
+        Reject images that exceed the uploader's pixel limit or that the resize
+        engine cannot thumbnail within its decode budget, reading only the
+        image header.
+
+        Args:
+            value (UploadedFile): The uploaded image.
+
+        Returns:
+            UploadedFile: The uploaded image.
+
+        Raises:
+            ValidationError: If the image is too large.
+        """
+        from PIL import Image as PILImage
+        from .imaging import ImageTooLarge, check_pixel_budget
+        from .resize_engines import get_engine
+        from .thumbnails import variant_sizes
+
+        request = self.context.get("request")
+        if request is None:
+            return value
+        subscription_plan = self.get_request_subscription_plan(request.user.pk)
+        value.seek(0)
+        try:
+            with PILImage.open(value) as image:
+                # Animations are rendered frame by frame with Pillow.
+                if getattr(image, "is_animated", False):
+                    decode_pixels = settings.THUMBNAIL_DECODE_PIXELS
+                else:
+                    decode_pixels = get_engine().decode_pixels
+                check_pixel_budget(
+                    image,
+                    max(variant_sizes(subscription_plan).values()),
+                    decode_pixels=decode_pixels,
+                    max_pixels=subscription_plan.max_pixels
+                    or settings.MAX_IMAGE_PIXELS,
+                )
+        except ImageTooLarge as e:
+            raise serializers.ValidationError(str(e))
+        finally:
+            value.seek(0)
+        return value
+
+    def get_original_file(self, user_id):
+        """
+        Get the original file for the given user ID.
+
+        Args:
+            user_id (int): The ID of the user.
+
+        Returns:
+            str: The path to the original file.
+
+        Raises:
+            UserProfile.DoesNotExist: If the UserProfile is not found for the given user.
+            CustomSubscriptionPlan.DoesNotExist: If the CustomSubscriptionPlan is not found for the given user.
+        """
+        return self.get_subscription_plan(user_id).original_file
+
+    def get_request_subscription_plan(self, user_id):
+        """
+        Get the subscription plan for the given user ID, once per request.
+
+        The plan is remembered in the serializer context, which list
+        serialization shares between all instances.
+
+        Args:
+            user_id (int): The ID of the user.
+
+        Returns:
+            CustomSubscriptionPlan: The user's subscription plan.
+        """
+        plans = self.context.setdefault("subscription_plans", {})
+        if user_id not in plans:
+            plans[user_id] = self.get_subscription_plan(user_id)
+        return plans[user_id]
+
+    def get_url_prefix(self, request):
+        """
+        Get the scheme and host serve URLs start with, once per request.
+
+        Args:
+            request: The HTTP request.
+
+        Returns:
+            str: The absolute base URL without a trailing slash.
+        """
+        prefix = self.context.get("url_prefix")
+        if prefix is None:
+            prefix = self.context["url_prefix"] = request.build_absolute_uri("/")[:-1]
+        return prefix
 
     def to_representation(self, instance):
         """
         Convert the instance to a representation.
 
+        With a request, returns the serve URLs the user's plan entitles them
+        to. URLs are filled into a template after a single absolute base URL
+        lookup per request. Variants missing since a plan upgrade are only
+        rendered when their URL is first served.
+
         Args:
             instance: The instance to convert.
 
         Returns:
             dict: The converted representation.
         """
-        data = super().to_representation(instance)
         request = self.context.get("request")
+        if not request:
+            return super().to_representation(instance)
 
-        if request:
-            user_id = instance.user_id
-            original_file = self.get_original_file(user_id)
+        subscription_plan = self.get_request_subscription_plan(instance.user_id)
+        prefix = self.get_url_prefix(request)
+        pk = instance.pk
+        version = instance.cache_version
 
-            if not original_file:
-                thumbnail_url = request.build_absolute_uri(
-                    f"/serve-image/{instance.pk}/?q={instance.thumbnail_Basic.path}"
-                )
-                return {"thumbnail_Basic": thumbnail_url}
-
-            original_url = request.build_absolute_uri(
-                f"/serve-image/{instance.pk}/?q={instance.image.path}"
-            )
-            thumbnail_url = request.build_absolute_uri(
-                f"/serve-image/{instance.pk}/?q={instance.thumbnail_Basic.path}"
-            )
-            thumbnail_premium_url = request.build_absolute_uri(
-                f"/serve-image/{instance.pk}/?q={instance.thumbnail_Premium.path}"
-            )
+        thumbnail_url = SERVE_URL_TEMPLATE.format(prefix, pk, "Basic", version)
+        if not subscription_plan.original_file:
             return {
                 "thumbnail_Basic": thumbnail_url,
-                "thumbnail_premium_url": thumbnail_premium_url,
-                "original_image": original_url,
+                "placeholder": instance.placeholder,
             }
-
-        return data
+        return {
+            "thumbnail_Basic": thumbnail_url,
+            "thumbnail_premium_url": SERVE_URL_TEMPLATE.format(
+                prefix, pk, "Premium", version
+            ),
+            "original_image": SERVE_URL_TEMPLATE.format(
+                prefix, pk, "original", version
+            ),
+            "placeholder": instance.placeholder,
+        }
 
 
 class UserSerializer(serializers.HyperlinkedModelSerializer):
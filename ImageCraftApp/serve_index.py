@@ -0,0 +1,106 @@
+"""
+Cached index from image ID to the files and access facts serve-image needs.
+
+Entries are written whenever an image is saved and dropped when it is
+deleted, so serving an image needs no query to find its file. A missing entry
+is rebuilt on first use from the primary database: a lagging read replica
+could still hold file names that tiering or shard_media have just replaced,
+and the entry would keep them for a day.
+"""
+
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS
+
+SERVE_INDEX_TIMEOUT = 24 * 3600
+
+# Variant name in serve URLs to Image field.
+VARIANT_FIELDS = {
+    "original": "image",
+    "Basic": "thumbnail_Basic",
+    "Premium": "thumbnail_Premium",
+}
+
+
+def _cache_key(pk):
+    return f"serve_index_{pk}"
+
+
+def build_entry(instance):
+    """
+    Build the index entry of an image.
+
+    Args:
+        instance (Image): The image.
+
+    Returns:
+        dict: The owner's ID, the link expiry and the storage name of every
+        generated variant under ``files``.
+    """
+    return {
+        "user_id": instance.user_id,
+        "expiration_date": instance.expiration_date,
+        "files": {
+            variant: getattr(instance, field_name).name
+            for variant, field_name in VARIANT_FIELDS.items()
+            if getattr(instance, field_name)
+        },
+    }
+
+
+def store(instance):
+    """
+    Write the index entry of an image.
+
+    Args:
+        instance (Image): The image; all of its fields must be loaded.
+    """
+    cache.set(_cache_key(instance.pk), build_entry(instance), SERVE_INDEX_TIMEOUT)
+
+
+def invalidate(pk):
+    """
+    Drop the index entry of an image.
+
+    Args:
+        pk (int): The ID of the image.
+    """
+    cache.delete(_cache_key(pk))
+
+
+def lookup(pk):
+    """
+    Get the index entry of an image, rebuilding it from the primary database
+    on a miss.
+
+    Args:
+        pk (int): The ID of the image.
+
+    Returns:
+        dict: The index entry, or None if the image does not exist.
+    """
+    entry = cache.get(_cache_key(pk))
+    if entry is not None:
+        return entry
+    from .models import Image
+
+    instance = Image.objects.using(DEFAULT_DB_ALIAS).filter(pk=pk).first()
+    if instance is None:
+        return None
+    store(instance)
+    return build_entry(instance)
+
+
+def storage_path(variant, name):
+    """
+    Get the filesystem path of a stored variant.
+
+    Args:
+        variant (str): The variant name.
+        name (str): The storage name from the index entry.
+
+    Returns:
+        str: The file path.
+    """
+    from .models import Image
+
+    return Image._meta.get_field(VARIANT_FIELDS[variant]).storage.path(name)
@@ -1,8 +1,11 @@
 from django.dispatch import receiver
-from django.db.models.signals import post_save
+from django.db.models.signals import post_delete, post_save
 from django.contrib.auth.models import User
+from django.core.cache import cache
 from django.core.exceptions import ObjectDoesNotExist
-from .models import UserProfile, CustomSubscriptionPlan
+from . import db_router, serve_index, usage
+from .edge_cache import purge
+from .models import Image, UserProfile, CustomSubscriptionPlan
 
 
 def create_subscription_plan():
@@ -72,3 +75,91 @@ def create_user_profile(sender, instance, created, **kwargs):
         except Exception as e:
             # Handle any other unexpected exceptions during profile creation
             raise e
+
+
+@receiver(post_save, sender=Image)
+def count_new_image(sender, instance, created, **kwargs):
+    """
+    Add a new image and its original to the owner's storage usage.
+
+    Variants are counted by ``generate_variants`` as they are written.
+
+    Args:
+        sender (Model): The model class sending the signal (Image in this case).
+        instance (Image): The saved image.
+        created (bool): Whether the image was just created.
+        kwargs: Additional keyword arguments.
+    """
+    if created:
+        usage.record(
+            instance.user_id,
+            images=1,
+            original_bytes=usage.stored_size(instance.image),
+        )
+
+
+@receiver(post_save, sender=Image)
+def update_serve_index(sender, instance, **kwargs):
+    """
+    Refresh the serve index entry of a saved image.
+
+    Args:
+        sender (Model): The model class sending the signal (Image in this case).
+        instance (Image): The saved image.
+        kwargs: Additional keyword arguments.
+    """
+    if instance.get_deferred_fields():
+        serve_index.invalidate(instance.pk)
+    else:
+        serve_index.store(instance)
+
+
+@receiver(post_delete, sender=Image)
+def purge_on_delete(sender, instance, **kwargs):
+    """
+    Purge nginx's cached responses and the serve index entry of a deleted image,
+    and take it off the owner's storage usage.
+
+    Args:
+        sender (Model): The model class sending the signal (Image in this case).
+        instance (Image): The deleted image.
+        kwargs: Additional keyword arguments.
+    """
+    serve_index.invalidate(instance.pk)
+    purge(instance.pk)
+    usage.record(
+        instance.user_id,
+        images=-1,
+        **{counter: -size for counter, size in usage.image_usage(instance).items()},
+    )
+
+
+@receiver(post_save, sender=Image)
+@receiver(post_delete, sender=Image)
+@receiver(post_save, sender=UserProfile)
+def pin_to_primary(sender, instance, **kwargs):
+    """
+    Send the owner's reads to the primary database for a while, so replicas
+    that have not caught up yet do not hide the change from them.
+
+    Args:
+        sender (Model): The model class sending the signal.
+        instance (Image or UserProfile): The changed image or profile.
+        kwargs: Additional keyword arguments.
+    """
+    db_router.pin(instance.user_id)
+
+
+@receiver(post_save, sender=CustomSubscriptionPlan)
+@receiver(post_delete, sender=CustomSubscriptionPlan)
+def forget_cached_plan(sender, instance, **kwargs):
+    """
+    Drop the cached copy of a changed subscription plan, so new limits and
+    quotas apply to the next upload.
+
+    Args:
+        sender (Model): The model class sending the signal.
+        instance (CustomSubscriptionPlan): The changed plan.
+        kwargs: Additional keyword arguments.
+    """
+    cache.delete(f"subscription_plan_{instance.pk}")
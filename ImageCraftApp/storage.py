@@ -0,0 +1,113 @@
+"""
+Sharded media layout.
+
+Every file of an image is stored in a directory of its own,
+``images/<ab>/<cd>/<key>/<variant><ext>``, where ``key`` is the image's random
+``storage_key`` and ``ab`` and ``cd`` are its first four hex digits. Two
+levels of 256 shards keep directories small however many images there are,
+and an image's files sit together for backups and deletion.
+
+The names are unique by construction, so ``ShardedStorage`` writes them
+without probing for a free name, and replaces a re-rendered variant
+atomically instead of storing it under a new, suffixed name. Names in the
+old flat ``images/`` directory are stored as ``FileSystemStorage`` stores
+them; ``manage.py shard_media`` moves them into the sharded layout.
+
+Names starting with ``cold/`` are files moved to the cold tier, and resolve
+to the same path under ``STORAGE_TIERS["COLD_ROOT"]`` instead of
+``MEDIA_ROOT``; see ImageCraftApp.tiering.
+"""
+
+import os
+import re
+import uuid
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage
+from django.utils._os import safe_join
+from django.utils.deconstruct import deconstructible
+
+ROOT = "images"
+COLD_PREFIX = "cold/"
+SHARDED_NAME = re.compile(
+    rf"^(?:{COLD_PREFIX})?{ROOT}/[0-9a-f]{{2}}/[0-9a-f]{{2}}/[0-9a-f]{{32}}/[^/]+$"
+)
+
+
+def is_sharded(name):
+    """
+    Check whether a storage name is in the sharded layout.
+    """
+    return bool(SHARDED_NAME.match(name))
+
+
+def image_directory(key):
+    """
+    Get the directory holding the files of an image.
+
+    Args:
+        key (UUID): The image's storage key.
+
+    Returns:
+        str: The storage name of the directory.
+    """
+    return f"{ROOT}/{key.hex[:2]}/{key.hex[2:4]}/{key.hex}"
+
+
+@deconstructible
+class ShardedPath:
+    """
+    ``upload_to`` of the Image file fields: names a variant's file after the
+    variant, in the image's directory, keeping the extension of the file
+    being stored.
+
+    Attributes:
+        variant (str): ``original``, ``Basic`` or ``Premium``.
+    """
+
+    def __init__(self, variant):
+        self.variant = variant
+
+    def __call__(self, instance, filename):
+        if instance.storage_key is None:
+            # Stored before storage keys; shard_media moves the other files.
+            instance.storage_key = uuid.uuid4()
+        extension = os.path.splitext(filename)[1].lower()
+        return f"{image_directory(instance.storage_key)}/{self.variant}{extension}"
+
+    def __eq__(self, other):
+        return isinstance(other, ShardedPath) and other.variant == self.variant
+
+
+class ShardedStorage(FileSystemStorage):
+    """
+    File system storage writing sharded names in place; see the module
+    docstring.
+    """
+
+    def path(self, name):
+        if name.startswith(COLD_PREFIX):
+            return safe_join(
+                settings.STORAGE_TIERS["COLD_ROOT"], name[len(COLD_PREFIX) :]
+            )
+        return super().path(name)
+
+    def get_available_name(self, name, max_length=None):
+        if is_sharded(name):
+            return name
+        return super().get_available_name(name, max_length)
+
+    def _save(self, name, content):
+        if not is_sharded(name):
+            return super()._save(name, content)
+        # Written next to its final name and renamed over it, so readers see
+        # either the old file or the whole new one.
+        directory, basename = name.rsplit("/", 1)
+        temporary = super()._save(
+            f"{directory}/.{uuid.uuid4().hex}-{basename}", content
+        )
+        try:
+            os.replace(self.path(temporary), self.path(name))
+        except OSError:
+            self.delete(temporary)
+            raise
+        return name
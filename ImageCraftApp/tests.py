@@ -1,15 +1,113 @@
-from django.test import TestCase
+import asyncio
+import base64
+import json
+import math
+import mimetypes
+import os
+import shutil
+import signal
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import unittest
+import zipfile
+from decimal import Decimal
+from io import BytesIO, StringIO
+from unittest import mock
+from PIL import Image as PILImage, ImageCms
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import OperationalError, connections
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import CommandError
 from django.contrib.auth.models import User
-from rest_framework.test import APIClient
+from rest_framework.exceptions import ErrorDetail
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient, APIRequestFactory
 from django.core.files.uploadedfile import SimpleUploadedFile
 from django.utils import timezone
+from django.utils.translation import gettext_lazy
 from rest_framework import status
+from asgiref.sync import async_to_sync, sync_to_async
 from .models import Image
 from .models import (
+    ImageColour,
     UserProfile,
     CustomSubscriptionPlan,
 )  # Assuming you have UserProfile model
 from .serializers import ImageSerializer  # Import your serializer
+from .management.commands import shard_media
+from . import (
+    admission,
+    colours,
+    db_router,
+    duplicates,
+    edge_cache,
+    events,
+    imaging,
+    loop_monitor,
+    profiling,
+    resize_engines,
+    thumbnails,
+    tiering,
+    transforms,
+    zipstream,
+)
+from .metrics import Metrics, mark_process_dead
+from .renderers import ORJSONRenderer
+from .middleware import (
+    DISCONNECT_SCOPE_KEY,
+    ClientDisconnectMiddleware,
+    LoopMonitorMiddleware,
+)
+from .storage import ShardedStorage
+from .views import ImageDetailView
+from ImageCraftsman import memory_watchdog
+from ImageCraftsman.memory_watchdog import MemoryWatchdog
+
+try:
+    import pyvips  # noqa: F401
+
+    HAS_VIPS = True
+except (ImportError, OSError):
+    HAS_VIPS = False
+
+
+def make_image_file(name="photo.jpg", size=(640, 480), format="JPEG", **save_kwargs):
+    image_io = BytesIO()
+    PILImage.new("RGB", size, (200, 120, 40)).save(image_io, format, **save_kwargs)
+    return SimpleUploadedFile(
+        name, image_io.getvalue(), content_type=f"image/{format.lower()}"
+    )
+
+
+class MediaRootTestCase(TestCase):
+    """
+    Test case storing uploaded files in a throwaway MEDIA_ROOT.
+    """
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        media_override = override_settings(MEDIA_ROOT=media_root)
+        media_override.enable()
+        self.addCleanup(media_override.disable)
+
+    def create_user(self, username="owner", plan="Basic"):
+        user = User.objects.create_user(username=username, password="testpassword")
+        self.set_plan(user, plan)
+        return user
+
+    def set_plan(self, user, plan):
+        UserProfile.objects.filter(user=user).update(
+            subscription_plan=CustomSubscriptionPlan.objects.filter(name=plan).first()
+        )
 
 
 class ImageCreateViewTestCase(TestCase):
@@ -133,3 +231,2445 @@ class ImageCreateViewTestCase(TestCase):
 
         # Assert that the response status code is 404 (Not Found) for a nonexistent image
         self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class LazyVariantBackfillTestCase(MediaRootTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = self.create_user()
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+        response = self.client.post(
+            "/upload/", {"title": "Before upgrade", "image": make_image_file()}
+        )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.image = Image.objects.get(title="Before upgrade")
+
+    def test_basic_upload_has_no_premium_variant(self):
+        self.assertTrue(self.image.thumbnail_Basic)
+        self.assertFalse(self.image.thumbnail_Premium)
+
+    def test_premium_variant_rendered_on_first_serve_after_upgrade(self):
+        self.set_plan(self.user, "Premium")
+
+        response = self.client.get(f"/image_detail/{self.image.pk}/")
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.image.refresh_from_db()
+        self.assertFalse(self.image.thumbnail_Premium)
+
+        served = self.client.get(response.data["thumbnail_premium_url"])
+
+        self.assertEqual(served.status_code, status.HTTP_200_OK)
+        self.image.refresh_from_db()
+        self.assertTrue(self.image.thumbnail_Premium)
+        with PILImage.open(BytesIO(served.content)) as thumbnail:
+            self.assertEqual(max(thumbnail.size), 400)
+
+    def test_basic_served_uncached_when_no_lazy_slot_is_free(self):
+        self.set_plan(self.user, "Premium")
+        busy = admission.RenderAdmission()
+
+        with mock.patch("ImageCraftApp.views.render_admission", busy):
+            self.assertTrue(busy.try_acquire_lazy())
+            served = self.client.get(f"/serve-image/{self.image.pk}/Premium/")
+
+        self.assertEqual(served.status_code, status.HTTP_200_OK)
+        self.assertEqual(served["Cache-Control"], "no-store")
+        self.image.refresh_from_db()
+        self.assertFalse(self.image.thumbnail_Premium)
+        with PILImage.open(BytesIO(served.content)) as thumbnail:
+            self.assertEqual(max(thumbnail.size), 200)
+
+    def test_missing_variant_outside_the_plan_is_not_rendered(self):
+        with mock.patch.object(thumbnails, "generate_variants") as generate:
+            response = self.client.get(f"/serve-image/{self.image.pk}/Premium/")
+
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        generate.assert_not_called()
+
+    def test_missing_variants_share_one_decode(self):
+        Image.objects.filter(pk=self.image.pk).update(thumbnail_Basic="")
+        self.image.refresh_from_db()
+        plan = CustomSubscriptionPlan.objects.filter(name="Premium").first()
+
+        with mock.patch.object(PILImage, "open", wraps=PILImage.open) as image_open:
+            thumbnails.ensure_variants(self.image, plan)
+
+        original_decodes = [
+            call
+            for call in image_open.call_args_list
+            if call.args[0] == self.image.image.path
+        ]
+        self.assertEqual(len(original_decodes), 1)
+        self.assertTrue(self.image.thumbnail_Basic)
+        self.assertTrue(self.image.thumbnail_Premium)
+
+    def test_backfill_command_renders_missing_variants(self):
+        self.set_plan(self.user, "Enterprise")
+
+        call_command("backfill_thumbnails", sleep=0, niceness=0, stdout=StringIO())
+
+        self.image.refresh_from_db()
+        self.assertTrue(self.image.thumbnail_Premium)
+
+
+class ThumbnailNormalizationTestCase(TestCase):
+    def render(self, **save_kwargs):
+        original = make_image_file(size=(640, 480), **save_kwargs)
+        with tempfile.NamedTemporaryFile(suffix=".jpg") as original_file:
+            original_file.write(original.read())
+            original_file.flush()
+            return thumbnails.render_thumbnails(original_file.name, [200, 400])
+
+    def test_exif_orientation_is_applied(self):
+        exif = PILImage.Exif()
+        exif[0x0112] = 6  # Rotated 90 degrees clockwise
+
+        rendered = self.render(exif=exif.tobytes())
+
+        with PILImage.open(rendered[400]) as thumbnail:
+            self.assertEqual(thumbnail.size, (300, 400))
+        with PILImage.open(rendered[200]) as thumbnail:
+            self.assertEqual(thumbnail.size, (150, 200))
+
+    def test_metadata_is_stripped_and_icc_transform_cached(self):
+        icc_profile = ImageCms.ImageCmsProfile(ImageCms.createProfile("sRGB")).tobytes()
+        exif = PILImage.Exif()
+        exif[0x010F] = "Camera maker"
+        imaging._srgb_transform.cache_clear()
+
+        self.render(icc_profile=icc_profile, exif=exif.tobytes())
+        rendered = self.render(icc_profile=icc_profile, exif=exif.tobytes())
+
+        for thumbnail_io in rendered.values():
+            with PILImage.open(thumbnail_io) as thumbnail:
+                self.assertNotIn("icc_profile", thumbnail.info)
+                self.assertNotIn("exif", thumbnail.info)
+        cache_info = imaging._srgb_transform.cache_info()
+        self.assertEqual((cache_info.misses, cache_info.hits), (1, 1))
+
+
+class PlaceholderTestCase(MediaRootTestCase):
+    def test_upload_stores_inline_placeholder(self):
+        user = self.create_user()
+        self.client = APIClient()
+        self.client.force_authenticate(user=user)
+        self.client.post("/upload/", {"title": "Koty", "image": make_image_file()})
+        image = Image.objects.get(title="Koty")
+
+        response = self.client.get(f"/image_detail/{image.pk}/")
+
+        placeholder = response.data["placeholder"]
+        self.assertEqual(placeholder, image.placeholder)
+        header, encoded = placeholder.split(",", 1)
+        self.assertTrue(header.startswith("data:image/"))
+        with PILImage.open(BytesIO(base64.b64decode(encoded))) as preview:
+            self.assertEqual(preview.size, (20, 15))
+
+
+class ContactSheetTestCase(MediaRootTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = self.create_user()
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+        for title in ("first", "second", "third"):
+            self.client.post("/upload/", {"title": title, "image": make_image_file()})
+        self.ids = list(
+            Image.objects.filter(user=self.user)
+            .order_by("pk")
+            .values_list("pk", flat=True)
+        )
+        other = self.create_user(username="other")
+        self.foreign = Image.objects.create(
+            title="foreign", image=make_image_file(), user=other
+        )
+
+    def test_sprite_with_coordinate_map(self):
+        ids = ",".join(map(str, self.ids + [self.foreign.pk]))
+
+        response = self.client.get(f"/contact-sheet/?ids={ids}")
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["missing"], [self.foreign.pk])
+        self.assertEqual(list(response.data["tiles"]), [str(pk) for pk in self.ids])
+        self.assertEqual(
+            response.data["tiles"][str(self.ids[1])],
+            {"x": 200, "y": 0, "width": 200, "height": 150},
+        )
+        sprite = self.client.get(response.data["sprite"])
+        self.assertEqual(sprite.status_code, status.HTTP_200_OK)
+        with PILImage.open(BytesIO(sprite.content)) as image:
+            self.assertEqual(image.size, (400, 400))
+
+    def test_sprite_is_cached_by_id_set(self):
+        url = f"/contact-sheet/?ids={','.join(map(str, self.ids))}"
+        first = self.client.get(url)
+
+        with mock.patch("ImageCraftApp.imaging.compose_sprite") as compose_sprite:
+            second = self.client.get(url)
+
+        compose_sprite.assert_not_called()
+        self.assertEqual(first.data["sprite"], second.data["sprite"])
+
+    def test_sprite_is_stored_outside_the_cache(self):
+        response = self.client.get(f"/contact-sheet/?ids={self.ids[0]}")
+        digest = response.data["sprite"].rstrip("/").rsplit("/", 1)[1]
+        sprites = os.path.join(settings.MEDIA_ROOT, "contact-sheets")
+        stale = os.path.join(sprites, digest[:2], "stale.jpg")
+        other_shard = "00" if digest[:2] != "00" else "01"
+        os.makedirs(os.path.join(sprites, other_shard))
+        unswept = os.path.join(sprites, other_shard, "stale.jpg")
+        for path in (stale, unswept):
+            with open(path, "wb") as sprite:
+                sprite.write(b"old")
+            os.utime(path, (0, 0))
+        cache.delete(f"contact_sheet_{digest}")
+
+        self.client.get(f"/contact-sheet/?ids={self.ids[0]}")
+
+        cached = cache.get(f"contact_sheet_{digest}")
+        self.assertEqual(cached["sprite"], f"contact-sheets/{digest[:2]}/{digest}.jpg")
+        self.assertTrue(
+            os.path.exists(os.path.join(settings.MEDIA_ROOT, cached["sprite"]))
+        )
+        self.assertFalse(os.path.exists(stale))
+        # Only the shard of the composed sprite is swept.
+        self.assertTrue(os.path.exists(unswept))
+
+    def test_sprite_of_other_user_is_not_served(self):
+        response = self.client.get(f"/contact-sheet/?ids={self.ids[0]}")
+        other = APIClient()
+        other.force_authenticate(user=User.objects.get(username="other"))
+
+        sprite = other.get(response.data["sprite"])
+
+        self.assertEqual(sprite.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_multipart_stream(self):
+        response = self.client.get(
+            f"/contact-sheet/?ids={','.join(map(str, self.ids))}&layout=multipart"
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response["Content-Type"].startswith("multipart/mixed"))
+        body = b"".join(response.streaming_content)
+        for pk in self.ids:
+            self.assertIn(f"X-Image-Id: {pk}".encode(), body)
+
+    def test_multipart_parts_have_the_stored_type(self):
+        self.client.post(
+            "/upload/", {"title": "moving", "image": make_animation_file(frames=3)}
+        )
+        animated = Image.objects.get(title="moving")
+        content_type = mimetypes.guess_type(animated.thumbnail_Basic.name)[0]
+        self.assertIn(content_type, ("image/webp", "image/gif"))
+
+        response = self.client.get(
+            f"/contact-sheet/?ids={self.ids[0]},{animated.pk}&layout=multipart"
+        )
+
+        body = b"".join(response.streaming_content)
+        self.assertIn(b"Content-Type: image/jpeg\r\n", body)
+        self.assertIn(f"Content-Type: {content_type}\r\n".encode(), body)
+
+    def test_invalid_ids_are_rejected(self):
+        response = self.client.get("/contact-sheet/?ids=1,abc")
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class ZipStreamTestCase(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+        self.files = {}
+        for name, size in (("a.jpg", 1000), ("b/c.jpg", 300000)):
+            path = os.path.join(self.directory, name.replace("/", "_"))
+            with open(path, "wb") as f:
+                f.write(os.urandom(size))
+            self.files[name] = path
+
+    async def entries(self):
+        for name, path in self.files.items():
+            yield name, path, timezone.now()
+
+    def build(self, zip_stream):
+        async def collect():
+            return b"".join(
+                [chunk async for chunk in zip_stream.stream(self.entries())]
+            )
+
+        return async_to_sync(collect)()
+
+    def assertArchiveMatches(self, archive):
+        with zipfile.ZipFile(BytesIO(archive)) as zip_file:
+            self.assertIsNone(zip_file.testzip())
+            self.assertEqual(zip_file.namelist(), list(self.files))
+            for info in zip_file.infolist():
+                self.assertEqual(info.compress_type, zipfile.ZIP_STORED)
+                with open(self.files[info.filename], "rb") as f:
+                    self.assertEqual(zip_file.read(info), f.read())
+
+    def test_stored_archive_round_trip(self):
+        self.assertArchiveMatches(self.build(zipstream.ZipStream(chunk_size=4096)))
+
+    def test_zip64_records(self):
+        with mock.patch.object(zipstream, "ZIP64_LIMIT", 500), mock.patch.object(
+            zipstream, "ZIP64_COUNT_LIMIT", 1
+        ):
+            archive = self.build(zipstream.ZipStream(chunk_size=4096))
+
+        self.assertIn(struct.pack("<I", 0x06064B50), archive)
+        self.assertArchiveMatches(archive)
+
+    def test_stops_reading_when_client_disconnects(self):
+        reads = []
+        zip_stream = zipstream.ZipStream(
+            chunk_size=4096, is_disconnected=lambda: len(reads) > 2
+        )
+
+        async def consume():
+            async for chunk in zip_stream.stream(self.entries()):
+                reads.append(chunk)
+
+        with self.assertRaises(zipstream.ClientDisconnected):
+            async_to_sync(consume)()
+        self.assertEqual(len(reads), 3)
+
+    def test_middleware_flags_disconnect_after_body(self):
+        seen = {}
+
+        async def app(scope, receive, send):
+            await receive()
+            await asyncio.sleep(0.01)
+            seen["disconnected"] = scope[DISCONNECT_SCOPE_KEY].is_set()
+
+        messages = [
+            {"type": "http.request", "body": b"", "more_body": False},
+            {"type": "http.disconnect"},
+        ]
+
+        async def receive():
+            if messages:
+                return messages.pop(0)
+            await asyncio.Event().wait()
+
+        async_to_sync(ClientDisconnectMiddleware(app))({"type": "http"}, receive, None)
+
+        self.assertTrue(seen["disconnected"])
+
+
+class ExportViewTestCase(MediaRootTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = self.create_user(plan="Premium")
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+        self.client.post("/upload/", {"title": "Koty", "image": make_image_file()})
+        self.image = Image.objects.get(title="Koty")
+
+    def download(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response["Content-Type"], "application/zip")
+
+        async def collect():
+            return b"".join([chunk async for chunk in response.streaming_content])
+
+        return zipfile.ZipFile(BytesIO(async_to_sync(collect)()))
+
+    def test_exports_originals_by_default(self):
+        with self.download("/export/") as archive:
+            self.assertEqual(archive.namelist(), [f"{self.image.pk}-koty/original.jpg"])
+            with open(self.image.image.path, "rb") as f:
+                self.assertEqual(archive.read(archive.namelist()[0]), f.read())
+
+    def test_exports_chosen_variants(self):
+        with self.download("/export/?variant=Basic&variant=Premium") as archive:
+            self.assertEqual(
+                archive.namelist(),
+                [
+                    f"{self.image.pk}-koty/Basic.jpeg",
+                    f"{self.image.pk}-koty/Premium.jpeg",
+                ],
+            )
+
+    def test_originals_require_plan(self):
+        self.set_plan(self.user, "Basic")
+
+        response = self.client.get("/export/?variant=original")
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+@override_settings(
+    RENDER_ADMISSION={
+        "MAX_CONCURRENT": 1,
+        "MAX_QUEUED": 1,
+        "QUEUE_TIMEOUT": 5,
+        "RETRY_AFTER": 7,
+        "MAX_LAZY": 1,
+    }
+)
+class RenderAdmissionTestCase(MediaRootTestCase):
+    def setUp(self):
+        super().setUp()
+        self.admission = admission.RenderAdmission()
+        self.plan = CustomSubscriptionPlan(pk=1, name="Basic", thumbnail_size=200)
+
+    def test_rejects_when_queue_is_full(self):
+        self.admission.acquire(self.plan)
+        waiter = threading.Thread(target=self.admission.acquire, args=[self.plan])
+        waiter.start()
+        while self.admission.stats()["queued"] != 1:
+            time.sleep(0.01)
+
+        with self.assertRaises(admission.RenderCapacityExceeded) as rejected:
+            self.admission.acquire(self.plan)
+
+        self.assertEqual(rejected.exception.wait, 7)
+        self.admission.release(self.plan)
+        waiter.join(timeout=5)
+        self.assertEqual(self.admission.stats(), {"active": 1, "queued": 0})
+
+    def test_queued_upload_times_out(self):
+        self.admission.acquire(self.plan)
+
+        with override_settings(
+            RENDER_ADMISSION={
+                "MAX_CONCURRENT": 1,
+                "MAX_QUEUED": 1,
+                "QUEUE_TIMEOUT": 0.05,
+                "RETRY_AFTER": 7,
+            }
+        ):
+            with self.assertRaises(admission.RenderCapacityExceeded):
+                self.admission.acquire(self.plan)
+
+        self.assertEqual(self.admission.stats(), {"active": 1, "queued": 0})
+
+    def test_lazy_slots_never_wait_or_use_upload_slots(self):
+        self.admission.acquire(self.plan)
+
+        self.assertTrue(self.admission.try_acquire_lazy())
+        self.assertFalse(self.admission.try_acquire_lazy())
+        self.admission.release_lazy()
+        self.assertTrue(self.admission.try_acquire_lazy())
+        self.assertEqual(self.admission.stats(), {"active": 1, "queued": 0})
+
+    def test_plan_limits_apply_per_plan(self):
+        self.plan.max_queued_renders = 0
+        other_plan = CustomSubscriptionPlan(pk=2, name="Enterprise", thumbnail_size=200)
+
+        with override_settings(
+            RENDER_ADMISSION={
+                "MAX_CONCURRENT": 2,
+                "MAX_QUEUED": 1,
+                "QUEUE_TIMEOUT": 5,
+                "RETRY_AFTER": 7,
+            }
+        ):
+            self.plan.max_concurrent_renders = 1
+            self.admission.acquire(self.plan)
+            with self.assertRaises(admission.RenderCapacityExceeded):
+                self.admission.acquire(self.plan)
+            self.admission.acquire(other_plan)
+
+        self.assertEqual(self.admission.stats(), {"active": 2, "queued": 0})
+
+    def test_upload_gets_503_with_retry_after_when_saturated(self):
+        user = self.create_user()
+        client = APIClient()
+        client.force_authenticate(user=user)
+        busy = admission.RenderAdmission()
+        busy.acquire(self.plan)
+
+        with mock.patch(
+            "ImageCraftApp.views.render_admission", busy
+        ), override_settings(
+            RENDER_ADMISSION={
+                "MAX_CONCURRENT": 1,
+                "MAX_QUEUED": 0,
+                "QUEUE_TIMEOUT": 5,
+                "RETRY_AFTER": 7,
+            }
+        ):
+            response = client.post(
+                "/upload/", {"title": "Koty", "image": make_image_file()}
+            )
+
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertEqual(response["Retry-After"], "7")
+        self.assertFalse(Image.objects.filter(title="Koty").exists())
+
+
+class MetricsTestCase(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+
+    def test_merges_worker_snapshots_and_keeps_dead_worker_counters(self):
+        with override_settings(METRICS_DIR=self.directory):
+            dead_worker = Metrics()
+            dead_worker.inc("imagecraft_worker_recycles_total", reason="rss")
+            dead_worker.set_gauge("imagecraft_worker_rss_bytes", 10)
+            dead_worker.flush()
+            os.rename(
+                os.path.join(self.directory, f"{os.getpid()}.json"),
+                os.path.join(self.directory, "123.json"),
+            )
+            mark_process_dead(123, self.directory)
+            worker = Metrics()
+            worker.inc("imagecraft_worker_recycles_total", reason="rss")
+            worker.set_gauge("imagecraft_worker_rss_bytes", 20)
+
+            rendered = worker.render()
+
+        self.assertIn('imagecraft_worker_recycles_total{reason="rss"} 2', rendered)
+        self.assertIn(
+            f'imagecraft_worker_rss_bytes{{pid="{os.getpid()}"}} 20', rendered
+        )
+        self.assertNotIn('pid="123"', rendered)
+
+    def test_watchdog_recycles_above_hard_limit(self):
+        watchdog = MemoryWatchdog(soft_limit=100 * 2**20, hard_limit=200 * 2**20)
+
+        with mock.patch.object(
+            memory_watchdog, "current_rss", return_value=300 * 2**20
+        ), mock.patch.object(
+            memory_watchdog, "trim_heap", return_value=False
+        ), mock.patch.object(
+            memory_watchdog.os, "kill"
+        ) as kill:
+            self.assertTrue(watchdog.check())
+
+        kill.assert_called_once_with(os.getpid(), signal.SIGTERM)
+        self.assertTrue(watchdog.stopped.is_set())
+
+    def test_watchdog_trims_heap_above_soft_limit(self):
+        watchdog = MemoryWatchdog(soft_limit=100 * 2**20, hard_limit=200 * 2**20)
+
+        with mock.patch.object(
+            memory_watchdog, "current_rss", side_effect=[150 * 2**20, 90 * 2**20]
+        ), mock.patch.object(
+            memory_watchdog, "trim_heap", return_value=True
+        ) as trim_heap, mock.patch.object(
+            memory_watchdog.os, "kill"
+        ) as kill:
+            self.assertFalse(watchdog.check())
+
+        trim_heap.assert_called_once()
+        kill.assert_not_called()
+
+    def test_metrics_endpoint_requires_staff(self):
+        client = APIClient()
+        client.force_authenticate(User.objects.create_user(username="user"))
+        self.assertEqual(client.get("/metrics/").status_code, status.HTTP_403_FORBIDDEN)
+
+        client.force_authenticate(
+            User.objects.create_user(username="staff", is_staff=True)
+        )
+        response = client.get("/metrics/")
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response["Content-Type"].startswith("text/plain"))
+
+
+class ColdStartTestCase(TestCase):
+    def test_loading_views_does_not_import_imaging_code(self):
+        code = (
+            "import sys, django; django.setup(); "
+            "import ImageCraftsman.urls; "
+            "print(sorted(m for m in ('PIL', 'ImageCraftApp.imaging') if m in sys.modules))"
+        )
+
+        result = subprocess.run(
+            [sys.executable, "-c", code],
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+
+        self.assertEqual(result.stdout.strip(), "[]")
+
+    def test_production_profile_has_no_debug_components(self):
+        code = (
+            "from django.conf import settings; "
+            "print(settings.DEBUG, 'debug_toolbar' in settings.INSTALLED_APPS)"
+        )
+        env = {
+            **os.environ,
+            "DEBUG": "True",
+            "DJANGO_SETTINGS_MODULE": "ImageCraftsman.settings_production",
+        }
+
+        result = subprocess.run(
+            [sys.executable, "-c", code],
+            capture_output=True,
+            text=True,
+            env=env,
+        )
+
+        self.assertEqual(result.stdout.strip(), "False False", result.stderr)
+
+
+class EdgeCacheTestCase(MediaRootTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = self.create_user()
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+        self.client.post("/upload/", {"title": "cached", "image": make_image_file()})
+        self.image = Image.objects.get(title="cached")
+
+    def serve(self):
+        return self.client.get(f"/serve-image/{self.image.pk}/Basic/")
+
+    @override_settings(SERVE_CACHE_MAX_TTL=3600)
+    def test_ttl_never_outlives_the_link(self):
+        self.image.expiration_date = timezone.now() + timezone.timedelta(seconds=120)
+        self.image.save()
+
+        response = self.serve()
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertLessEqual(int(response["X-Accel-Expires"]), 120)
+        self.assertGreater(int(response["X-Accel-Expires"]), 100)
+
+    @override_settings(SERVE_CACHE_MAX_TTL=30)
+    def test_ttl_capped_by_setting(self):
+        response = self.serve()
+
+        self.assertEqual(response["X-Accel-Expires"], "30")
+        self.assertEqual(response["Cache-Control"], "private, max-age=30")
+
+    def test_urls_carry_cache_version(self):
+        response = self.client.get(f"/image_detail/{self.image.pk}/")
+
+        self.assertTrue(response.data["thumbnail_Basic"].endswith("/Basic/?v=1"))
+
+    def test_expiry_change_invalidates(self):
+        with mock.patch("ImageCraftApp.models.purge") as purge:
+            self.image.expiration_date += timezone.timedelta(hours=1)
+            self.image.save(update_fields=["expiration_date"])
+
+        purge.assert_called_once_with(self.image.pk)
+        self.image.refresh_from_db()
+        self.assertEqual(self.image.cache_version, 2)
+
+    def test_unchanged_expiry_keeps_version(self):
+        with mock.patch("ImageCraftApp.models.purge") as purge:
+            self.image.title = "renamed"
+            self.image.save()
+
+        purge.assert_not_called()
+        self.image.refresh_from_db()
+        self.assertEqual(self.image.cache_version, 1)
+
+    def test_regeneration_invalidates(self):
+        with mock.patch("ImageCraftApp.edge_cache.purge") as purge:
+            thumbnails.generate_variants(self.image, {"thumbnail_Basic": 200})
+
+        purge.assert_called_once_with(self.image.pk)
+        self.image.refresh_from_db()
+        self.assertEqual(self.image.cache_version, 2)
+
+    @override_settings(EDGE_CACHE_PURGE_URL="http://nginx/purge/")
+    def test_delete_sends_purge(self):
+        run_inline = mock.Mock(
+            side_effect=lambda target, daemon: mock.Mock(start=target)
+        )
+        with mock.patch.object(
+            edge_cache.threading, "Thread", run_inline
+        ), mock.patch.object(edge_cache.urllib.request, "urlopen") as urlopen:
+            pk = self.image.pk
+            self.image.delete()
+
+        request = urlopen.call_args.args[0]
+        self.assertEqual(request.method, "PURGE")
+        self.assertEqual(request.full_url, f"http://nginx/purge/serve-image/{pk}/*")
+
+    def test_hit_ratio_command(self):
+        log_path = os.path.join(tempfile.mkdtemp(), "access.log")
+        self.addCleanup(shutil.rmtree, os.path.dirname(log_path))
+        line = '10.0.0.1 [19/Oct/2026:10:00:00 +0000] "GET {} HTTP/1.1" 200 512 cache={} rt=0.001\n'
+        with open(log_path, "w") as log:
+            log.write(line.format("/serve-image/1/?q=a&v=1", "HIT") * 3)
+            log.write(line.format("/serve-image/1/?q=a&v=1", "MISS"))
+            log.write(line.format("/image_detail/1/", "-"))
+        stdout = StringIO()
+
+        call_command("cache_hit_ratio", log_path, stdout=stdout)
+
+        self.assertIn("Hit ratio: 75.0% of 4 requests", stdout.getvalue())
+
+
+class PixelBudgetTestCase(MediaRootTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = self.create_user()
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+
+    def upload(self, image_file):
+        return self.client.post("/upload/", {"title": "huge", "image": image_file})
+
+    @override_settings(MAX_IMAGE_PIXELS=100_000)
+    def test_upload_over_pixel_limit_rejected(self):
+        response = self.upload(make_image_file())
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("pixels", response.data["image"][0])
+        self.assertFalse(Image.objects.exists())
+
+    @override_settings(MAX_IMAGE_PIXELS=100_000)
+    def test_plan_pixel_limit_overrides_default(self):
+        CustomSubscriptionPlan.objects.filter(name="Basic").update(max_pixels=1_000_000)
+
+        response = self.upload(make_image_file())
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+    @override_settings(THUMBNAIL_DECODE_PIXELS=100_000)
+    def test_undecodable_within_budget_rejected(self):
+        # Without libvips, PNG cannot be decoded at a reduced scale or in bands.
+        with mock.patch.object(imaging, "_vips", return_value=None):
+            response = self.upload(make_image_file("photo.png", format="PNG"))
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("too large to process", response.data["image"][0])
+        self.assertFalse(Image.objects.exists())
+
+    @unittest.skipUnless(HAS_VIPS, "pyvips and libvips are not installed")
+    @override_settings(THUMBNAIL_DECODE_PIXELS=100_000)
+    def test_compressed_original_over_budget_decoded_with_vips(self):
+        response = self.upload(make_image_file("photo.png", format="PNG"))
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        image = Image.objects.get()
+        with PILImage.open(image.thumbnail_Basic.path) as thumbnail:
+            self.assertEqual(thumbnail.size, (200, 150))
+            for channel, expected in zip(thumbnail.getpixel((100, 75)), (200, 120, 40)):
+                self.assertAlmostEqual(channel, expected, delta=2)
+
+    @override_settings(THUMBNAIL_DECODE_PIXELS=100_000)
+    def test_uncompressed_original_thumbnailed_in_bands(self):
+        response = self.upload(make_image_file("photo.tiff", format="TIFF"))
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        image = Image.objects.get()
+        with PILImage.open(image.thumbnail_Basic.path) as thumbnail:
+            self.assertEqual(thumbnail.size, (200, 150))
+            for channel, expected in zip(thumbnail.getpixel((100, 75)), (200, 120, 40)):
+                self.assertAlmostEqual(channel, expected, delta=2)
+
+    def peak_rss_increase(self, path, decode_pixels):
+        # VmHWM starts afresh in the new process, unlike ru_maxrss which is
+        # inherited from the test runner across exec.
+        code = (
+            "import re, sys\n"
+            "from ImageCraftApp.imaging import open_within_budget\n"
+            "def peak():\n"
+            "    with open('/proc/self/status') as f:\n"
+            "        return int(re.search(r'VmHWM:\\s+(\\d+)', f.read())[1])\n"
+            "before = peak()\n"
+            "open_within_budget(sys.argv[1], 200, int(sys.argv[2])).thumbnail((200, 200))\n"
+            "print(peak() - before)\n"
+        )
+        result = subprocess.run(
+            [sys.executable, "-c", code, path, str(decode_pixels)],
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+        return int(result.stdout) * 1024
+
+    def test_peak_memory_stays_within_budget(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        original = PILImage.linear_gradient("L").resize((8000, 8000))
+        for name in ("huge.tiff", "huge.jpg"):
+            original.save(os.path.join(directory, name))
+        del original
+        budget = 1_000_000
+
+        for name in ("huge.tiff", "huge.jpg"):
+            with self.subTest(name):
+                path = os.path.join(directory, name)
+                # Decoding in full needs 64MB for these 64M single-byte pixels.
+                self.assertGreater(self.peak_rss_increase(path, 10**9), 60 * 2**20)
+                self.assertLess(self.peak_rss_increase(path, budget), 8 * 2**20)
+
+
+class ResizeEngineContract:
+    """
+    Behaviour every resize engine must share.
+    """
+
+    def get_engine(self):
+        raise NotImplementedError
+
+    def render(self, sizes=(200, 400), **save_kwargs):
+        original = make_image_file(size=(640, 480), **save_kwargs)
+        with tempfile.NamedTemporaryFile(suffix=".jpg") as original_file:
+            original_file.write(original.read())
+            original_file.flush()
+            return self.get_engine().render(original_file.name, sizes)
+
+    def test_renders_every_size_as_jpeg(self):
+        rendered = self.render()
+
+        self.assertEqual(sorted(rendered), [200, 400])
+        for size, expected in ((200, (200, 150)), (400, (400, 300))):
+            with PILImage.open(rendered[size]) as thumbnail:
+                self.assertEqual(thumbnail.format, "JPEG")
+                self.assertEqual(thumbnail.size, expected)
+                for channel, value in zip(
+                    thumbnail.convert("RGB").getpixel((50, 50)), (200, 120, 40)
+                ):
+                    self.assertAlmostEqual(channel, value, delta=3)
+
+    def test_never_upscales(self):
+        rendered = self.render(sizes=(1000,))
+
+        with PILImage.open(rendered[1000]) as thumbnail:
+            self.assertEqual(thumbnail.size, (640, 480))
+
+    def test_exif_orientation_is_applied(self):
+        exif = PILImage.Exif()
+        exif[0x0112] = 6  # Rotated 90 degrees clockwise
+
+        rendered = self.render(exif=exif.tobytes())
+
+        with PILImage.open(rendered[200]) as thumbnail:
+            self.assertEqual(thumbnail.size, (150, 200))
+
+    def test_metadata_is_stripped(self):
+        icc_profile = ImageCms.ImageCmsProfile(ImageCms.createProfile("sRGB")).tobytes()
+        exif = PILImage.Exif()
+        exif[0x010F] = "Camera maker"
+
+        rendered = self.render(icc_profile=icc_profile, exif=exif.tobytes())
+
+        for thumbnail_io in rendered.values():
+            with PILImage.open(thumbnail_io) as thumbnail:
+                self.assertNotIn("icc_profile", thumbnail.info)
+                self.assertNotIn("exif", thumbnail.info)
+
+
+class PillowEngineTestCase(ResizeEngineContract, TestCase):
+    def get_engine(self):
+        return resize_engines.PillowEngine()
+
+    def test_cmyk_profile_applied_before_flattening(self):
+        original_io = BytesIO()
+        PILImage.new("CMYK", (640, 480), (0, 160, 220, 40)).save(
+            original_io, "JPEG", icc_profile=b"cmyk profile"
+        )
+        profiled = PILImage.new("RGB", (400, 300), (10, 200, 30))
+
+        with tempfile.NamedTemporaryFile(
+            suffix=".jpg"
+        ) as original_file, mock.patch.object(
+            imaging, "_srgb_transform"
+        ) as srgb_transform, mock.patch.object(
+            ImageCms, "applyTransform", return_value=profiled
+        ):
+            original_file.write(original_io.getvalue())
+            original_file.flush()
+            rendered = self.get_engine().render(original_file.name, [200])
+
+        srgb_transform.assert_called_once_with(b"cmyk profile", "CMYK")
+        with PILImage.open(rendered[200]) as thumbnail:
+            for channel, value in zip(thumbnail.getpixel((50, 50)), (10, 200, 30)):
+                self.assertAlmostEqual(channel, value, delta=3)
+
+
+@unittest.skipUnless(HAS_VIPS, "pyvips and libvips are not installed")
+class VipsEngineTestCase(ResizeEngineContract, TestCase):
+    def get_engine(self):
+        return resize_engines.VipsEngine()
+
+
+class ResizeEngineSelectionTestCase(TestCase):
+    def setUp(self):
+        resize_engines._load_engine.cache_clear()
+        self.addCleanup(resize_engines._load_engine.cache_clear)
+
+    def test_pillow_by_default(self):
+        self.assertEqual(resize_engines.get_engine().name, "pillow")
+
+    @override_settings(THUMBNAIL_ENGINE="vips")
+    def test_falls_back_to_pillow_without_vips(self):
+        with mock.patch.dict(sys.modules, {"pyvips": None}):
+            engine = resize_engines.get_engine()
+
+        self.assertEqual(engine.name, "pillow")
+
+    @override_settings(THUMBNAIL_ENGINE="magick")
+    def test_unknown_engine_is_a_configuration_error(self):
+        with self.assertRaises(ImproperlyConfigured):
+            resize_engines.get_engine()
+
+    def test_streaming_engine_skips_decode_budget(self):
+        engine = mock.Mock(decode_pixels=None)
+        user = User.objects.create_user(username="owner", password="testpassword")
+        client = APIClient()
+        client.force_authenticate(user=user)
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+
+        with override_settings(
+            MEDIA_ROOT=media_root, THUMBNAIL_DECODE_PIXELS=100_000
+        ), mock.patch.object(
+            resize_engines, "get_engine", return_value=engine
+        ), mock.patch.object(
+            thumbnails, "get_engine", return_value=resize_engines.PillowEngine(10**9)
+        ):
+            response = client.post(
+                "/upload/",
+                {"title": "png", "image": make_image_file("p.png", format="PNG")},
+            )
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+
+class FastRenderingTestCase(MediaRootTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = self.create_user(plan="Premium")
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+        for title in ("first", "second", "third"):
+            self.client.post("/upload/", {"title": title, "image": make_image_file()})
+        self.images = list(Image.objects.filter(user=self.user).order_by("pk"))
+
+    def test_renderer_matches_drf_json(self):
+        data = {
+            "detail": ErrorDetail("Not found.", code="not_found"),
+            "price": Decimal("1.50"),
+            "label": gettext_lazy("Thumbnail"),
+            "when": timezone.datetime(2026, 1, 2, 3, 4, 5),
+            1: "ü",
+        }
+
+        rendered = ORJSONRenderer().render(data)
+
+        self.assertEqual(
+            json.loads(rendered),
+            json.loads(JSONRenderer().render(data)),
+        )
+
+    def test_many_images_share_one_base_url_and_plan_lookup(self):
+        request = APIRequestFactory().get("/image_detail/")
+        request.user = self.user
+
+        with mock.patch.object(
+            request, "build_absolute_uri", wraps=request.build_absolute_uri
+        ) as build_absolute_uri, self.assertNumQueries(1):
+            data = ImageSerializer(
+                self.images, many=True, context={"request": request}
+            ).data
+
+        build_absolute_uri.assert_called_once_with("/")
+        self.assertEqual(
+            data[1]["original_image"],
+            f"http://testserver/serve-image/{self.images[1].pk}/original/?v=1",
+        )
+        self.assertEqual(
+            set(data[0]),
+            {
+                "thumbnail_Basic",
+                "thumbnail_premium_url",
+                "original_image",
+                "placeholder",
+            },
+        )
+
+    def test_api_responds_with_orjson(self):
+        response = self.client.get(f"/image_detail/{self.images[0].pk}/")
+
+        self.assertEqual(response["Content-Type"], "application/json")
+        self.assertIsInstance(response.accepted_renderer, ORJSONRenderer)
+        self.assertEqual(json.loads(response.content), response.data)
+
+
+class ServeIndexTestCase(MediaRootTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = self.create_user(plan="Premium")
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+        self.client.post("/upload/", {"title": "indexed", "image": make_image_file()})
+        self.image = Image.objects.get(title="indexed")
+
+    def test_variant_served_without_image_query(self):
+        # Only the requester's subscription plan is read from the database.
+        with self.assertNumQueries(1):
+            response = self.client.get(f"/serve-image/{self.image.pk}/Premium/")
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        with PILImage.open(BytesIO(response.content)) as thumbnail:
+            self.assertEqual(thumbnail.size, (400, 300))
+
+    def test_index_rebuilt_after_cache_loss(self):
+        cache.clear()
+
+        response = self.client.get(f"/serve-image/{self.image.pk}/original/")
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response["Content-Type"], "image/jpeg")
+
+    def test_legacy_path_limited_to_own_files(self):
+        own = self.client.get(
+            f"/serve-image/{self.image.pk}/?q={self.image.thumbnail_Basic.path}"
+        )
+        foreign = self.client.get(f"/serve-image/{self.image.pk}/?q=/etc/passwd")
+
+        self.assertEqual(own.status_code, status.HTTP_200_OK)
+        self.assertEqual(foreign.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_variant_outside_plan_forbidden(self):
+        self.set_plan(self.user, "Basic")
+
+        response = self.client.get(f"/serve-image/{self.image.pk}/original/")
+
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_other_users_image_not_found(self):
+        other = APIClient()
+        other.force_authenticate(user=self.create_user(username="other"))
+
+        response = other.get(f"/serve-image/{self.image.pk}/Basic/")
+
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_index_follows_expiry_and_deletion(self):
+        self.set_plan(self.user, "Basic")
+        self.image.expiration_date = timezone.now() - timezone.timedelta(seconds=1)
+        self.image.save()
+
+        expired = self.client.get(f"/serve-image/{self.image.pk}/Basic/")
+        self.image.delete()
+        deleted = self.client.get(f"/serve-image/{self.image.pk}/Basic/")
+
+        self.assertEqual(expired.status_code, status.HTTP_403_FORBIDDEN)
+        self.assertEqual(deleted.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class StorageUsageTestCase(MediaRootTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = self.create_user()
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+
+    def upload(self, title="counted"):
+        return self.client.post(
+            "/upload/", {"title": title, "image": make_image_file()}
+        )
+
+    def profile(self):
+        return UserProfile.objects.get(user=self.user)
+
+    def set_quota(self, **quota):
+        plan = CustomSubscriptionPlan.objects.get(name="Basic")
+        # Saved rather than updated, so the cached plan is dropped.
+        for field, value in quota.items():
+            setattr(plan, field, value)
+        plan.save()
+        # The quota plan gets cached but its rows are rolled back.
+        self.addCleanup(cache.clear)
+
+    def test_upload_counts_original_and_thumbnail(self):
+        self.upload()
+
+        image = Image.objects.get()
+        profile = self.profile()
+        self.assertEqual(profile.image_count, 1)
+        self.assertEqual(profile.original_bytes, image.image.size)
+        self.assertEqual(profile.thumbnail_basic_bytes, image.thumbnail_Basic.size)
+        self.assertEqual(profile.thumbnail_premium_bytes, 0)
+
+    def test_lazy_variant_and_regeneration_adjust_usage(self):
+        self.upload()
+        self.set_plan(self.user, "Premium")
+        image = Image.objects.get()
+        self.client.get(f"/serve-image/{image.pk}/Premium/")
+        image.refresh_from_db()
+        self.assertEqual(
+            self.profile().thumbnail_premium_bytes, image.thumbnail_Premium.size
+        )
+
+        thumbnails.generate_variants(image, {"thumbnail_Basic": 100})
+
+        self.assertEqual(
+            self.profile().thumbnail_basic_bytes, image.thumbnail_Basic.size
+        )
+
+    def test_delete_releases_usage(self):
+        self.upload()
+
+        Image.objects.get().delete()
+
+        profile = self.profile()
+        self.assertEqual(profile.image_count, 0)
+        self.assertEqual(profile.storage_bytes, 0)
+
+    def test_image_quota(self):
+        self.set_quota(max_images=1)
+        self.upload()
+
+        response = self.upload("second")
+
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        self.assertEqual(response.data["detail"].code, "quota_exceeded")
+        self.assertEqual(Image.objects.count(), 1)
+
+    def test_storage_quota(self):
+        self.set_quota(max_storage_bytes=1000)
+
+        response = self.upload()
+
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        self.assertFalse(Image.objects.exists())
+
+    def test_reconcile_repairs_drift(self):
+        self.upload()
+        expected = self.profile()
+        UserProfile.objects.filter(user=self.user).update(
+            image_count=5, original_bytes=0
+        )
+
+        call_command("reconcile_storage_usage", dry_run=True, stdout=StringIO())
+        self.assertEqual(self.profile().image_count, 5)
+        stdout = StringIO()
+        call_command("reconcile_storage_usage", stdout=stdout)
+
+        profile = self.profile()
+        self.assertEqual(profile.image_count, 1)
+        self.assertEqual(profile.storage_bytes, expected.storage_bytes)
+        self.assertIn("Repaired drift for 1 users.", stdout.getvalue())
+
+
+class ProgressEventsTestCase(MediaRootTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = self.create_user(plan="Premium")
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+        self.backend = events.InProcessBackend(queue_size=2)
+        backend_patch = mock.patch.object(
+            events, "get_backend", return_value=self.backend
+        )
+        backend_patch.start()
+        self.addCleanup(backend_patch.stop)
+
+    def test_broker_delivers_across_threads_and_drops_oldest(self):
+        async def scenario():
+            with self.backend.broker.subscribe(self.user.pk) as subscription:
+                publisher = threading.Thread(
+                    target=lambda: [
+                        self.backend.publish(self.user.pk, {"n": n}) for n in range(3)
+                    ]
+                )
+                publisher.start()
+                publisher.join()
+                self.backend.publish(self.user.pk + 1, {"n": "other user"})
+                received = [await subscription.get(1) for _ in range(2)]
+                return received, await subscription.get(0.01)
+
+        received, idle = async_to_sync(scenario)()
+
+        self.assertEqual(received, [{"n": 1}, {"n": 2}])
+        self.assertIsNone(idle)
+        self.assertEqual(self.backend.broker.subscriber_count(), 0)
+
+    def test_upload_publishes_progress(self):
+        with mock.patch.object(events, "publish") as publish:
+            self.client.post("/upload/", {"title": "Koty", "image": make_image_file()})
+
+        image = Image.objects.get()
+        self.assertEqual(
+            publish.call_args_list,
+            [
+                mock.call(image, events.RECEIVED),
+                mock.call(image, events.VARIANT, variant="Basic"),
+                mock.call(image, events.VARIANT, variant="Premium"),
+            ],
+        )
+
+    def test_failed_upload_publishes_failure(self):
+        with mock.patch.object(events, "publish") as publish, mock.patch.object(
+            thumbnails, "render_thumbnails", side_effect=OSError("broken")
+        ):
+            with self.assertRaises(OSError):
+                self.client.post(
+                    "/upload/", {"title": "Koty", "image": make_image_file()}
+                )
+
+        self.assertEqual(
+            [call.args[1] for call in publish.call_args_list],
+            [events.RECEIVED, events.FAILED],
+        )
+
+    @override_settings(PROGRESS_EVENTS={"HEARTBEAT": 0.05})
+    def test_stream_sends_events_of_requested_images(self):
+        response = self.client.get(
+            "/upload/events/?image=7", HTTP_ACCEPT="text/event-stream"
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response["Content-Type"], "text/event-stream")
+        self.assertEqual(response["X-Accel-Buffering"], "no")
+
+        async def read():
+            stream = response.streaming_content
+            chunks = [await anext(stream)]
+            self.backend.publish(self.user.pk, {"event": "received", "image": 6})
+            self.backend.publish(
+                self.user.pk, {"event": "variant", "image": 7, "variant": "Basic"}
+            )
+            chunks.append(await anext(stream))
+            chunks.append(await anext(stream))
+            await stream.aclose()
+            return chunks
+
+        self.assertEqual(
+            async_to_sync(read)(),
+            [
+                b"retry: 3000\n\n",
+                b'event: variant\ndata: {"image": 7, "variant": "Basic"}\n\n',
+                b": keepalive\n\n",
+            ],
+        )
+
+    def test_lost_listener_connection_is_reopened(self):
+        backend = events.PostgresBackend(queue_size=2)
+        connections = [mock.Mock(), mock.Mock()]
+        for connection in connections:
+            connection.is_closed.return_value = False
+
+        async def connect():
+            backend._connection = connections.pop(0)
+
+        async def scenario():
+            with mock.patch.object(
+                backend, "_connect", side_effect=connect
+            ), mock.patch.object(events, "RECONNECT_DELAYS", (0,)):
+                async with backend.subscribe(self.user.pk):
+                    first = backend._connection
+                    backend._on_terminated(first)
+                    await backend._reconnecting
+                    return first, backend._connection
+
+        first, second = async_to_sync(scenario)()
+
+        self.assertIsNot(first, second)
+        self.assertIsNotNone(second)
+
+    def test_streams_are_told_when_reconnecting_fails(self):
+        backend = events.PostgresBackend(queue_size=2)
+        connection = mock.Mock()
+        connection.is_closed.return_value = False
+        connects = iter([connection])
+
+        async def connect():
+            # Only the first connection succeeds.
+            backend._connection = next(connects, None)
+            if backend._connection is None:
+                raise OSError("connection refused")
+
+        async def scenario():
+            with mock.patch.object(
+                backend, "_connect", side_effect=connect
+            ), mock.patch.object(events, "RECONNECT_DELAYS", (0,)):
+                async with backend.subscribe(self.user.pk) as subscription:
+                    backend._on_terminated(connection)
+                    event = await subscription.get(1)
+                    backend._reconnecting.cancel()
+                    return event
+
+        event = async_to_sync(scenario)()
+
+        self.assertEqual(event["event"], events.INTERRUPTED)
+
+    def test_stream_requires_authentication(self):
+        response = APIClient().get("/upload/events/")
+
+        self.assertIn(
+            response.status_code,
+            (status.HTTP_401_UNAUTHORIZED, status.HTTP_403_FORBIDDEN),
+        )
+
+
+class TransformFusionTestCase(TestCase):
+    def fuse(self, spec, size=(400, 200)):
+        return transforms.fuse(spec, size)
+
+    def test_equivalent_chains_share_a_key(self):
+        self.assertEqual(
+            self.fuse("rotate:90/rotate:270/fit:contain,100,100").key,
+            self.fuse("fit:contain,100,100").key,
+        )
+        self.assertEqual(
+            self.fuse("square/fit:fill,50,50").key,
+            self.fuse("fit:cover,50,50").key,
+        )
+        self.assertNotEqual(self.fuse("format:png").key, self.fuse("format:webp").key)
+
+    def test_crop_after_rotation_maps_to_source(self):
+        # Rotated clockwise, the left edge of the source is on top.
+        transformation = self.fuse("rotate:90/crop:0,0,200,100")
+
+        self.assertEqual(transformation.box, (0, 0, 100, 200))
+        self.assertEqual(transformation.rotation, 90)
+        self.assertEqual(transformation.size, (200, 100))
+
+    def test_crop_after_resize_maps_to_source(self):
+        transformation = self.fuse("fit:contain,200,200/crop:50,0,50,100/rotate:-90")
+
+        self.assertEqual(transformation.box, (100, 0, 200, 200))
+        self.assertEqual(transformation.rotation, 270)
+        self.assertEqual(transformation.size, (100, 50))
+
+    def test_contain_never_enlarges(self):
+        self.assertEqual(self.fuse("fit:contain,800,800").size, (400, 200))
+        self.assertEqual(self.fuse("fit:fill,800,800").size, (800, 800))
+
+    def test_invalid_specs(self):
+        for spec in (
+            "",
+            "blur:3",
+            "rotate:45",
+            "crop:0,0,10",
+            "fit:stretch,10,10",
+            "fit:fill,10000,10",
+            "quality:100",
+            "crop:500,0,10,10",
+            "/".join(["square"] * (transforms.MAX_OPERATIONS + 1)),
+        ):
+            with self.subTest(spec=spec), self.assertRaises(ValueError):
+                self.fuse(spec)
+
+
+class TransformImageViewTestCase(MediaRootTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = self.create_user()
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+        # Left half red, right half blue.
+        source = PILImage.new("RGB", (400, 200), (255, 0, 0))
+        source.paste((0, 0, 255), (200, 0, 400, 200))
+        image_io = BytesIO()
+        source.save(image_io, "PNG")
+        self.client.post(
+            "/upload/",
+            {
+                "title": "halves",
+                "image": SimpleUploadedFile("halves.png", image_io.getvalue()),
+            },
+        )
+        self.image = Image.objects.get()
+        self.addCleanup(cache.clear)
+
+    def allow_transformations(self, **fields):
+        plan = CustomSubscriptionPlan.objects.get(name="Basic")
+        plan.transformations = True
+        for field, value in fields.items():
+            setattr(plan, field, value)
+        plan.save()
+
+    def get(self, spec):
+        return self.client.get(f"/serve-image/{self.image.pk}/t/{spec}/")
+
+    def test_renders_fused_chain(self):
+        self.allow_transformations()
+
+        response = self.get(
+            "crop:200,0,200,200/rotate:90/fit:contain,100,100/format:png"
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response["Content-Type"], "image/png")
+        with PILImage.open(BytesIO(response.content)) as rendered:
+            self.assertEqual(rendered.size, (100, 100))
+            self.assertEqual(rendered.getpixel((50, 50)), (0, 0, 255))
+
+    def test_rotation_moves_pixels(self):
+        self.allow_transformations()
+
+        response = self.get("fit:contain,200,200/rotate:90/format:png")
+
+        with PILImage.open(BytesIO(response.content)) as rendered:
+            self.assertEqual(rendered.size, (100, 200))
+            # The red left half ends up on top.
+            self.assertEqual(rendered.getpixel((50, 20)), (255, 0, 0))
+            self.assertEqual(rendered.getpixel((50, 180)), (0, 0, 255))
+
+    def test_equivalent_chains_render_once(self):
+        self.allow_transformations()
+
+        with mock.patch.object(transforms, "render", wraps=transforms.render) as render:
+            first = self.get("square/fit:fill,64,64")
+            second = self.get("rotate:180/rotate:180/fit:cover,64,64")
+
+        self.assertEqual(render.call_count, 1)
+        self.assertEqual(first.content, second.content)
+
+    def test_large_outputs_are_not_cached(self):
+        self.allow_transformations()
+
+        with mock.patch.object(
+            transforms, "TRANSFORM_CACHE_MAX_SIZE", 10
+        ), mock.patch.object(transforms, "render", wraps=transforms.render) as render:
+            first = self.get("fit:fill,64,64")
+            second = self.get("fit:fill,64,64")
+
+        self.assertEqual(render.call_count, 2)
+        self.assertEqual(first.content, second.content)
+
+    def test_transparency_becomes_white_in_jpeg(self):
+        self.allow_transformations()
+        source = PILImage.new("RGBA", (100, 100), (0, 0, 0, 0))
+        image_io = BytesIO()
+        source.save(image_io, "PNG")
+        self.client.post(
+            "/upload/",
+            {
+                "title": "clear",
+                "image": SimpleUploadedFile("clear.png", image_io.getvalue()),
+            },
+        )
+        clear = Image.objects.get(title="clear")
+
+        response = self.client.get(
+            f"/serve-image/{clear.pk}/t/fit:fill,50,50/format:jpeg/"
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        with PILImage.open(BytesIO(response.content)) as rendered:
+            self.assertGreater(min(rendered.getpixel((25, 25))), 250)
+
+    def test_limited_by_plan(self):
+        response = self.get("square")
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+        self.allow_transformations(max_transform_size=150)
+        self.assertEqual(
+            self.get("fit:contain,300,300").status_code, status.HTTP_403_FORBIDDEN
+        )
+        self.assertEqual(
+            self.get("fit:contain,150,150").status_code, status.HTTP_200_OK
+        )
+
+    def test_invalid_spec(self):
+        self.allow_transformations()
+
+        response = self.get("rotate:45")
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("spec", response.json())
+
+
+def make_pattern_file(name="pattern.jpg", size=(640, 480), seed=0, brightness=0):
+    """
+    Make a JPEG of a coarse random grid, so different seeds look different.
+    """
+    import random
+
+    rng = random.Random(seed)
+    grid = PILImage.new("L", (8, 6))
+    grid.putdata([rng.randrange(256) for _ in range(48)])
+    image = grid.resize(size, PILImage.Resampling.NEAREST).point(
+        lambda value: min(255, value + brightness)
+    )
+    image_io = BytesIO()
+    image.convert("RGB").save(image_io, "JPEG", quality=90)
+    return SimpleUploadedFile(name, image_io.getvalue(), content_type="image/jpeg")
+
+
+class NearDuplicateTestCase(MediaRootTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = self.create_user()
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+
+    def upload(self, title, image, policy=None):
+        url = "/upload/" if policy is None else f"/upload/?duplicates={policy}"
+        return self.client.post(url, {"title": title, "image": image})
+
+    def test_hash_chunks_round_trip(self):
+        value = 0xF0E1D2C3B4A59687
+        fields = duplicates.hash_fields(value)
+
+        self.assertLess(fields["phash"], 0)
+        self.assertEqual(duplicates.unsigned(fields["phash"]), value)
+        self.assertEqual(
+            [fields[field] for field in duplicates.CHUNK_FIELDS],
+            [0xF0E1, 0xD2C3, 0xB4A5, 0x9687],
+        )
+
+    def test_lookup_finds_every_hash_within_distance(self):
+        base = 0x0123456789ABCDEF
+        for distance in (1, 4, 7, duplicates.MAX_DISTANCE):
+            flipped = base
+            for bit in range(0, 64, 64 // distance)[:distance]:
+                flipped ^= 1 << bit
+            image = Image.objects.create(
+                title=str(distance),
+                image="images/x.jpg",
+                user=self.user,
+                **duplicates.hash_fields(flipped),
+            )
+            with self.subTest(distance=distance):
+                found = dict(
+                    duplicates.find_near_duplicates(
+                        Image.objects.filter(user=self.user),
+                        duplicates.hash_fields(base)["phash"],
+                        distance,
+                    )
+                )
+                self.assertEqual(found.get(image.pk), distance)
+                self.assertTrue(all(value <= distance for value in found.values()))
+
+    def test_upload_warns_about_recompressed_copy(self):
+        self.upload("first", make_pattern_file(seed=1))
+        self.upload("other", make_pattern_file(seed=2))
+        first, other = Image.objects.order_by("pk")
+
+        response = self.upload(
+            "copy", make_pattern_file(size=(320, 240), seed=1, brightness=3)
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(
+            [match["id"] for match in response.data["duplicates"]], [first.pk]
+        )
+        copy = Image.objects.get(title="copy")
+        listed = self.client.get(f"/image_detail/{copy.pk}/duplicates/").json()
+        self.assertEqual([match["id"] for match in listed], [first.pk])
+        self.assertEqual(listed[0]["title"], "first")
+
+    def test_upload_rejects_duplicate(self):
+        self.upload("first", make_pattern_file(seed=1))
+
+        response = self.upload("copy", make_pattern_file(seed=1), policy="reject")
+
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(Image.objects.count(), 1)
+        self.assertEqual(UserProfile.objects.get(user=self.user).image_count, 1)
+        first = Image.objects.get()
+        stored = {
+            os.path.relpath(os.path.join(directory, name), settings.MEDIA_ROOT)
+            for directory, _, names in os.walk(settings.MEDIA_ROOT)
+            for name in names
+        }
+        self.assertEqual(
+            stored,
+            {
+                first.image.name,
+                first.thumbnail_Basic.name,
+                first.thumbnail_Premium.name,
+            }
+            - {""},
+        )
+
+    def test_allow_skips_lookup(self):
+        self.upload("first", make_pattern_file(seed=1))
+
+        with mock.patch.object(duplicates, "find_near_duplicates") as lookup:
+            response = self.upload("copy", make_pattern_file(seed=1), policy="allow")
+
+        lookup.assert_not_called()
+        self.assertNotIn("duplicates", response.data)
+
+    def test_hash_images_command_backfills(self):
+        self.upload("first", make_pattern_file(seed=1))
+        image = Image.objects.get()
+        Image.objects.update(phash=None, phash_0=None)
+
+        call_command("hash_images", stdout=StringIO())
+
+        self.assertEqual(Image.objects.get().phash, image.phash)
+
+
+class DominantColourTestCase(MediaRootTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = self.create_user()
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+
+    def upload(self, title, colour, accent=None):
+        source = PILImage.new("RGB", (400, 300), colour)
+        if accent:
+            source.paste(accent, (0, 0, 400, 100))
+        image_io = BytesIO()
+        source.save(image_io, "PNG")
+        self.client.post(
+            "/upload/",
+            {
+                "title": title,
+                "image": SimpleUploadedFile(f"{title}.png", image_io.getvalue()),
+            },
+        )
+        return Image.objects.get(title=title)
+
+    def test_palette_and_histogram(self):
+        image = PILImage.new("RGB", (100, 100), (250, 10, 10))
+        image.paste((10, 10, 240), (0, 0, 100, 25))
+
+        palette, histogram = imaging.dominant_colours(image)
+
+        self.assertEqual(
+            palette,
+            [(48, (250, 10, 10), 0.75), (3, (10, 10, 240), 0.25)],
+        )
+        self.assertEqual(len(histogram), 64)
+        self.assertEqual((histogram[48], histogram[3]), (191, 64))
+
+    def test_bins_within_distance(self):
+        self.assertEqual(colours.bins_within((32, 32, 32), 10), [0])
+        self.assertEqual(len(colours.bins_within((64, 64, 64), 1)), 4)
+        self.assertEqual(len(colours.bins_within((64, 64, 64), 2)), 8)
+        self.assertEqual(len(colours.bins_within((0, 0, 0), 500)), 64)
+
+    def test_upload_stores_colours(self):
+        image = self.upload("sunset", (255, 120, 0), accent=(20, 20, 120))
+
+        # The Basic thumbnail is a JPEG, so colours and shares are approximate.
+        stored = ImageColour.objects.filter(image=image).order_by("-share")[:2]
+        for colour, (expected, share) in zip(
+            stored, [((255, 120, 0), 0.67), ((20, 20, 120), 0.33)]
+        ):
+            rgb = colours.parse_colour(colours.to_hex(colour.rgb))
+            self.assertLess(math.dist(rgb, expected), 4)
+            self.assertAlmostEqual(colour.share, share, places=1)
+        self.assertEqual(bytes(image.colour_histogram)[colours.LEVELS**3 - 1], 0)
+
+    def test_search_ranks_by_distance(self):
+        orange = self.upload("orange", (255, 120, 0))
+        red = self.upload("red", (240, 90, 20))
+        self.upload("blue", (0, 60, 230))
+
+        response = self.client.get("/search/colour/?colour=ff7000")
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [match["id"] for match in response.json()], [orange.pk, red.pk]
+        )
+        self.assertLess(response.json()[0]["distance"], response.json()[1]["distance"])
+
+    def test_search_skips_distant_colours(self):
+        self.upload("orange", (255, 120, 0))
+
+        response = self.client.get("/search/colour/?colour=0000ff&distance=30")
+
+        self.assertEqual(response.json(), [])
+        # Only the blue corner bin is read.
+        self.assertEqual(colours.bins_within((0, 0, 255), 30), [3])
+
+    def test_search_validates_parameters(self):
+        for query in (
+            "colour=orange",
+            "colour=ff8800&distance=0",
+            "colour=ff8800&limit=x",
+        ):
+            with self.subTest(query=query):
+                response = self.client.get(f"/search/colour/?{query}")
+                self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+def make_animation_file(frames=6, size=(320, 240), duration=40, format="GIF"):
+    # Distinct colours, so that encoders do not merge frames.
+    colours = [
+        (255, 0, 0),
+        (0, 255, 0),
+        (0, 0, 255),
+        (255, 255, 0),
+        (0, 255, 255),
+        (255, 0, 255),
+        (128, 0, 0),
+        (0, 128, 0),
+        (0, 0, 128),
+        (128, 128, 0),
+    ]
+    images = [
+        PILImage.new("RGB", size, colours[index % len(colours)])
+        for index in range(frames)
+    ]
+    image_io = BytesIO()
+    images[0].save(
+        image_io,
+        format,
+        save_all=True,
+        append_images=images[1:],
+        duration=duration,
+        loop=0,
+    )
+    return SimpleUploadedFile(
+        f"animation.{format.lower()}",
+        image_io.getvalue(),
+        content_type=f"image/{format.lower()}",
+    )
+
+
+class AnimatedThumbnailTestCase(MediaRootTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = self.create_user(plan="Premium")
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+
+    def upload(self, image):
+        response = self.client.post("/upload/", {"title": "moving", "image": image})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        return Image.objects.get(title="moving")
+
+    def test_animated_gif_keeps_its_frames(self):
+        image = self.upload(make_animation_file(frames=6, duration=40))
+
+        for field in (image.thumbnail_Basic, image.thumbnail_Premium):
+            self.assertTrue(field.name.endswith(".webp"))
+            with PILImage.open(field.path) as thumbnail:
+                self.assertTrue(thumbnail.is_animated)
+                self.assertEqual(thumbnail.n_frames, 6)
+                thumbnail.seek(1)
+                self.assertEqual(
+                    thumbnail.convert("RGB").getpixel((5, 5))[1] > 200, True
+                )
+        response = self.client.get(f"/serve-image/{image.pk}/Basic/")
+        self.assertEqual(response["Content-Type"], "image/webp")
+
+    @override_settings(THUMBNAIL_MAX_FRAMES=4)
+    def test_long_animations_are_decimated_at_the_same_speed(self):
+        image = self.upload(make_animation_file(frames=10, duration=30))
+
+        with PILImage.open(image.thumbnail_Basic.path) as thumbnail:
+            durations = []
+            for index in range(thumbnail.n_frames):
+                thumbnail.seek(index)
+                thumbnail.load()
+                durations.append(thumbnail.info["duration"])
+        self.assertEqual(durations, [90, 90, 90, 30])
+
+    def test_gif_output_without_webp(self):
+        with mock.patch.object(imaging, "animation_format", return_value="GIF"):
+            image = self.upload(make_animation_file(frames=3))
+
+        self.assertTrue(image.thumbnail_Basic.name.endswith(".gif"))
+        with PILImage.open(image.thumbnail_Basic.path) as thumbnail:
+            self.assertEqual(thumbnail.n_frames, 3)
+
+    @override_settings(THUMBNAIL_DECODE_PIXELS=10_000)
+    def test_frames_over_the_budget_are_rejected(self):
+        response = self.client.post(
+            "/upload/", {"title": "moving", "image": make_animation_file()}
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_transparent_still_images_become_jpeg_on_white(self):
+        source = PILImage.new("RGBA", (200, 200), (0, 0, 0, 0))
+        source.paste((0, 0, 255, 255), (0, 0, 100, 200))
+        image_io = BytesIO()
+        source.save(image_io, "PNG")
+
+        image = self.upload(SimpleUploadedFile("alpha.png", image_io.getvalue()))
+
+        self.assertTrue(image.thumbnail_Basic.name.endswith(".jpeg"))
+        with PILImage.open(image.thumbnail_Basic.path) as thumbnail:
+            right = thumbnail.getpixel((thumbnail.width - 5, thumbnail.height // 2))
+            self.assertTrue(all(value > 245 for value in right))
+
+    def test_palette_still_images_become_jpeg(self):
+        image_io = BytesIO()
+        PILImage.new("P", (120, 80), 3).save(image_io, "GIF", transparency=3)
+
+        image = self.upload(SimpleUploadedFile("still.gif", image_io.getvalue()))
+
+        self.assertTrue(image.thumbnail_Basic.name.endswith(".jpeg"))
+
+
+class SeedLoadUsersTestCase(MediaRootTestCase):
+    def seed(self, **options):
+        stdout = StringIO()
+        call_command(
+            "seed_load_users",
+            users_per_plan=1,
+            images=2,
+            size="64x48",
+            stdout=stdout,
+            **options,
+        )
+        return {user["plan"]: user for user in json.loads(stdout.getvalue())["users"]}
+
+    def test_seeds_users_on_every_plan(self):
+        users = self.seed()
+
+        self.assertEqual(set(users), {"Basic", "Premium", "Enterprise"})
+        self.assertEqual(users["Basic"]["variants"], ["Basic"])
+        self.assertEqual(
+            users["Enterprise"]["variants"], ["Basic", "Premium", "original"]
+        )
+        self.assertEqual(users["Basic"]["expired_status"], 403)
+        self.assertEqual(users["Enterprise"]["expired_status"], 200)
+        premium = users["Premium"]
+        self.assertEqual(len(premium["images"]), 2)
+        self.assertTrue(
+            Image.objects.get(pk=premium["images"][0]).thumbnail_Premium.name
+        )
+        self.assertLess(
+            Image.objects.get(pk=premium["expired_images"][0]).expiration_date,
+            timezone.now(),
+        )
+
+    def test_seeded_credentials_reach_the_expected_statuses(self):
+        users = self.seed()
+
+        for user in users.values():
+            self.client.cookies["sessionid"] = user["session"]
+            response = self.client.get(f"/serve-image/{user['images'][0]}/Basic/")
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            response = self.client.get(
+                f"/serve-image/{user['expired_images'][0]}/Basic/"
+            )
+            self.assertEqual(response.status_code, user["expired_status"])
+        self.client.cookies.clear()
+        self.assertTrue(
+            self.client.login(
+                username=users["Basic"]["username"],
+                password=users["Basic"]["password"],
+            )
+        )
+
+    def test_reruns_reuse_users_and_images(self):
+        first = self.seed()
+        second = self.seed()
+
+        self.assertEqual(first["Basic"]["images"], second["Basic"]["images"])
+        self.assertEqual(
+            User.objects.filter(username__startswith="loadtest").count(), 3
+        )
+
+
+def spin(seconds):
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        pass
+
+
+def spin_elsewhere(seconds):
+    spin(seconds)
+
+
+class ProfilingTestCase(MediaRootTestCase):
+    def setUp(self):
+        super().setUp()
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+        self.configure()
+        self.user = self.create_user()
+        self.client.login(username="owner", password="testpassword")
+        self.image = Image.objects.create(
+            title="photo", image=make_image_file(), user=self.user
+        )
+        original = ImageDetailView.get_object
+        get_object = mock.patch.object(
+            ImageDetailView,
+            "get_object",
+            autospec=True,
+            side_effect=lambda view: spin(0.05) or original(view),
+        )
+        get_object.start()
+        self.addCleanup(get_object.stop)
+
+    def configure(self, **config):
+        profiler = override_settings(
+            PROFILER={
+                "DIR": self.directory,
+                "INTERVAL": 0.001,
+                "SAMPLE_RATE": 0.0,
+                "MIN_DURATION": 0.0,
+                "MAX_FILES": 10,
+                "MAX_ACTIVE": 2,
+                "TOKEN_MAX_AGE": 60,
+                **config,
+            }
+        )
+        profiler.enable()
+        self.addCleanup(profiler.disable)
+
+    def get(self, **extra):
+        return self.client.get(f"/image_detail/{self.image.pk}/", **extra)
+
+    def test_token_profiles_the_request(self):
+        response = self.get(HTTP_X_PROFILE=profiling.make_token("admin"))
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(os.listdir(self.directory), [response["X-Profile"]])
+        with open(os.path.join(self.directory, response["X-Profile"])) as profile:
+            lines = profile.read().splitlines()
+        stacks = dict(line.rsplit(" ", 1) for line in lines)
+        self.assertTrue(all(stack.startswith("GET /image_detail/") for stack in stacks))
+        self.assertTrue(any("spin (tests.py:" in stack for stack in stacks))
+        self.assertTrue(all(count.isdigit() for count in stacks.values()))
+
+    def test_requests_without_a_token_are_not_profiled(self):
+        response = self.get()
+
+        self.assertNotIn("X-Profile", response)
+        self.assertEqual(os.listdir(self.directory), [])
+
+    def test_invalid_tokens_are_ignored(self):
+        token = profiling.make_token("admin")
+
+        response = self.get(HTTP_X_PROFILE=token[:-1] + "x")
+        self.assertNotIn("X-Profile", response)
+        response = self.client.get(
+            f"/image_detail/{self.image.pk}/", {"profile": "admin"}
+        )
+        self.assertNotIn("X-Profile", response)
+        self.assertEqual(os.listdir(self.directory), [])
+
+    def test_staff_can_use_the_query_flag(self):
+        response = self.client.get(f"/image_detail/{self.image.pk}/", {"profile": 1})
+        self.assertNotIn("X-Profile", response)
+
+        User.objects.filter(pk=self.user.pk).update(is_staff=True)
+        response = self.client.get(f"/image_detail/{self.image.pk}/", {"profile": 1})
+        self.assertIn("X-Profile", response)
+
+    def test_only_the_newest_profiles_are_kept(self):
+        self.configure(MAX_FILES=2)
+        token = profiling.make_token("admin")
+
+        names = [self.get(HTTP_X_PROFILE=token)["X-Profile"] for _ in range(3)]
+
+        self.assertEqual(sorted(os.listdir(self.directory)), names[1:])
+
+    def test_sampled_requests_are_kept_only_when_slow(self):
+        self.configure(SAMPLE_RATE=1.0, MIN_DURATION=10)
+        response = self.get()
+        self.assertEqual(os.listdir(self.directory), [])
+
+        self.configure(SAMPLE_RATE=1.0, MIN_DURATION=0)
+        response = self.get()
+        self.assertEqual(len(os.listdir(self.directory)), 1)
+        self.assertNotIn("X-Profile", response)
+
+    def test_concurrent_profiles_are_capped(self):
+        self.configure(MAX_ACTIVE=0)
+
+        response = self.get(HTTP_X_PROFILE=profiling.make_token("admin"))
+
+        self.assertNotIn("X-Profile", response)
+
+    def test_async_profiles_follow_the_task_into_executor_threads(self):
+        async def profiled():
+            with profiling.Profile("GET /", 0.001) as profile:
+                await sync_to_async(spin, thread_sensitive=False)(0.1)
+            return profile
+
+        async def run():
+            other = sync_to_async(spin_elsewhere, thread_sensitive=False)(0.2)
+            profile, _ = await asyncio.gather(profiled(), other)
+            return profile
+
+        profile = async_to_sync(run)()
+
+        stacks = list(profile.counts)
+        self.assertTrue(any("spin (tests.py:" in stack for stack in stacks))
+        self.assertFalse(any("spin_elsewhere" in stack for stack in stacks))
+
+    def test_profile_token_command(self):
+        with self.assertRaises(CommandError):
+            call_command("profile_token", "owner", stdout=StringIO())
+
+        User.objects.filter(pk=self.user.pk).update(is_staff=True)
+        stdout = StringIO()
+        call_command("profile_token", "owner", stdout=stdout, stderr=StringIO())
+        self.assertIn("X-Profile", self.get(HTTP_X_PROFILE=stdout.getvalue().strip()))
+
+
+def block_loop(seconds):
+    time.sleep(seconds)
+
+
+class LoopMonitorTestCase(TestCase):
+    def setUp(self):
+        self.metrics = Metrics()
+        patcher = mock.patch.object(loop_monitor, "metrics", self.metrics)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_blocking_calls_are_logged_with_their_stack(self):
+        async def upload():
+            block_loop(0.3)
+
+        async def serve():
+            monitor = loop_monitor.LoopMonitor(interval=0.02, threshold=0.05)
+            monitor.start()
+            await asyncio.sleep(0.1)
+            await upload()
+            await asyncio.sleep(0.1)
+            monitor.stop()
+
+        with self.assertLogs("ImageCraftApp.loop_monitor", "WARNING") as logs:
+            asyncio.run(serve())
+
+        self.assertEqual(len(logs.output), 1)
+        self.assertIn("so far, in LoopMonitorTestCase", logs.output[0])
+        self.assertIn("<locals>.serve:", logs.output[0])
+        self.assertIn("in block_loop", logs.output[0])
+        rendered = self.metrics.render()
+        self.assertIn("# TYPE imagecraft_event_loop_lag_seconds histogram", rendered)
+        self.assertIn("imagecraft_event_loop_blocked_total 1", rendered)
+        self.assertIn('imagecraft_event_loop_lag_seconds_bucket{le="0.25"}', rendered)
+
+    def test_an_idle_loop_is_not_reported(self):
+        async def serve():
+            monitor = loop_monitor.LoopMonitor(interval=0.02, threshold=0.05)
+            monitor.start()
+            await asyncio.sleep(0.2)
+            monitor.stop()
+
+        with self.assertNoLogs("ImageCraftApp.loop_monitor", "WARNING"):
+            asyncio.run(serve())
+
+        self.assertNotIn("imagecraft_event_loop_blocked_total", self.metrics.render())
+
+    def test_executor_records_queueing(self):
+        executor = loop_monitor.MonitoredExecutor(max_workers=1)
+        self.addCleanup(executor.shutdown)
+
+        futures = [executor.submit(time.sleep, 0.1) for _ in range(2)]
+        self.assertEqual(executor.queued + executor.busy, 2)
+        for future in futures:
+            future.result()
+
+        self.assertEqual((executor.queued, executor.busy), (0, 0))
+        rendered = self.metrics.render()
+        self.assertIn("imagecraft_executor_wait_seconds_count 2", rendered)
+        self.assertIn('imagecraft_executor_wait_seconds_bucket{le="0.05"} 1', rendered)
+        self.assertIn('imagecraft_executor_wait_seconds_bucket{le="+Inf"} 2', rendered)
+
+    def test_middleware_starts_the_monitor_once(self):
+        async def app(scope, receive, send):
+            pass
+
+        middleware = LoopMonitorMiddleware(app)
+        with mock.patch.object(loop_monitor, "ensure_started") as ensure_started:
+            for _ in range(2):
+                async_to_sync(middleware)({"type": "http"}, None, None)
+
+        ensure_started.assert_called_once()
+
+
+@override_settings(
+    READ_REPLICAS={
+        "ALIASES": ["replica"],
+        "PIN_SECONDS": 10,
+        "HEALTH_CHECK_INTERVAL": 60,
+        "MAX_LAG": 5,
+    }
+)
+class ReplicaRoutingTestCase(TransactionTestCase):
+    """
+    Reads through a second alias connected to the test database, as a
+    replica that is always caught up. Its rows are only visible to the
+    replica once committed, hence TransactionTestCase.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        # Added once the test databases exist, so it opens the test database.
+        connections.settings["replica"] = {**connections["default"].settings_dict}
+
+    @classmethod
+    def tearDownClass(cls):
+        connections["replica"].close()
+        del connections["replica"]
+        del connections.settings["replica"]
+        super().tearDownClass()
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        media_override = override_settings(MEDIA_ROOT=media_root)
+        media_override.enable()
+        self.addCleanup(media_override.disable)
+        db_router._health.clear()
+        self.metrics = Metrics()
+        patcher = mock.patch.object(db_router, "metrics", self.metrics)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.user = User.objects.create_user(username="reader", password="x")
+        UserProfile.objects.filter(user=self.user).update(
+            subscription_plan=CustomSubscriptionPlan.objects.get(name="Premium")
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+        self.client.post(
+            "/upload/", {"title": "replicated", "image": make_image_file()}
+        )
+        self.image = Image.objects.get(title="replicated")
+
+    def gauge(self, name, value):
+        return f'{name}{{database="replica",pid="{os.getpid()}"}} {value}'
+
+    def get(self, url):
+        with CaptureQueriesContext(connections["default"]) as primary:
+            with CaptureQueriesContext(connections["replica"]) as replica:
+                response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return primary.captured_queries, replica.captured_queries
+
+    def test_reads_go_to_the_replica(self):
+        # Past the pin, and with the serve index gone, so the image is read too.
+        cache.clear()
+
+        primary, replica = self.get(f"/image_detail/{self.image.pk}/")
+        self.assertEqual(primary, [])
+        self.assertTrue(replica)
+
+        cache.clear()
+        primary, replica = self.get(f"/serve-image/{self.image.pk}/Premium/")
+        # Only the serve index is rebuilt from the primary; see serve_index.
+        self.assertEqual(len(primary), 1)
+        self.assertIn('"ImageCraftApp_image"', primary[0]["sql"])
+        self.assertTrue(replica)
+        self.assertIn(
+            self.gauge("imagecraft_db_replica_healthy", 1), self.metrics.render()
+        )
+
+    def test_writers_read_their_writes_from_the_primary(self):
+        # The upload pinned the user to the primary.
+        primary, replica = self.get(f"/image_detail/{self.image.pk}/")
+
+        self.assertTrue(primary)
+        self.assertEqual(replica, [])
+
+    def test_unavailable_replica_is_skipped_until_rechecked(self):
+        cache.clear()
+        with mock.patch.object(
+            db_router, "measure_lag", side_effect=OperationalError("down")
+        ) as measure_lag, self.assertLogs("ImageCraftApp.db_router", "WARNING"):
+            for _ in range(2):
+                primary, replica = self.get(f"/image_detail/{self.image.pk}/")
+                self.assertTrue(primary)
+                self.assertEqual(replica, [])
+
+        measure_lag.assert_called_once_with("replica")
+        self.assertIn(
+            self.gauge("imagecraft_db_replica_healthy", 0), self.metrics.render()
+        )
+
+        with override_settings(
+            READ_REPLICAS={**settings.READ_REPLICAS, "HEALTH_CHECK_INTERVAL": 0}
+        ):
+            primary, replica = self.get(f"/image_detail/{self.image.pk}/")
+        self.assertEqual(primary, [])
+        self.assertTrue(replica)
+
+    def test_lagging_replica_is_skipped(self):
+        cache.clear()
+        with mock.patch.object(db_router, "measure_lag", return_value=30.0):
+            primary, replica = self.get(f"/image_detail/{self.image.pk}/")
+
+        self.assertTrue(primary)
+        self.assertEqual(replica, [])
+        self.assertIn(
+            self.gauge("imagecraft_db_replica_lag_seconds", 30),
+            self.metrics.render(),
+        )
+
+    def test_writes_and_migrations_stay_on_the_primary(self):
+        router = db_router.ReplicaRouter()
+        token = db_router._replica.set("replica")
+        try:
+            self.assertEqual(router.db_for_read(Image), "replica")
+            self.assertEqual(router.db_for_write(Image), "default")
+        finally:
+            db_router._replica.reset(token)
+        self.assertEqual(router.db_for_read(Image), "default")
+        self.assertIs(router.allow_migrate("replica", "ImageCraftApp"), False)
+        self.assertIsNone(router.allow_migrate("default", "ImageCraftApp"))
+
+
+class ShardedMediaTestCase(MediaRootTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = self.create_user(plan="Premium")
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+        self.storage = Image._meta.get_field("image").storage
+
+    def upload(self, title):
+        self.client.post(
+            "/upload/", {"title": title, "image": make_image_file("Photo.JPG")}
+        )
+        return Image.objects.get(title=title)
+
+    def legacy_image(self, title):
+        # Stored as before the sharded layout: flat names and no storage key.
+        image = self.upload(title)
+        names = {}
+        for field_name in shard_media.FIELDS:
+            name = getattr(image, field_name).name
+            names[field_name] = f"images/{title}-{os.path.basename(name)}"
+            os.rename(self.storage.path(name), self.storage.path(names[field_name]))
+        Image.objects.filter(pk=image.pk).update(storage_key=None, **names)
+        cache.clear()
+        return Image.objects.get(pk=image.pk)
+
+    def shard(self, *args):
+        out = StringIO()
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command("shard_media", "--sleep", "0", *args, stdout=out)
+        return out.getvalue()
+
+    def test_uploads_are_stored_in_their_own_directory(self):
+        image = self.upload("sharded")
+
+        key = image.storage_key.hex
+        directory = f"images/{key[:2]}/{key[2:4]}/{key}"
+        self.assertEqual(
+            [
+                image.image.name,
+                image.thumbnail_Basic.name,
+                image.thumbnail_Premium.name,
+            ],
+            [
+                f"{directory}/original.jpg",
+                f"{directory}/Basic.jpeg",
+                f"{directory}/Premium.jpeg",
+            ],
+        )
+        self.assertEqual(
+            sorted(os.listdir(self.storage.path(directory))),
+            ["Basic.jpeg", "Premium.jpeg", "original.jpg"],
+        )
+
+    def test_rerendered_variant_replaces_its_file(self):
+        image = self.upload("rerendered")
+        name = image.thumbnail_Basic.name
+
+        with mock.patch.object(ShardedStorage, "exists") as exists:
+            thumbnails.generate_variants(image, {"thumbnail_Basic": 100})
+
+        exists.assert_not_called()
+        image.refresh_from_db()
+        self.assertEqual(image.thumbnail_Basic.name, name)
+        with PILImage.open(image.thumbnail_Basic.path) as thumbnail:
+            self.assertEqual(thumbnail.size, (100, 75))
+        self.assertEqual(len(os.listdir(os.path.dirname(image.image.path))), 3)
+
+    def test_legacy_files_are_moved(self):
+        image = self.legacy_image("legacy")
+        old_paths = [
+            self.storage.path(getattr(image, field_name).name)
+            for field_name in shard_media.FIELDS
+        ]
+        self.assertIn("1 image(s) to move.", self.shard("--dry-run"))
+
+        self.assertIn("Moved 1 image(s).", self.shard())
+
+        image.refresh_from_db()
+        key = image.storage_key.hex
+        self.assertEqual(
+            image.thumbnail_Premium.name,
+            f"images/{key[:2]}/{key[2:4]}/{key}/Premium.jpeg",
+        )
+        for path in old_paths:
+            self.assertFalse(os.path.exists(path))
+        response = self.client.get(f"/serve-image/{image.pk}/Premium/")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn("0 image(s) to move.", self.shard("--dry-run"))
+
+    def test_images_changed_while_moving_are_left_for_a_later_run(self):
+        image = self.legacy_image("changing")
+        original = image.image.name
+
+        def link_and_change(source, target):
+            link(source, target)
+            Image.objects.filter(pk=image.pk).update(
+                thumbnail_Basic="images/changing-rerendered.jpeg"
+            )
+
+        link = shard_media.link
+        with mock.patch.object(shard_media, "link", link_and_change):
+            output = self.shard()
+
+        self.assertIn("Moved 0 image(s).", output)
+        self.assertIn("Skipped 1 image(s)", output)
+        image.refresh_from_db()
+        self.assertIsNone(image.storage_key)
+        self.assertEqual(image.image.name, original)
+        self.assertTrue(os.path.exists(self.storage.path(original)))
+        # The links made for it were removed again.
+        flat = self.storage.path("images")
+        self.assertEqual(
+            [
+                name
+                for root, _, names in os.walk(flat)
+                if root != flat
+                for name in names
+            ],
+            [],
+        )
+
+
+class TieringTestCase(MediaRootTestCase):
+    def setUp(self):
+        super().setUp()
+        cold_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cold_root, ignore_errors=True)
+        self.tiers = {
+            "COLD_ROOT": cold_root,
+            "COLD_AFTER_DAYS": 7,
+            "FLUSH_INTERVAL": 60,
+            "FLUSH_SIZE": 1000,
+        }
+        tiers_override = override_settings(STORAGE_TIERS=self.tiers)
+        tiers_override.enable()
+        self.addCleanup(tiers_override.disable)
+        patcher = mock.patch.object(tiering, "access_log", tiering.AccessLog())
+        self.access_log = patcher.start()
+        self.addCleanup(patcher.stop)
+        # Flushed by the tests themselves.
+        flusher_patcher = mock.patch.object(self.access_log, "start_flusher")
+        flusher_patcher.start()
+        self.addCleanup(flusher_patcher.stop)
+
+        self.user = self.create_user(plan="Premium")
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+        self.image = self.upload("tiered")
+
+    def upload(self, title):
+        self.client.post("/upload/", {"title": title, "image": make_image_file()})
+        return Image.objects.get(title=title)
+
+    def serve(self, variant, image=None):
+        image = image or self.image
+        response = self.client.get(f"/serve-image/{image.pk}/{variant}/")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response
+
+    def make_cold(self):
+        Image.objects.filter(pk=self.image.pk).update(
+            created_at=timezone.now() - timezone.timedelta(days=10)
+        )
+        out = StringIO()
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command("tier_media", "--sleep", "0", stdout=out)
+        self.image.refresh_from_db()
+        return out.getvalue()
+
+    def test_hits_are_written_in_one_batch(self):
+        for variant in ("Basic", "Basic", "Premium", "original"):
+            self.serve(variant)
+        self.image.refresh_from_db()
+        self.assertEqual(self.image.serve_count, 0)
+
+        # One UPDATE for the hit count, one for the originals served.
+        with self.assertNumQueries(2):
+            self.access_log.flush()
+
+        self.image.refresh_from_db()
+        self.assertEqual(self.image.serve_count, 4)
+        self.assertIsNotNone(self.image.original_served_at)
+
+    def test_hits_are_written_once_flush_size_images_were_hit(self):
+        other = self.upload("other")
+        self.tiers["FLUSH_SIZE"] = 2
+
+        self.serve("Basic")
+        self.assertEqual(Image.objects.get(pk=self.image.pk).serve_count, 0)
+        self.serve("Basic", other)
+
+        self.assertEqual(
+            list(Image.objects.order_by("pk").values_list("serve_count", flat=True)),
+            [1, 1],
+        )
+
+    def test_first_hit_starts_the_flusher_once(self):
+        access_log = tiering.AccessLog()
+        with mock.patch.object(tiering.AccessFlusher, "start") as start:
+            access_log.record(self.image.pk, "Basic", self.image.thumbnail_Basic.name)
+            access_log.record(self.image.pk, "Basic", self.image.thumbnail_Basic.name)
+
+        start.assert_called_once()
+        self.assertEqual(access_log.flusher.interval, 60)
+
+    def test_flusher_thread_writes_when_woken(self):
+        flushed = threading.Event()
+        flusher = tiering.AccessFlusher(self.access_log, interval=60)
+        self.access_log.flusher = flusher
+        self.tiers["FLUSH_SIZE"] = 1
+        with mock.patch.object(
+            self.access_log, "flush", side_effect=lambda final: flushed.set()
+        ):
+            flusher.start()
+            self.serve("Basic")
+            self.assertTrue(flushed.wait(5))
+            flusher.stop()
+            flusher.join(5)
+        self.assertFalse(flusher.is_alive())
+
+    def test_cold_originals_are_served_and_promoted(self):
+        hot_path = self.image.image.path
+        with open(hot_path, "rb") as original:
+            content = original.read()
+
+        self.assertIn("Moved 1 original(s) to the cold tier.", self.make_cold())
+
+        self.assertTrue(self.image.image.name.startswith("cold/images/"))
+        cold_path = self.image.image.path
+        self.assertTrue(cold_path.startswith(self.tiers["COLD_ROOT"]))
+        self.assertFalse(os.path.exists(hot_path))
+        self.assertTrue(os.path.exists(self.image.thumbnail_Basic.path))
+
+        self.assertEqual(self.serve("original").content, content)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.access_log.flush()
+
+        self.image.refresh_from_db()
+        self.assertEqual(self.image.image.path, hot_path)
+        self.assertTrue(os.path.exists(hot_path))
+        # Kept for requests that looked up the cold name until the next flush.
+        self.assertTrue(os.path.exists(cold_path))
+        self.assertEqual(self.serve("original").content, content)
+
+        self.access_log.flush()
+        self.assertFalse(os.path.exists(cold_path))
+
+    def test_final_flush_leaves_cold_originals_cold(self):
+        self.make_cold()
+        self.serve("original")
+
+        self.access_log.flush(final=True)
+
+        self.image.refresh_from_db()
+        self.assertTrue(self.image.image.name.startswith("cold/images/"))
+        self.assertTrue(os.path.exists(self.image.image.path))
+        self.assertIsNotNone(self.image.original_served_at)
+
+    def test_recently_served_originals_stay_hot(self):
+        Image.objects.filter(pk=self.image.pk).update(
+            created_at=timezone.now() - timezone.timedelta(days=10),
+            original_served_at=timezone.now() - timezone.timedelta(days=1),
+        )
+        self.upload("new")
+        out = StringIO()
+
+        call_command("tier_media", "--dry-run", stdout=out)
+
+        self.assertIn("0 original(s) to move.", out.getvalue())
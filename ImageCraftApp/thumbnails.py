@@ -0,0 +1,223 @@
+"""
+Thumbnail variant generation shared by uploads, lazy rendering and backfills.
+
+Pillow and the imaging helpers are imported on first use so that loading the
+views at startup does not pay for them.
+"""
+
+import threading
+import time
+import weakref
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from . import events, usage
+from .edge_cache import invalidate
+from .resize_engines import get_engine
+from .serve_index import VARIANT_FIELDS
+
+# How long a cross-process render lock is held before it is considered stale.
+RENDER_LOCK_TIMEOUT = 60
+RENDER_LOCK_POLL_INTERVAL = 0.1
+
+# Leading bytes of the formats thumbnails are written in, and their extension.
+THUMBNAIL_SIGNATURES = ((b"\xff\xd8", "jpeg"), (b"GIF8", "gif"), (b"RIFF", "webp"))
+
+_render_locks = weakref.WeakValueDictionary()
+_render_locks_guard = threading.Lock()
+
+
+def variant_sizes(subscription_plan):
+    """
+    Get the thumbnail variants the subscription plan is entitled to.
+
+    Args:
+        subscription_plan (CustomSubscriptionPlan): The subscription plan.
+
+    Returns:
+        dict: Mapping of Image field name to thumbnail size.
+    """
+    sizes = {"thumbnail_Basic": subscription_plan.thumbnail_size}
+    if subscription_plan.premium_thumbnail_size:
+        sizes["thumbnail_Premium"] = subscription_plan.premium_thumbnail_size
+    return sizes
+
+
+def missing_variants(instance, subscription_plan):
+    """
+    Get the thumbnail variants of the image that have not been generated yet.
+
+    Args:
+        instance (Image): The image instance.
+        subscription_plan (CustomSubscriptionPlan): The subscription plan.
+
+    Returns:
+        dict: Mapping of Image field name to thumbnail size.
+    """
+    return {
+        field_name: size
+        for field_name, size in variant_sizes(subscription_plan).items()
+        if not getattr(instance, field_name)
+    }
+
+
+def render_thumbnails(path, sizes):
+    """
+    Render thumbnails of several sizes.
+
+    Still images are rendered as JPEGs with the configured resize engine.
+    Animated GIF, WebP and PNG originals are rendered frame by frame with
+    Pillow into animated thumbnails, whichever engine is configured.
+
+    Args:
+        path (str): The file path to the original image.
+        sizes (iterable): The thumbnail sizes to render.
+
+    Returns:
+        dict: Mapping of size to the thumbnail image as BytesIO object.
+
+    Raises:
+        ImageTooLarge: If the original cannot be decoded within the budget.
+    """
+    from .imaging import is_animated, render_animation
+    from .resize_engines import JPEG_QUALITY
+
+    if is_animated(path):
+        return render_animation(
+            path,
+            sizes,
+            max_frames=settings.THUMBNAIL_MAX_FRAMES,
+            decode_pixels=settings.THUMBNAIL_DECODE_PIXELS,
+            quality=JPEG_QUALITY,
+        )
+    return get_engine().render(path, sizes)
+
+
+def thumbnail_extension(content):
+    """
+    Get the file extension of a rendered thumbnail from its leading bytes.
+
+    Args:
+        content (bytes): The encoded thumbnail.
+
+    Returns:
+        str: ``jpeg``, ``gif`` or ``webp``.
+    """
+    for signature, extension in THUMBNAIL_SIGNATURES:
+        if content.startswith(signature):
+            return extension
+    return "jpeg"
+
+
+def generate_variants(instance, sizes):
+    """
+    Render and store the given thumbnail variants of the image.
+
+    The inline placeholder, the perceptual hash and the dominant colours are
+    computed from the Basic thumbnail whenever that variant is rendered. The
+    owner's storage usage is adjusted by the size difference of every variant
+    written, and a ``variant`` progress event is published for each.
+    Replacing an existing variant invalidates the cached serve-image
+    responses of the image.
+
+    Args:
+        instance (Image): The image instance.
+        sizes (dict): Mapping of Image field name to thumbnail size.
+    """
+    from PIL import Image as PILImage
+    from . import colours
+    from .duplicates import hash_fields
+    from .imaging import dhash, dominant_colours, placeholder_data_uri
+
+    regenerated = any(getattr(instance, field_name) for field_name in sizes)
+    rendered = render_thumbnails(instance.image.path, sizes.values())
+    # Images stored before the sharded layout get their storage key now.
+    update_fields = [*sizes, "storage_key"]
+    byte_deltas = {}
+    for field_name, size in sizes.items():
+        content = rendered[size].getvalue()
+        extension = thumbnail_extension(content)
+        thumbnail_name = f"thumbnail_{size}.{extension}"
+        counter = usage.USAGE_FIELDS[field_name]
+        byte_deltas[counter] = len(content) - usage.stored_size(
+            getattr(instance, field_name)
+        )
+        thumbnail_file = SimpleUploadedFile(
+            thumbnail_name, content, content_type=f"image/{extension}"
+        )
+        getattr(instance, field_name).save(thumbnail_name, thumbnail_file, save=False)
+    if "thumbnail_Basic" in sizes:
+        with PILImage.open(rendered[sizes["thumbnail_Basic"]]) as thumbnail:
+            instance.placeholder = placeholder_data_uri(thumbnail)
+            phash_fields = hash_fields(dhash(thumbnail))
+            palette, instance.colour_histogram = dominant_colours(thumbnail)
+        for field_name, value in phash_fields.items():
+            setattr(instance, field_name, value)
+        update_fields += ["placeholder", "colour_histogram", *phash_fields]
+    instance.save(update_fields=update_fields)
+    if "thumbnail_Basic" in sizes:
+        colours.store(instance, palette)
+    usage.record(instance.user_id, **byte_deltas)
+    if regenerated:
+        invalidate(instance)
+    for variant, field_name in VARIANT_FIELDS.items():
+        if field_name in sizes:
+            events.publish(instance, events.VARIANT, variant=variant)
+
+
+def _render_lock(pk):
+    with _render_locks_guard:
+        lock = _render_locks.get(pk)
+        if lock is None:
+            lock = _render_locks[pk] = threading.Lock()
+        return lock
+
+
+def _wait_for_render(lock_key):
+    deadline = time.monotonic() + RENDER_LOCK_TIMEOUT
+    while cache.get(lock_key) is not None and time.monotonic() < deadline:
+        time.sleep(RENDER_LOCK_POLL_INTERVAL)
+
+
+def ensure_variants(instance, subscription_plan):
+    """
+    Lazily generate the thumbnail variants missing from the image.
+
+    Images uploaded before a plan upgrade have no premium thumbnail. Rendering
+    is single-flight: concurrent requests for the same image in this process
+    wait on a shared lock, and other processes wait on a cache lock, so the
+    missing variants are rendered once from a single decode of the original.
+
+    Args:
+        instance (Image): The image instance.
+        subscription_plan (CustomSubscriptionPlan): The subscription plan.
+
+    Returns:
+        Image: The image instance with its variants populated.
+    """
+    missing = missing_variants(instance, subscription_plan)
+    if not missing:
+        return instance
+
+    with _render_lock(instance.pk):
+        instance.refresh_from_db(fields=list(missing))
+        missing = missing_variants(instance, subscription_plan)
+        if not missing:
+            return instance
+
+        lock_key = f"thumbnail_render_{instance.pk}"
+        acquired = cache.add(lock_key, 1, RENDER_LOCK_TIMEOUT)
+        if not acquired:
+            _wait_for_render(lock_key)
+            instance.refresh_from_db(fields=list(missing))
+            missing = missing_variants(instance, subscription_plan)
+            if not missing:
+                return instance
+            # The peer gave up or timed out; render it ourselves.
+            acquired = cache.add(lock_key, 1, RENDER_LOCK_TIMEOUT)
+        try:
+            generate_variants(instance, missing)
+        finally:
+            if acquired:
+                cache.delete(lock_key)
+    return instance
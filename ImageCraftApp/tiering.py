@@ -0,0 +1,286 @@
+"""
+Hot/cold storage tiering of originals, driven by serve-image access counts.
+
+Serve-image hits are counted in memory by ``access_log`` and written in
+batches: a single UPDATE per distinct hit count adds to ``Image.serve_count``,
+and one more stamps ``Image.original_served_at`` on the images whose original
+was served. The first hit in a process starts an ``AccessFlusher`` thread
+that writes them every ``STORAGE_TIERS["FLUSH_INTERVAL"]`` seconds, and sooner
+once ``STORAGE_TIERS["FLUSH_SIZE"]`` images have been hit, so requests never
+wait for it. Hits not yet written when a process dies are lost, which only
+delays tiering decisions.
+
+``manage.py tier_media`` moves originals not served for
+``STORAGE_TIERS["COLD_AFTER_DAYS"]`` days to the cold tier, a slower volume
+mounted at ``STORAGE_TIERS["COLD_ROOT"]``. Their names get the ``cold/``
+prefix, which the media storage resolves to that volume, so serving them
+works unchanged. Serving a cold original promotes it back to the hot tier
+when the hits are written; the cold copy is deleted a write later, once
+requests that looked it up have finished. Thumbnails always stay hot.
+"""
+
+import logging
+import os
+import shutil
+import threading
+import uuid
+from collections import Counter, defaultdict
+from django.conf import settings
+from django.db import DatabaseError, close_old_connections, transaction
+from django.db.models import F
+from django.utils import timezone
+from . import serve_index
+from .storage import COLD_PREFIX
+
+logger = logging.getLogger(__name__)
+
+
+def is_cold(name):
+    return name.startswith(COLD_PREFIX)
+
+
+def cold_name(name):
+    return f"{COLD_PREFIX}{name}"
+
+
+def hot_name(name):
+    return name[len(COLD_PREFIX) :] if is_cold(name) else name
+
+
+def copy_file(source, target):
+    """
+    Copy a file, replacing the target atomically.
+
+    Args:
+        source (str): The path of the file.
+        target (str): The path of the copy.
+    """
+    directory = os.path.dirname(target)
+    os.makedirs(directory, exist_ok=True)
+    temporary = os.path.join(directory, f".{uuid.uuid4().hex}.tmp")
+    try:
+        shutil.copyfile(source, temporary)
+        os.replace(temporary, target)
+    except BaseException:
+        if os.path.exists(temporary):
+            os.remove(temporary)
+        raise
+
+
+def move_original(pk, old_name, new_name):
+    """
+    Move an image's original to another tier.
+
+    The file is copied first, and the row only switched to the new name if
+    it still holds the old one. The caller deletes the old file once
+    requests that looked it up have finished.
+
+    Args:
+        pk (int): The ID of the image.
+        old_name (str): The storage name the original has.
+        new_name (str): The storage name in the other tier.
+
+    Returns:
+        bool: Whether the image was moved; if not, the copy is removed.
+    """
+    from .models import Image
+
+    storage = Image._meta.get_field("image").storage
+    copy_file(storage.path(old_name), storage.path(new_name))
+    with transaction.atomic():
+        moved = Image.objects.filter(pk=pk, image=old_name).update(image=new_name)
+        if moved:
+            transaction.on_commit(lambda: serve_index.invalidate(pk))
+    if not moved:
+        storage.delete(new_name)
+    return bool(moved)
+
+
+def promote(pk, name):
+    """
+    Move a cold original back to the hot tier.
+
+    The caller deletes the cold copy once requests that looked it up have
+    finished.
+
+    Args:
+        pk (int): The ID of the image.
+        name (str): The original's cold storage name.
+
+    Returns:
+        bool: Whether the original was promoted.
+    """
+    if not move_original(pk, name, hot_name(name)):
+        return False
+    logger.info("Promoted the original of image %s to the hot tier", pk)
+    return True
+
+
+class AccessLog:
+    """
+    Serve-image hits of this process not yet written to the database.
+
+    Attributes:
+        flusher (AccessFlusher): The thread writing the hits, if started.
+    """
+
+    def __init__(self):
+        self.flusher = None
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._flusher_lock = threading.Lock()
+        # Cold copies of the originals promoted by the last flush.
+        self._retired = []
+        self._reset()
+
+    def _reset(self):
+        self._hits = Counter()
+        self._originals = set()
+        self._cold = {}
+
+    def start_flusher(self):
+        """
+        Start writing the hits from a background thread, once per process.
+        """
+        with self._flusher_lock:
+            if self.flusher is not None and self.flusher.pid == os.getpid():
+                return
+            self.flusher = AccessFlusher(self, settings.STORAGE_TIERS["FLUSH_INTERVAL"])
+            self.flusher.start()
+
+    def record(self, pk, variant, name):
+        """
+        Count a hit, starting the flusher on the first one and waking it
+        if the hits are due.
+
+        Args:
+            pk (int): The ID of the image.
+            variant (str): The variant served.
+            name (str): Its storage name.
+        """
+        if self.flusher is None or self.flusher.pid != os.getpid():
+            self.start_flusher()
+        with self._lock:
+            self._hits[pk] += 1
+            if variant == "original":
+                self._originals.add(pk)
+                if is_cold(name):
+                    self._cold[pk] = name
+            due = len(self._hits) >= settings.STORAGE_TIERS["FLUSH_SIZE"]
+        if not due:
+            return
+        if self.flusher is not None and self.flusher.is_alive():
+            self.flusher.wake.set()
+        else:
+            self.flush()
+
+    def flush(self, final=False):
+        """
+        Write the counted hits and promote the cold originals served.
+
+        Does nothing if another thread is flushing already.
+
+        Args:
+            final (bool): Whether the process is exiting; cold originals are
+                then left for another process to promote, so that no cold
+                copy is left behind.
+        """
+        from .models import Image
+
+        if not self._flush_lock.acquire(blocking=False):
+            return
+        try:
+            with self._lock:
+                hits, originals, cold = self._hits, self._originals, self._cold
+                self._reset()
+            by_count = defaultdict(list)
+            for pk, count in hits.items():
+                by_count[count].append(pk)
+            try:
+                for count, pks in by_count.items():
+                    Image.objects.filter(pk__in=pks).update(
+                        serve_count=F("serve_count") + count
+                    )
+                if originals:
+                    Image.objects.filter(pk__in=originals).update(
+                        original_served_at=timezone.now()
+                    )
+            except DatabaseError:
+                logger.exception("Could not record %d image hits", len(hits))
+            # The cold copies promoted last time have been unreferenced since.
+            storage = Image._meta.get_field("image").storage
+            retired, self._retired = self._retired, []
+            for name in retired:
+                storage.delete(name)
+            if final:
+                return
+            for pk, name in cold.items():
+                try:
+                    if promote(pk, name):
+                        self._retired.append(name)
+                except (OSError, DatabaseError):
+                    logger.exception("Could not promote the original of image %s", pk)
+        finally:
+            self._flush_lock.release()
+
+
+class AccessFlusher(threading.Thread):
+    """
+    Daemon thread writing an access log's hits periodically.
+
+    Attributes:
+        pid (int): The process the thread was started in; it does not
+            survive a fork.
+        wake (Event): Set to write the hits now.
+        stopped (Event): Set by ``stop``.
+    """
+
+    def __init__(self, log, interval):
+        """
+        Args:
+            log (AccessLog): The access log.
+            interval (float): Seconds between writes.
+        """
+        super().__init__(name="access-flusher", daemon=True)
+        self.pid = os.getpid()
+        self.log = log
+        self.interval = interval
+        self.wake = threading.Event()
+        self.stopped = threading.Event()
+
+    def stop(self):
+        """
+        Write the hits once more and stop.
+        """
+        self.stopped.set()
+        self.wake.set()
+
+    def run(self):
+        while not self.stopped.is_set():
+            self.wake.wait(self.interval)
+            self.wake.clear()
+            try:
+                self.log.flush(final=self.stopped.is_set())
+            except Exception:
+                logger.exception("Could not write the image hits.")
+            finally:
+                close_old_connections()
+
+
+access_log = AccessLog()
+
+
+def start_flusher():
+    """
+    Write this process's hits from a background thread; see
+    ``AccessLog.start_flusher``. Called in every gunicorn worker, ahead of
+    the first hit.
+    """
+    access_log.start_flusher()
+
+
+def record_access(pk, variant, name):
+    """
+    Count a serve-image hit; see ``AccessLog.record``.
+    """
+    access_log.record(pk, variant, name)
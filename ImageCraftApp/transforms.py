@@ -0,0 +1,420 @@
+"""
+URL-driven image transformations.
+
+A transformation is a chain of operations separated by ``/``, applied left
+to right:
+
+* ``crop:x,y,w,h`` keeps a box of the current image, in its pixels.
+* ``square`` keeps the centred square of the current image.
+* ``rotate:deg`` rotates clockwise by a multiple of 90 degrees.
+* ``fit:mode,w,h`` resizes into ``w`` x ``h``: ``contain`` fits inside,
+  ``cover`` fills it and crops the overflow, ``fill`` stretches to it.
+  ``contain`` and ``cover`` never enlarge past the source's resolution.
+* ``format:jpeg|png|webp`` and ``quality:q`` set the encoding.
+
+However long, every chain is fused into one crop of the source, one
+rotation, one resize and one encode, so rendering decodes the original once.
+Chains that fuse into the same steps share a cache entry.
+
+Pillow is imported on first render so that loading the views does not pay
+for it.
+"""
+
+import hashlib
+import math
+from django.core.cache import cache
+from .resize_engines import JPEG_QUALITY
+
+MAX_OPERATIONS = 12
+MAX_OUTPUT_SIZE = 4096
+TRANSFORM_CACHE_TIMEOUT = 3600
+# Larger outputs are not cached: memcached refuses items over 1 MiB, key and
+# item header included.
+TRANSFORM_CACHE_MAX_SIZE = 1000 * 1000
+EXIF_ORIENTATION = 0x0112
+
+# Format name in specs to the Pillow format and the content type.
+FORMATS = {
+    "jpeg": ("JPEG", "image/jpeg"),
+    "png": ("PNG", "image/png"),
+    "webp": ("WEBP", "image/webp"),
+}
+FIT_MODES = ("contain", "cover", "fill")
+
+
+def _integers(args, count, minimum=0):
+    if len(args) != count:
+        raise ValueError(f"Expected {count} numbers.")
+    try:
+        numbers = [int(arg) for arg in args]
+    except ValueError:
+        raise ValueError("Expected whole numbers.")
+    if any(number < minimum for number in numbers):
+        raise ValueError(f"Expected numbers of at least {minimum}.")
+    return numbers
+
+
+def _parse_crop(args):
+    if len(args) != 4:
+        raise ValueError("Expected 4 numbers.")
+    x, y = _integers(args[:2], 2)
+    return [x, y, *_integers(args[2:], 2, minimum=1)]
+
+
+def _parse_square(args):
+    return _integers(args, 0)
+
+
+def _parse_rotate(args):
+    if len(args) != 1 or args[0].lstrip("-") not in ("0", "90", "180", "270"):
+        raise ValueError("Rotations must be multiples of 90 degrees.")
+    return [int(args[0]) % 360]
+
+
+def _parse_fit(args):
+    if not args or args[0] not in FIT_MODES:
+        raise ValueError("Expected contain, cover or fill.")
+    width, height = _integers(args[1:], 2, minimum=1)
+    if max(width, height) > MAX_OUTPUT_SIZE:
+        raise ValueError(f"Sizes are limited to {MAX_OUTPUT_SIZE} pixels.")
+    return [args[0], width, height]
+
+
+def _parse_format(args):
+    if len(args) != 1 or args[0] not in FORMATS:
+        raise ValueError("Expected jpeg, png or webp.")
+    return args
+
+
+def _parse_quality(args):
+    (quality,) = _integers(args, 1, minimum=1)
+    if quality > 95:
+        raise ValueError("Qualities above 95 are not supported.")
+    return [quality]
+
+
+PARSERS = {
+    "crop": _parse_crop,
+    "square": _parse_square,
+    "rotate": _parse_rotate,
+    "fit": _parse_fit,
+    "format": _parse_format,
+    "quality": _parse_quality,
+}
+
+
+def parse(spec):
+    """
+    Parse a transformation spec.
+
+    Args:
+        spec (str): The operations, separated by ``/``.
+
+    Returns:
+        list: ``(name, args)`` pairs in order.
+
+    Raises:
+        ValueError: If the spec is empty, too long or has an invalid operation.
+    """
+    segments = [segment for segment in spec.split("/") if segment]
+    if not segments:
+        raise ValueError("The transformation is empty.")
+    if len(segments) > MAX_OPERATIONS:
+        raise ValueError(f"At most {MAX_OPERATIONS} operations are allowed.")
+    operations = []
+    for segment in segments:
+        name, _, raw_args = segment.partition(":")
+        if name not in PARSERS:
+            raise ValueError(f"Unknown operation {name!r}.")
+        try:
+            args = PARSERS[name](raw_args.split(",") if raw_args else [])
+        except ValueError as exc:
+            raise ValueError(f"Invalid {name} operation: {exc}")
+        operations.append((name, args))
+    return operations
+
+
+class Transformation:
+    """
+    A chain of operations fused into the steps that render it.
+
+    Attributes:
+        box (tuple): The ``(left, top, right, bottom)`` box of the upright
+            source that is kept.
+        rotation (int): The clockwise rotation applied to the box, in degrees.
+        size (tuple): The ``(width, height)`` of the output.
+        format (str): The output format name.
+        quality (int): The encoding quality, or None for lossless formats.
+    """
+
+    def __init__(self, width, height):
+        """
+        Args:
+            width (int): The width of the upright source.
+            height (int): The height of the upright source.
+        """
+        self.box = (0, 0, width, height)
+        self.rotation = 0
+        self.size = (width, height)
+        self.format = "jpeg"
+        self.quality = JPEG_QUALITY
+
+    @classmethod
+    def fuse(cls, operations, source_size):
+        """
+        Fuse parsed operations applied to a source of the given size.
+
+        Args:
+            operations (list): ``(name, args)`` pairs from ``parse``.
+            source_size (tuple): The size of the upright source.
+
+        Returns:
+            Transformation: The fused transformation, with whole pixel sizes.
+
+        Raises:
+            ValueError: If a crop falls outside the image.
+        """
+        transformation = cls(*source_size)
+        for name, args in operations:
+            getattr(transformation, f"_{name}")(*args)
+        transformation._round()
+        return transformation
+
+    @property
+    def content_type(self):
+        return FORMATS[self.format][1]
+
+    @property
+    def key(self):
+        """
+        str: The canonical form; equal for chains that render identically.
+        """
+        return (
+            f"{','.join(map(str, self.box))};{self.rotation};"
+            f"{self.size[0]}x{self.size[1]};{self.format};{self.quality}"
+        )
+
+    def _box_size(self):
+        left, top, right, bottom = self.box
+        width, height = right - left, bottom - top
+        return (height, width) if self.rotation % 180 else (width, height)
+
+    def _unrotate(self, x, y):
+        # Map a point of the rotated box back to the unrotated box.
+        left, top, right, bottom = self.box
+        width, height = right - left, bottom - top
+        return {
+            0: (x, y),
+            90: (y, height - x),
+            180: (width - x, height - y),
+            270: (width - y, x),
+        }[self.rotation]
+
+    def _crop(self, x, y, width, height):
+        output_width, output_height = self.size
+        x0, y0 = max(x, 0), max(y, 0)
+        x1, y1 = min(x + width, output_width), min(y + height, output_height)
+        if x1 <= x0 or y1 <= y0:
+            raise ValueError("The crop is outside the image.")
+        box_width, box_height = self._box_size()
+        scale_x, scale_y = output_width / box_width, output_height / box_height
+        u0, v0 = self._unrotate(x0 / scale_x, y0 / scale_y)
+        u1, v1 = self._unrotate(x1 / scale_x, y1 / scale_y)
+        left, top = self.box[:2]
+        self.box = (
+            left + min(u0, u1),
+            top + min(v0, v1),
+            left + max(u0, u1),
+            top + max(v0, v1),
+        )
+        self.size = (x1 - x0, y1 - y0)
+
+    def _square(self):
+        width, height = self.size
+        side = min(width, height)
+        self._crop((width - side) / 2, (height - side) / 2, side, side)
+
+    def _rotate(self, degrees):
+        self.rotation = (self.rotation + degrees) % 360
+        if degrees % 180:
+            self.size = self.size[::-1]
+
+    def _fit(self, mode, width, height):
+        if mode == "fill":
+            self.size = (width, height)
+            return
+        output_width, output_height = self.size
+        if mode == "cover":
+            if output_width * height > output_height * width:
+                crop_width = output_height * width / height
+                self._crop(
+                    (output_width - crop_width) / 2, 0, crop_width, output_height
+                )
+            else:
+                crop_height = output_width * height / width
+                self._crop(
+                    0, (output_height - crop_height) / 2, output_width, crop_height
+                )
+            output_width, output_height = self.size
+        native_scale = self._box_size()[0] / output_width
+        scale = min(width / output_width, height / output_height, native_scale)
+        self.size = (output_width * scale, output_height * scale)
+
+    def _format(self, name):
+        self.format = name
+
+    def _quality(self, quality):
+        self.quality = quality
+
+    def _round(self):
+        left, top, right, bottom = (round(edge) for edge in self.box)
+        self.box = (left, top, max(right, left + 1), max(bottom, top + 1))
+        self.size = tuple(max(1, round(side)) for side in self.size)
+        if self.format == "png":
+            self.quality = None
+
+
+def fuse(spec, source_size):
+    """
+    Parse a transformation spec and fuse it for a source.
+
+    Args:
+        spec (str): The operations, separated by ``/``.
+        source_size (tuple): The size of the upright source.
+
+    Returns:
+        Transformation: The fused transformation.
+
+    Raises:
+        ValueError: If the spec is invalid for the source.
+    """
+    return Transformation.fuse(parse(spec), source_size)
+
+
+def size_limit(subscription_plan):
+    """
+    Get the longest output side the subscription plan may request.
+
+    Args:
+        subscription_plan (CustomSubscriptionPlan): The subscription plan.
+
+    Returns:
+        int: The limit in pixels, or None if the plan has no transformations.
+    """
+    if not subscription_plan.transformations:
+        return None
+    return subscription_plan.max_transform_size or max(
+        subscription_plan.thumbnail_size,
+        subscription_plan.premium_thumbnail_size or 0,
+    )
+
+
+def _digest(*parts):
+    return hashlib.sha256("|".join(map(str, parts)).encode()).hexdigest()
+
+
+def source_size(name, path):
+    """
+    Get the upright size of a stored original, cached by its storage name.
+
+    Args:
+        name (str): The storage name of the original.
+        path (str): The file path to the original.
+
+    Returns:
+        tuple: The width and height after applying the EXIF orientation.
+    """
+    cache_key = f"transform_source_{_digest(name)}"
+    size = cache.get(cache_key)
+    if size is None:
+        from PIL import Image as PILImage
+
+        with PILImage.open(path) as image:
+            size = image.size
+            if image.getexif().get(EXIF_ORIENTATION, 1) in (5, 6, 7, 8):
+                size = size[::-1]
+        cache.set(cache_key, size, TRANSFORM_CACHE_TIMEOUT)
+    return tuple(size)
+
+
+def cache_key(name, transformation):
+    """
+    Get the cache key of a rendered transformation.
+
+    Args:
+        name (str): The storage name of the original.
+        transformation (Transformation): The fused transformation.
+
+    Returns:
+        str: The cache key.
+    """
+    return f"transform_{_digest(name, transformation.key)}"
+
+
+def render(path, transformation, decode_pixels):
+    """
+    Render a transformation of an original in one decode and one encode.
+
+    JPEGs are decoded at the smallest scale that still covers the output.
+    The image is normalized (EXIF orientation, sRGB, no metadata), then the
+    box is cropped and resized in a single resample, rotated and encoded.
+
+    Args:
+        path (str): The file path to the original.
+        transformation (Transformation): The fused transformation.
+        decode_pixels (int): The most pixels decoded into memory at once.
+
+    Returns:
+        bytes: The encoded image.
+
+    Raises:
+        ImageTooLarge: If the original cannot be decoded within the budget.
+    """
+    from io import BytesIO
+    from PIL import Image as PILImage
+    from .imaging import REDUCING_GAP, ImageTooLarge, flatten, normalize
+
+    left, top, right, bottom = transformation.box
+    width, height = transformation.size
+    if transformation.rotation % 180:
+        width, height = height, width
+    with PILImage.open(path) as image:
+        full_width = image.width
+        scale = max(width / (right - left), height / (bottom - top)) * REDUCING_GAP
+        if scale < 1:
+            # JPEG decodes straight to 1/2, 1/4 or 1/8 scale.
+            image.draft(
+                image.mode,
+                (math.ceil(image.width * scale), math.ceil(image.height * scale)),
+            )
+        if image.width * image.height > decode_pixels:
+            raise ImageTooLarge(
+                f"A {image.format} image of {image.width}x{image.height} pixels "
+                "is too large to transform."
+            )
+        reduced = image.width / full_width
+        has_alpha = "A" in image.getbands() or "transparency" in image.info
+        image = normalize(image)
+    output_format, _ = FORMATS[transformation.format]
+    if output_format == "JPEG" or not has_alpha:
+        image = flatten(image)
+    elif image.mode != "RGBA":
+        image = image.convert("RGBA")
+    image = image.resize(
+        (width, height),
+        PILImage.Resampling.LANCZOS,
+        box=tuple(edge * reduced for edge in transformation.box),
+        reducing_gap=REDUCING_GAP,
+    )
+    if transformation.rotation:
+        image = image.transpose(
+            {
+                90: PILImage.Transpose.ROTATE_270,
+                180: PILImage.Transpose.ROTATE_180,
+                270: PILImage.Transpose.ROTATE_90,
+            }[transformation.rotation]
+        )
+    output = BytesIO()
+    options = {"quality": transformation.quality} if transformation.quality else {}
+    image.save(output, output_format, **options)
+    return output.getvalue()
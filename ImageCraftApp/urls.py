@@ -1,9 +1,47 @@
 from django.urls import path
-from .views import ImageCreateView, UserDetailView, ImageDetailView, ServeImageView
+from .views import (
+    ImageCreateView,
+    UserDetailView,
+    ImageDetailView,
+    ImageDuplicatesView,
+    ServeImageView,
+    TransformImageView,
+    ColourSearchView,
+    ContactSheetView,
+    ContactSheetSpriteView,
+    ExportView,
+    MetricsView,
+    ProgressEventsView,
+)
 
 urlpatterns = [
     path("upload/", ImageCreateView.as_view(), name="upload-image"),
+    path("upload/events/", ProgressEventsView.as_view(), name="upload-events"),
     path("user/<int:pk>/", UserDetailView.as_view(), name="user-detail"),
     path("image_detail/<int:pk>/", ImageDetailView.as_view(), name="image-detail"),
+    path(
+        "image_detail/<int:pk>/duplicates/",
+        ImageDuplicatesView.as_view(),
+        name="image-duplicates",
+    ),
     path("serve-image/<int:pk>/", ServeImageView.as_view(), name="serve_image"),
+    path(
+        "serve-image/<int:pk>/t/<path:spec>/",
+        TransformImageView.as_view(),
+        name="serve-image-transform",
+    ),
+    path(
+        "serve-image/<int:pk>/<str:variant>/",
+        ServeImageView.as_view(),
+        name="serve-image-variant",
+    ),
+    path("search/colour/", ColourSearchView.as_view(), name="colour-search"),
+    path("contact-sheet/", ContactSheetView.as_view(), name="contact-sheet"),
+    path(
+        "contact-sheet/<str:digest>/",
+        ContactSheetSpriteView.as_view(),
+        name="contact-sheet-sprite",
+    ),
+    path("export/", ExportView.as_view(), name="export"),
+    path("metrics/", MetricsView.as_view(), name="metrics"),
 ]
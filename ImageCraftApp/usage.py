@@ -0,0 +1,113 @@
+"""
+Per-user storage accounting.
+
+The counters on UserProfile are adjusted with single UPDATE statements using
+F() expressions whenever an image is created, a variant is written or an image
+is deleted, so concurrent uploads never lose an update and reading a user's
+usage never touches the filesystem. ``reconcile_storage_usage`` repairs drift
+left by files changed outside the app.
+"""
+
+from django.db.models import F
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+# Image field to the UserProfile counter holding the bytes of that variant.
+USAGE_FIELDS = {
+    "image": "original_bytes",
+    "thumbnail_Basic": "thumbnail_basic_bytes",
+    "thumbnail_Premium": "thumbnail_premium_bytes",
+}
+
+
+class QuotaExceeded(APIException):
+    """
+    Raised when an upload would take a user past their plan's quota.
+    """
+
+    status_code = status.HTTP_403_FORBIDDEN
+    default_detail = "Your subscription plan's storage quota is used up."
+    default_code = "quota_exceeded"
+
+
+def stored_size(field_file):
+    """
+    Get the size of a stored file.
+
+    Args:
+        field_file (FieldFile): The file.
+
+    Returns:
+        int: The size in bytes; 0 if there is no file or it is missing.
+    """
+    if not field_file:
+        return 0
+    try:
+        return field_file.storage.size(field_file.name)
+    except OSError:
+        return 0
+
+
+def image_usage(instance):
+    """
+    Measure the bytes each variant of an image takes.
+
+    Args:
+        instance (Image): The image.
+
+    Returns:
+        dict: Mapping of UserProfile counter to bytes.
+    """
+    return {
+        counter: stored_size(getattr(instance, field_name))
+        for field_name, counter in USAGE_FIELDS.items()
+    }
+
+
+def record(user_id, images=0, **byte_deltas):
+    """
+    Atomically adjust a user's usage counters.
+
+    Args:
+        user_id (int): The ID of the user.
+        images (int): The change in the number of images.
+        byte_deltas: Changes in bytes, keyed by UserProfile counter.
+    """
+    from .models import UserProfile
+
+    updates = {
+        counter: F(counter) + delta for counter, delta in byte_deltas.items() if delta
+    }
+    if images:
+        updates["image_count"] = F("image_count") + images
+    if updates and user_id is not None:
+        UserProfile.objects.filter(user_id=user_id).update(**updates)
+
+
+def check_quota(user_profile, subscription_plan, upload_size):
+    """
+    Check that an upload fits in the user's quota.
+
+    Uses the counters on the already loaded profile, so it costs no query
+    and no filesystem access. Thumbnails rendered afterwards may take a user
+    slightly past the byte quota.
+
+    Args:
+        user_profile (UserProfile): The uploader's profile.
+        subscription_plan (CustomSubscriptionPlan): The uploader's plan.
+        upload_size (int): The size of the uploaded file in bytes.
+
+    Raises:
+        QuotaExceeded: If the plan's image count or storage quota would be exceeded.
+    """
+    max_images = subscription_plan.max_images
+    if max_images is not None and user_profile.image_count >= max_images:
+        raise QuotaExceeded(
+            f"Your subscription plan allows at most {max_images} images."
+        )
+    max_bytes = subscription_plan.max_storage_bytes
+    if max_bytes is not None and user_profile.storage_bytes + upload_size > max_bytes:
+        raise QuotaExceeded(
+            f"This upload would exceed your subscription plan's storage quota "
+            f"of {max_bytes} bytes."
+        )
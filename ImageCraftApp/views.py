@@ -1,23 +1,50 @@
-from django.http import HttpResponseNotFound
-from django.utils import timezone
+import hashlib
+import logging
+import mimetypes
 import os
+import secrets
+from django.http import HttpResponseNotFound, StreamingHttpResponse
+from django.conf import settings
+from django.utils import timezone
 from django.shortcuts import render, HttpResponse
-from PIL import Image as PILImage
-from io import BytesIO
-from django.core.files.uploadedfile import SimpleUploadedFile
 from django.core.exceptions import ObjectDoesNotExist
 from django.core.cache import cache
+from django.core.files.base import ContentFile
 from django.contrib.auth.models import User
+from django.db import DEFAULT_DB_ALIAS
+from django.db.models import Q
+from django.urls import reverse
+from django.utils.text import slugify
 from rest_framework import generics
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated, IsAdminUser
-from rest_framework.exceptions import NotFound
+from rest_framework.exceptions import NotFound, PermissionDenied, ValidationError
 from asgiref.sync import sync_to_async, async_to_sync
 from .models import Image, UserProfile, CustomSubscriptionPlan
 from .serializers import (
     ImageSerializer,
     UserSerializer,
 )
+from .admission import RenderCapacityExceeded, render_admission
+from .db_router import ReplicaReadMixin
+from . import colours, duplicates, events, serve_index, tiering, transforms
+from .edge_cache import serve_cache_ttl, set_cache_headers
+from .metrics import metrics
+from .middleware import client_disconnected
+from .thumbnails import ensure_variants, generate_variants, variant_sizes
+from .usage import check_quota
+from .zipstream import ClientDisconnected, ZipStream
+
+logger = logging.getLogger(__name__)
+
+CONTACT_SHEET_MAX_IMAGES = 200
+CONTACT_SHEET_TILE_SIZES = {"Basic": 200, "Premium": 400}
+CONTACT_SHEET_CACHE_TIMEOUT = 3600
+# Storage directory of composed sprites; memcached refuses items over 1 MB.
+CONTACT_SHEET_DIR = "contact-sheets"
+EXPORT_BATCH_SIZE = 500
+# How long a client waits before reopening a dropped event stream.
+EVENTS_RETRY_MS = 3000
 
 
 class ImageCreateView(generics.CreateAPIView):
@@ -29,71 +56,87 @@ class ImageCreateView(generics.CreateAPIView):
     serializer_class = ImageSerializer
     permission_classes = [IsAuthenticated]
 
-    async def create_thumbnail(self, instance, size):
+    async def create_thumbnails(self, instance, subscription_plan):
         """
-        Create a thumbnail image with the given size.
+        Create thumbnails for the image.
+
+        The original is decoded once and every thumbnail size the subscription
+        plan is entitled to is rendered from it.
 
         Args:
             instance (Image): The image instance.
-            size (int): The size of the thumbnail.
-
-        Returns:
-            BytesIO: The thumbnail image as BytesIO object.
+            subscription_plan (CustomSubscriptionPlan): The subscription plan.
         """
-        image = PILImage.open(instance.image.path)
-        image.thumbnail((size, size))
-        thumbnail_io = BytesIO()
-        image.save(thumbnail_io, "JPEG")
-        thumbnail_io.seek(0)
-        return thumbnail_io
+        await sync_to_async(generate_variants)(
+            instance, variant_sizes(subscription_plan)
+        )
 
-    async def save_thumbnail(
-        self, instance, thumbnail_name, thumbnail_io, subscription_plan=None
-    ):
+    def get_duplicate_policy(self):
         """
-        Save the thumbnail image.
+        Get what to do about near-duplicates of the upload.
 
-        Args:
-            instance (Image): The image instance.
-            thumbnail_name (str): The name of the thumbnail image.
-            thumbnail_io (BytesIO): The thumbnail image as BytesIO object.
-            subscription_plan (str, optional): The subscription plan. Defaults to None.
+        The ``duplicates`` query parameter (``allow``, ``warn`` or
+        ``reject``) overrides ``settings.DUPLICATE_UPLOADS``.
+
+        Returns:
+            str: The policy.
+
+        Raises:
+            ValidationError: If the policy is unknown.
         """
-        thumbnail_file = SimpleUploadedFile(
-            thumbnail_name, thumbnail_io.read(), content_type="image/jpeg"
-        )
-        if subscription_plan:
-            instance.thumbnail_Premium.save(thumbnail_name, thumbnail_file, save=False)
-        else:
-            instance.thumbnail_Basic.save(thumbnail_name, thumbnail_file, save=False)
+        policy = self.request.query_params.get("duplicates", settings.DUPLICATE_UPLOADS)
+        if policy not in duplicates.POLICIES:
+            raise ValidationError({"duplicates": "Expected allow, warn or reject."})
+        return policy
 
-    async def create_thumbnails(
-        self, instance, subscription_plan, thumbnail_size, premium_thumbnail_size
-    ):
+    @sync_to_async
+    def check_duplicates(self, instance, policy):
         """
-        Create thumbnails for the image.
+        Look for near-duplicates of the uploaded image in the user's library.
+
+        With ``warn``, they are listed under ``duplicates`` in the response.
+        With ``reject``, the upload is deleted again, files included.
 
         Args:
-            instance (Image): The image instance.
-            subscription_plan (str): The subscription plan.
-            thumbnail_size (int): The size of the basic thumbnail.
-            premium_thumbnail_size (int): The size of the premium thumbnail.
+            instance (Image): The uploaded image, with its hash computed.
+            policy (str): ``warn`` or ``reject``.
+
+        Raises:
+            DuplicateImage: If there are near-duplicates and the policy is
+                ``reject``.
         """
-        thumbnail_io = await self.create_thumbnail(instance, thumbnail_size)
-        thumbnail_name = os.path.join(
-            f"thumbnail_{thumbnail_size}.jpeg",
-        )
-        await self.save_thumbnail(instance, thumbnail_name, thumbnail_io)
-        if subscription_plan in ("Premium", "Enterprise"):
-            thumbnail_io = await self.create_thumbnail(instance, premium_thumbnail_size)
-            thumbnail_name = os.path.join(
-                f"thumbnail_{premium_thumbnail_size}.jpeg",
+        if instance.phash is None:
+            return
+        matches = [
+            {"id": pk, "distance": distance}
+            for pk, distance in duplicates.find_near_duplicates(
+                Image.objects.filter(user_id=instance.user_id),
+                instance.phash,
+                settings.DUPLICATE_DISTANCE,
+                exclude=instance.pk,
             )
-            await self.save_thumbnail(
-                instance, thumbnail_name, thumbnail_io, subscription_plan
+        ]
+        if matches and policy == "reject":
+            instance.delete()
+            # Deleting the row leaves the original and thumbnails on disk.
+            for field_name in serve_index.VARIANT_FIELDS.values():
+                field_file = getattr(instance, field_name)
+                if field_file:
+                    field_file.delete(save=False)
+            ids = ", ".join(str(match["id"]) for match in matches)
+            raise duplicates.DuplicateImage(
+                f"This image is a near-duplicate of image {ids} in your library."
             )
+        self.duplicates = matches
 
-        await sync_to_async(instance.save)()
+    def create(self, request, *args, **kwargs):
+        """
+        Create the image, listing near-duplicates found under ``duplicates``.
+        """
+        response = super().create(request, *args, **kwargs)
+        if getattr(self, "duplicates", None):
+            response.data["duplicates"] = self.duplicates
+        return response
 
     @sync_to_async
     def serealizer_data(self, instance):
@@ -145,14 +188,14 @@ class ImageCreateView(generics.CreateAPIView):
             ObjectDoesNotExist: If the subscription plan is not found.
         """
         cache_key = f"subscription_plan_{plan_id}"
-        cached_plan = cache.get(cache_key)
+        cached_plan = await cache.aget(cache_key)
 
         if cached_plan is not None:
             return cached_plan
 
         try:
             plan = await CustomSubscriptionPlan.objects.aget(pk=plan_id)
-            cache.set(cache_key, plan)  # Cache the result
+            await cache.aset(cache_key, plan)  # Cache the result
             return plan
         except Exception:  # CustomSubscriptionPlan.DoesNotExist:
             raise ObjectDoesNotExist(
@@ -166,30 +209,54 @@ class ImageCreateView(generics.CreateAPIView):
 
         Args:
             serializer (ImageSerializer): The image serializer.
+
+        Raises:
+            ValidationError: If the duplicates policy is unknown.
+            QuotaExceeded: If the upload would exceed the plan's quota.
+            RenderCapacityExceeded: If this process is already rendering and
+                queueing as many uploads as it is allowed to.
+            DuplicateImage: If the image is a near-duplicate of one in the
+                library and the policy is ``reject``.
         """
+        policy = self.get_duplicate_policy()
         user = self.request.user
         user_profile = await self.get_user_profile(user)
         subscription_plan = await self.get_subscription_plan(
             user_profile.subscription_plan_id
         )
-        thumbnail_size = subscription_plan.thumbnail_size
-        premium_thumbnail_size = subscription_plan.premium_thumbnail_size
-        instance = await sync_to_async(serializer.save)(user=user)
-        await self.create_thumbnails(
-            instance,
-            subscription_plan.name,
-            thumbnail_size,
-            premium_thumbnail_size,
+        check_quota(
+            user_profile, subscription_plan, serializer.validated_data["image"].size
+        )
+        # Wait for a render slot off the event loop, before anything is stored.
+        await sync_to_async(render_admission.acquire, thread_sensitive=False)(
+            subscription_plan
         )
+        try:
+            instance = await sync_to_async(serializer.save)(user=user)
+            # Publishing may query the database, which must not block the loop.
+            await sync_to_async(events.publish)(instance, events.RECEIVED)
+            try:
+                await self.create_thumbnails(instance, subscription_plan)
+            except Exception:
+                await sync_to_async(events.publish)(instance, events.FAILED)
+                raise
+        finally:
+            render_admission.release(subscription_plan)
+        if policy != "allow":
+            await self.check_duplicates(instance, policy)
         await self.serealizer_data(instance)
 
 
-class ServeImageView(generics.RetrieveAPIView):
+class ServeImageView(ReplicaReadMixin, generics.RetrieveAPIView):
     """
     A view for serving images with expiring links.
 
-    This view allows authenticated users to access images with expiring links.
-    If the link is still valid, the image is served; otherwise, an error response is returned.
+    Images are addressed by ID and variant (``original``, ``Basic`` or
+    ``Premium``). The file, owner and link expiry come from the cached serve
+    index, so no query is needed to find the file. Thumbnail variants missing
+    since a plan upgrade are rendered on their first request. The legacy
+    ``?q=<path>`` form is still accepted, but only for the paths of the
+    image's own variants. Queries go to a read replica when one is configured.
 
     Attributes:
         serializer_class (class): The serializer class for this view.
@@ -199,18 +266,6 @@ class ServeImageView(generics.RetrieveAPIView):
     serializer_class = ImageSerializer
     permission_classes = [IsAuthenticated]
 
-    def get_queryset(self):
-        """
-        Get the queryset of images based on the user's permissions.
-
-        Returns:
-            QuerySet: The queryset of images to serve.
-        """
-        user = self.request.user
-        if user.is_staff:
-            return Image.objects.all()
-        return Image.objects.filter(user=user)
-
     def get_user_profile(self, user):
         """
         Get the user's profile, including the related subscription plan.
@@ -246,12 +301,114 @@ class ServeImageView(generics.RetrieveAPIView):
         Raises:
             NotFound: If the requested file does not exist.
         """
+        content_type = mimetypes.guess_type(path)[0] or "image/jpeg"
         try:
             with open(path, "rb") as f:
-                return HttpResponse(f.read(), content_type="image/jpeg")
+                return HttpResponse(f.read(), content_type=content_type)
         except FileNotFoundError:
             raise NotFound("The requested file does not exist.")
 
+    def get_variant(self, entry):
+        """
+        Get the requested variant, from the URL or from a legacy ``?q=`` path.
+
+        Args:
+            entry (dict): The serve index entry of the image.
+
+        Returns:
+            str: The variant name.
+
+        Raises:
+            NotFound: If the variant does not exist for the image.
+        """
+        variant = self.kwargs.get("variant")
+        if variant is None:
+            path = self.request.GET.get("q")
+            variant = next(
+                (
+                    name
+                    for name, stored in entry["files"].items()
+                    if path and serve_index.storage_path(name, stored) == path
+                ),
+                None,
+            )
+        if variant not in entry["files"]:
+            raise NotFound(
+                "The file you are linking to does not exist. Please check the file path is correct."
+            )
+        return variant
+
+    def is_entitled(self, subscription_plan, variant):
+        """
+        Check whether the subscription plan includes the variant.
+
+        Args:
+            subscription_plan (CustomSubscriptionPlan): The requester's plan.
+            variant (str): The variant name.
+
+        Returns:
+            bool: Whether the variant may be served.
+        """
+        if variant == "original":
+            return subscription_plan.original_file
+        if variant == "Premium":
+            return bool(subscription_plan.premium_thumbnail_size)
+        return True
+
+    def render_missing_variants(self, subscription_plan):
+        """
+        Render the thumbnail variants of the requested image missing since a
+        plan upgrade, if a lazy render slot is free.
+
+        Never waits for a slot, and never takes one reserved for uploads.
+
+        Args:
+            subscription_plan (CustomSubscriptionPlan): The requester's plan.
+
+        Returns:
+            dict: The refreshed serve index entry of the image, or None if no
+            slot was free.
+
+        Raises:
+            NotFound: If the image no longer exists.
+        """
+        pk = self.kwargs["pk"]
+        try:
+            # From the primary, which the rendered files are saved to.
+            instance = Image.objects.using(DEFAULT_DB_ALIAS).get(pk=pk)
+        except Image.DoesNotExist:
+            raise NotFound("No Image matches the given query.")
+        if not render_admission.try_acquire_lazy():
+            return None
+        try:
+            ensure_variants(instance, subscription_plan)
+        finally:
+            render_admission.release_lazy()
+        return serve_index.build_entry(instance)
+
+    def get_entry(self):
+        """
+        Get the serve index entry of the requested image, checking access.
+
+        Returns:
+            tuple: The entry, the requester's subscription plan and whether
+            the link expiry applies to the requester.
+
+        Raises:
+            NotFound: If the image does not exist or belongs to someone else.
+            PermissionDenied: If the link has expired.
+        """
+        user = self.request.user
+        entry = serve_index.lookup(self.kwargs["pk"])
+        if entry is None or (not user.is_staff and entry["user_id"] != user.pk):
+            raise NotFound("No Image matches the given query.")
+        subscription_plan = self.get_user_profile(user).subscription_plan
+        link_expires = not subscription_plan.expiring_links and not user.is_staff
+
+        if entry["expiration_date"] < timezone.now() and link_expires:
+            raise PermissionDenied("This link has expired.")
+        return entry, subscription_plan, link_expires
+
     def retrieve(self, request, *args, **kwargs):
         """
         Serve the image with expiring link functionality.
@@ -265,24 +422,104 @@ class ServeImageView(generics.RetrieveAPIView):
 
         Raises:
             PermissionDenied: If the link has expired.
-            NotFound: If the requested file does not exist.
+            NotFound: If the image or the requested file does not exist.
+            RenderCapacityExceeded: If the requested thumbnail is missing, no
+                lazy render slot is free and there is no Basic thumbnail to
+                serve instead.
         """
-        instance = self.get_object()
-        user = self.request.user
-        expiring_links = self.get_user_profile(user).subscription_plan.expiring_links
-
+        entry, subscription_plan, link_expires = self.get_entry()
+        requested = self.kwargs.get("variant")
+        stand_in = False
         if (
-            instance.expiration_date < timezone.now()
-            and not expiring_links
-            and not user.is_staff
+            requested in ("Basic", "Premium")
+            and requested not in entry["files"]
+            and self.is_entitled(subscription_plan, requested)
         ):
-            return Response({"detail": "This link has expired."}, status=403)
+            rendered = self.render_missing_variants(subscription_plan)
+            if rendered is not None:
+                entry = rendered
+            elif requested != "Basic" and "Basic" in entry["files"]:
+                # Served until a slot is free; never cached as the variant.
+                stand_in = True
+            else:
+                raise RenderCapacityExceeded(
+                    wait=settings.RENDER_ADMISSION["RETRY_AFTER"]
+                )
+        variant = "Basic" if stand_in else self.get_variant(entry)
+        if not request.user.is_staff and not self.is_entitled(
+            subscription_plan, variant
+        ):
+            raise PermissionDenied("Your subscription plan does not include this file.")
+        name = entry["files"][variant]
+        response = self.open_image(serve_index.storage_path(variant, name))
+        tiering.record_access(self.kwargs["pk"], variant, name)
+        ttl = 0 if stand_in else serve_cache_ttl(entry["expiration_date"], link_expires)
+        return set_cache_headers(response, ttl)
+
+
+class TransformImageView(ServeImageView):
+    """
+    Serve a transformation of an image, described in the URL.
+
+    The spec is a chain of operations (``crop``, ``square``, ``rotate``,
+    ``fit``, ``format``, ``quality``) separated by ``/``; see
+    ImageCraftApp.transforms. The chain is fused and rendered from the
+    original in one decode and one encode, and the result is cached under the
+    fused form, so equivalent chains share an entry; results larger than
+    memcached holds are rendered each time. Access and link expiry
+    are checked as for serve-image.
+    """
+
+    def retrieve(self, request, *args, **kwargs):
+        """
+        Serve the transformed image.
+
+        Raises:
+            NotFound: If the image does not exist.
+            PermissionDenied: If the link has expired, the plan has no
+                transformations or the output is larger than the plan allows.
+            ValidationError: If the spec is invalid or the original is too
+                large to transform.
+        """
+        entry, subscription_plan, link_expires = self.get_entry()
+        limit = None
+        if not request.user.is_staff:
+            limit = transforms.size_limit(subscription_plan)
+            if limit is None:
+                raise PermissionDenied(
+                    "Your subscription plan does not include transformations."
+                )
+        name = entry["files"]["original"]
+        path = serve_index.storage_path("original", name)
+        try:
+            transformation = transforms.fuse(
+                self.kwargs["spec"], transforms.source_size(name, path)
+            )
+        except FileNotFoundError:
+            raise NotFound("The requested file does not exist.")
+        except ValueError as exc:
+            raise ValidationError({"spec": str(exc)})
+        if limit is not None and max(transformation.size) > limit:
+            raise PermissionDenied(
+                f"Your subscription plan allows transformed images of at most "
+                f"{limit} pixels per side."
+            )
 
-        path = self.request.GET.get("q")
-        if path:
-            return self.open_image(path)
-        raise NotFound(
-            "The file you are linking to does not exist. Please check the file path is correct."
+        cache_key = transforms.cache_key(name, transformation)
+        content = cache.get(cache_key)
+        if content is None:
+            try:
+                content = transforms.render(
+                    path, transformation, settings.THUMBNAIL_DECODE_PIXELS
+                )
+            except ValueError as exc:
+                raise ValidationError({"spec": str(exc)})
+            tiering.record_access(self.kwargs["pk"], "original", name)
+            if len(content) <= transforms.TRANSFORM_CACHE_MAX_SIZE:
+                cache.set(cache_key, content, transforms.TRANSFORM_CACHE_TIMEOUT)
+        response = HttpResponse(content, content_type=transformation.content_type)
+        return set_cache_headers(
+            response, serve_cache_ttl(entry["expiration_date"], link_expires)
         )
 
 
@@ -297,12 +534,13 @@ class UserDetailView(generics.RetrieveAPIView):
     permission_classes = [IsAdminUser]
 
 
-class ImageDetailView(generics.RetrieveAPIView):
+class ImageDetailView(ReplicaReadMixin, generics.RetrieveAPIView):
     """
     Retrieve detailed information about an image.
 
     This view allows authenticated users to retrieve detailed information about a specific image.
     The information includes details about the image, such as title and thumbnail URLs.
+    Queries go to a read replica when one is configured.
 
     Attributes:
         serializer_class (class): The serializer class for this view.
@@ -339,3 +577,630 @@ class ImageDetailView(generics.RetrieveAPIView):
         if user.is_staff:
             return Image.objects.all()
         return Image.objects.filter(user=user)
+
+
+class UserImagesMixin:
+    """
+    Restrict a view to the images the requesting user may access.
+    """
+
+    def get_queryset(self):
+        """
+        Get the queryset of images based on the user's role.
+
+        Returns:
+            QuerySet: All images for staff members, otherwise the user's own images.
+        """
+        user = self.request.user
+        if user.is_staff:
+            return Image.objects.all()
+        return Image.objects.filter(user=user)
+
+    def get_user_profile(self):
+        """
+        Get the requesting user's profile, including the related subscription plan.
+
+        Returns:
+            UserProfile: The user's profile with subscription plan.
+
+        Raises:
+            NotFound: If the user's profile is not found in the database.
+        """
+        try:
+            return UserProfile.objects.select_related("subscription_plan").get(
+                user=self.request.user
+            )
+        except UserProfile.DoesNotExist:
+            raise NotFound("UserProfile not found for the given user.")
+
+    def get_servable_queryset(self):
+        """
+        Get the queryset of images whose links have not expired for the user.
+
+        Applies the same expiry rule as ServeImageView, in the query itself.
+
+        Returns:
+            QuerySet: The queryset of images that may be served.
+
+        Raises:
+            NotFound: If the user's profile is not found in the database.
+        """
+        queryset = self.get_queryset()
+        if self.request.user.is_staff:
+            return queryset
+        subscription_plan = self.get_user_profile().subscription_plan
+        if subscription_plan and subscription_plan.expiring_links:
+            return queryset
+        return queryset.filter(
+            Q(expiration_date__isnull=True) | Q(expiration_date__gte=timezone.now())
+        )
+
+
+class ImageDuplicatesView(UserImagesMixin, generics.RetrieveAPIView):
+    """
+    List the near-duplicates of an image in its owner's library.
+
+    Query parameters:
+        distance: The largest Hamming distance between perceptual hashes,
+            defaulting to ``settings.DUPLICATE_DISTANCE``.
+
+    Candidates are found through the indexed hash chunks, so the cost grows
+    with the number of matches rather than with the size of the library.
+    """
+
+    permission_classes = [IsAuthenticated]
+
+    def get_distance(self):
+        """
+        Get the requested Hamming distance.
+
+        Returns:
+            int: The distance.
+
+        Raises:
+            ValidationError: If the distance is not a number in range.
+        """
+        distance = self.request.GET.get("distance", settings.DUPLICATE_DISTANCE)
+        try:
+            distance = int(distance)
+        except ValueError:
+            distance = -1
+        if not 0 <= distance <= duplicates.MAX_DISTANCE:
+            raise ValidationError(
+                {"distance": f"Expected a number from 0 to {duplicates.MAX_DISTANCE}."}
+            )
+        return distance
+
+    def retrieve(self, request, *args, **kwargs):
+        """
+        List the near-duplicates, closest first.
+
+        Raises:
+            NotFound: If the image does not exist or its hash is not computed yet.
+            ValidationError: If the distance is invalid.
+        """
+        distance = self.get_distance()
+        image = self.get_object()
+        if image.phash is None:
+            raise NotFound("The image has not been hashed yet.")
+        matches = duplicates.find_near_duplicates(
+            Image.objects.filter(user_id=image.user_id),
+            image.phash,
+            distance,
+            exclude=image.pk,
+        )
+        titles = dict(
+            Image.objects.filter(pk__in=[pk for pk, _ in matches]).values_list(
+                "pk", "title"
+            )
+        )
+        return Response(
+            [
+                {"id": pk, "title": titles[pk], "distance": match_distance}
+                for pk, match_distance in matches
+            ]
+        )
+
+
+class ColourSearchView(generics.GenericAPIView):
+    """
+    Rank the user's images by how close their dominant colours come to a colour.
+
+    Query parameters:
+        colour: The colour to look for, as six hex digits (``ff8800``).
+        distance: The largest Euclidean distance in RGB space (default 60).
+        limit: The most images returned (default 50).
+
+    Only the indexed colour rows of the bins near the colour are read, so
+    searches stay fast on large libraries.
+    """
+
+    permission_classes = [IsAuthenticated]
+
+    def get_number(self, name, default, maximum):
+        """
+        Get a numeric query parameter.
+
+        Args:
+            name (str): The parameter name.
+            default (int): The value when the parameter is missing.
+            maximum (int): The largest value allowed.
+
+        Returns:
+            int: The value.
+
+        Raises:
+            ValidationError: If the value is not a number from 1 to ``maximum``.
+        """
+        try:
+            value = int(self.request.GET.get(name, default))
+        except ValueError:
+            value = 0
+        if not 1 <= value <= maximum:
+            raise ValidationError({name: f"Expected a number from 1 to {maximum}."})
+        return value
+
+    def get(self, request, *args, **kwargs):
+        """
+        List the matching images, closest first.
+
+        Raises:
+            ValidationError: If a query parameter is invalid.
+        """
+        try:
+            rgb = colours.parse_colour(request.GET.get("colour", ""))
+        except ValueError:
+            raise ValidationError({"colour": "Expected a colour such as ff8800."})
+        distance = self.get_number(
+            "distance",
+            colours.DEFAULT_SEARCH_DISTANCE,
+            colours.MAX_SEARCH_DISTANCE,
+        )
+        limit = self.get_number("limit", 50, colours.MAX_SEARCH_RESULTS)
+        matches = colours.search(request.user.pk, rgb, distance, limit)
+        titles = dict(
+            Image.objects.filter(pk__in=[match[0] for match in matches]).values_list(
+                "pk", "title"
+            )
+        )
+        return Response(
+            [
+                {
+                    "id": pk,
+                    "title": titles[pk],
+                    "colour": colours.to_hex(packed),
+                    "share": round(share, 3),
+                    "distance": colour_distance,
+                }
+                for pk, packed, share, colour_distance in matches
+            ]
+        )
+
+
+class ContactSheetView(UserImagesMixin, generics.GenericAPIView):
+    """
+    Serve many thumbnails in one response for grid views.
+
+    Query parameters:
+        ids: Comma-separated image IDs, at most ``CONTACT_SHEET_MAX_IMAGES``.
+        variant: ``Basic`` (default) or ``Premium``.
+        layout: ``sprite`` (default) returns a coordinate map and the URL of a
+            single composed sprite image; ``multipart`` streams the thumbnails
+            as a ``multipart/mixed`` body.
+
+    All requested images are authorized with a single query; IDs that do not
+    exist, belong to someone else or have expired links are reported in
+    ``missing``.
+    """
+
+    permission_classes = [IsAuthenticated]
+    variant_fields = {"Basic": "thumbnail_Basic", "Premium": "thumbnail_Premium"}
+
+    def get_image_ids(self):
+        """
+        Parse the requested image IDs.
+
+        Returns:
+            list: The unique image IDs in request order.
+
+        Raises:
+            ValidationError: If the IDs are missing, malformed or too many.
+        """
+        try:
+            ids = [int(pk) for pk in self.request.GET.get("ids", "").split(",") if pk]
+        except ValueError:
+            raise ValidationError({"ids": "Expected comma-separated image IDs."})
+        ids = list(dict.fromkeys(ids))
+        if not ids:
+            raise ValidationError({"ids": "At least one image ID is required."})
+        if len(ids) > CONTACT_SHEET_MAX_IMAGES:
+            raise ValidationError(
+                {"ids": f"At most {CONTACT_SHEET_MAX_IMAGES} images per request."}
+            )
+        return ids
+
+    def get_thumbnails(self, ids, field_name):
+        """
+        Authorize the requested images and collect their thumbnails.
+
+        Args:
+            ids (list): The requested image IDs.
+            field_name (str): The Image field holding the requested variant.
+
+        Returns:
+            tuple: An ordered list of ``(pk, thumbnail name)`` pairs and the
+            list of IDs that cannot be served.
+        """
+        names = dict(
+            self.get_servable_queryset()
+            .filter(pk__in=ids)
+            .exclude(**{field_name: ""})
+            .exclude(**{f"{field_name}__isnull": True})
+            .values_list("pk", field_name)
+        )
+        found = [(pk, names[pk]) for pk in ids if pk in names]
+        missing = [pk for pk in ids if pk not in names]
+        return found, missing
+
+    def get(self, request, *args, **kwargs):
+        """
+        Serve the requested thumbnails as a sprite or a multipart stream.
+
+        Raises:
+            ValidationError: If the query parameters are invalid.
+        """
+        ids = self.get_image_ids()
+        variant = request.GET.get("variant", "Basic")
+        if variant not in self.variant_fields:
+            raise ValidationError({"variant": "Expected Basic or Premium."})
+        layout = request.GET.get("layout", "sprite")
+        if layout not in ("sprite", "multipart"):
+            raise ValidationError({"layout": "Expected sprite or multipart."})
+
+        found, missing = self.get_thumbnails(ids, self.variant_fields[variant])
+        if layout == "multipart":
+            return self.multipart_response(found)
+        return self.sprite_response(found, missing, variant)
+
+    def save_sprite(self, digest, sprite):
+        """
+        Store a composed sprite, replacing an earlier one of the same digest,
+        and delete the expired sprites of its shard.
+
+        Sprites are sharded by the first two hex digits of their digest, so
+        each cache miss sweeps about 1/256 of them rather than all.
+
+        Args:
+            digest (str): The hash the sprite is addressed by.
+            sprite (bytes): The JPEG sprite.
+
+        Returns:
+            str: The storage name of the sprite.
+        """
+        storage = Image._meta.get_field("thumbnail_Basic").storage
+        shard = f"{CONTACT_SHEET_DIR}/{digest[:2]}"
+        name = f"{shard}/{digest}.jpg"
+        # Its cache entry is gone, so the old sprite is no longer served.
+        storage.delete(name)
+        name = storage.save(name, ContentFile(sprite))
+        expired = timezone.now() - timezone.timedelta(
+            seconds=CONTACT_SHEET_CACHE_TIMEOUT
+        )
+        for other in storage.listdir(shard)[1]:
+            other = f"{shard}/{other}"
+            try:
+                if storage.get_modified_time(other) < expired:
+                    storage.delete(other)
+            except FileNotFoundError:
+                # Deleted by a concurrent request.
+                pass
+        return name
+
+    def sprite_response(self, found, missing, variant):
+        """
+        Compose (or fetch from cache) the sprite and return its coordinate map.
+
+        Sprites are addressed by a hash of the requesting user, the variant
+        and the thumbnail file names, so regenerated thumbnails get a new
+        sprite. The sprite is stored in the media storage and the cache only
+        holds its name and the coordinate map.
+
+        Args:
+            found (list): The ``(pk, thumbnail name)`` pairs to include.
+            missing (list): The IDs that cannot be served.
+            variant (str): The thumbnail variant.
+
+        Returns:
+            Response: The sprite URL, its tile size and the per-image boxes.
+        """
+        digest = hashlib.sha256(
+            repr((self.request.user.pk, variant, found)).encode()
+        ).hexdigest()
+        cache_key = f"contact_sheet_{digest}"
+        cached = cache.get(cache_key)
+        if cached is None:
+            from .imaging import compose_sprite
+
+            storage = Image._meta.get_field("thumbnail_Basic").storage
+            sprite, boxes = compose_sprite(
+                [storage.path(name) for _, name in found],
+                CONTACT_SHEET_TILE_SIZES[variant],
+            )
+            cached = {
+                "user_id": self.request.user.pk,
+                "sprite": self.save_sprite(digest, sprite),
+                "tiles": {
+                    str(pk): dict(zip(("x", "y", "width", "height"), box))
+                    for (pk, _), box in zip(found, boxes)
+                },
+            }
+            cache.set(cache_key, cached, CONTACT_SHEET_CACHE_TIMEOUT)
+        return Response(
+            {
+                "sprite": self.request.build_absolute_uri(
+                    reverse("contact-sheet-sprite", args=[digest])
+                ),
+                "tile_size": CONTACT_SHEET_TILE_SIZES[variant],
+                "tiles": cached["tiles"],
+                "missing": missing,
+            }
+        )
+
+    def multipart_response(self, found):
+        """
+        Stream the thumbnails as the parts of a ``multipart/mixed`` body.
+
+        Each part has the content type of the stored thumbnail: JPEG, or
+        WebP or GIF for animations.
+
+        Args:
+            found (list): The ``(pk, thumbnail name)`` pairs to include.
+
+        Returns:
+            StreamingHttpResponse: The multipart stream.
+        """
+        boundary = secrets.token_hex(16)
+        storage = Image._meta.get_field("thumbnail_Basic").storage
+
+        def parts():
+            for pk, name in found:
+                try:
+                    with storage.open(name, "rb") as thumbnail:
+                        content = thumbnail.read()
+                except FileNotFoundError:
+                    continue
+                content_type = mimetypes.guess_type(name)[0] or "image/jpeg"
+                yield (
+                    f"--{boundary}\r\n"
+                    f"Content-Type: {content_type}\r\n"
+                    f"Content-Length: {len(content)}\r\n"
+                    f"X-Image-Id: {pk}\r\n\r\n"
+                ).encode()
+                yield content
+                yield b"\r\n"
+            yield f"--{boundary}--\r\n".encode()
+
+        return StreamingHttpResponse(
+            parts(), content_type=f"multipart/mixed; boundary={boundary}"
+        )
+
+
+class ContactSheetSpriteView(generics.GenericAPIView):
+    """
+    Serve a sprite composed by ContactSheetView.
+
+    Sprites are addressed by content hash, so responses are immutable.
+    """
+
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, digest, *args, **kwargs):
+        """
+        Serve the stored sprite image.
+
+        Raises:
+            NotFound: If the sprite expired or belongs to someone else.
+        """
+        cached = cache.get(f"contact_sheet_{digest}")
+        if cached is None or cached["user_id"] != request.user.pk:
+            raise NotFound("The contact sheet has expired. Please request it again.")
+        storage = Image._meta.get_field("thumbnail_Basic").storage
+        try:
+            with storage.open(cached["sprite"], "rb") as sprite:
+                response = HttpResponse(sprite.read(), content_type="image/jpeg")
+        except FileNotFoundError:
+            raise NotFound("The contact sheet has expired. Please request it again.")
+        response[
+            "Cache-Control"
+        ] = f"private, max-age={CONTACT_SHEET_CACHE_TIMEOUT}, immutable"
+        return response
+
+
+class ExportView(UserImagesMixin, generics.GenericAPIView):
+    """
+    Download the user's image library as a streamed ZIP archive.
+
+    Query parameters:
+        variant: ``original``, ``Basic`` or ``Premium``; may be repeated.
+            Defaults to the originals when the plan includes them, otherwise
+            to the Basic thumbnails.
+
+    Files are stored without recompression and read in chunks as the archive
+    is sent, so memory use stays constant whatever the library size. The
+    stream stops as soon as the client disconnects.
+    """
+
+    permission_classes = [IsAuthenticated]
+    variant_fields = {
+        "original": "image",
+        "Basic": "thumbnail_Basic",
+        "Premium": "thumbnail_Premium",
+    }
+
+    def get_variants(self, original_file):
+        """
+        Get the requested variants.
+
+        Args:
+            original_file (bool): Whether the user may download originals.
+
+        Returns:
+            list: The requested variant names.
+
+        Raises:
+            ValidationError: If a variant is unknown or not included in the plan.
+        """
+        variants = self.request.GET.getlist("variant") or [
+            "original" if original_file else "Basic"
+        ]
+        for variant in variants:
+            if variant not in self.variant_fields:
+                raise ValidationError(
+                    {"variant": "Expected original, Basic or Premium."}
+                )
+        if "original" in variants and not original_file:
+            raise ValidationError(
+                {"variant": "Original files are not included in your plan."}
+            )
+        return list(dict.fromkeys(variants))
+
+    def get(self, request, *args, **kwargs):
+        """
+        Stream the archive.
+
+        Raises:
+            ValidationError: If a requested variant is not available.
+        """
+        user = request.user
+        if user.is_staff:
+            original_file = True
+        else:
+            subscription_plan = self.get_user_profile().subscription_plan
+            original_file = bool(subscription_plan and subscription_plan.original_file)
+        variants = self.get_variants(original_file)
+        fields = [self.variant_fields[variant] for variant in variants]
+        queryset = (
+            self.get_servable_queryset()
+            .order_by("pk")
+            .values_list("pk", "title", "created_at", *fields)
+        )
+        storage = Image._meta.get_field("image").storage
+
+        async def files():
+            # Keyset pagination keeps one batch of rows in memory at a time.
+            last_pk = 0
+            while True:
+                rows = await sync_to_async(list)(
+                    queryset.filter(pk__gt=last_pk)[:EXPORT_BATCH_SIZE]
+                )
+                if not rows:
+                    return
+                for pk, title, created_at, *names in rows:
+                    folder = f"{pk}-{slugify(title) or 'image'}"
+                    for variant, name in zip(variants, names):
+                        if not name:
+                            continue
+                        extension = os.path.splitext(name)[1]
+                        path = storage.path(name)
+                        yield f"{folder}/{variant}{extension}", path, created_at
+                last_pk = rows[-1][0]
+
+        async def archive():
+            zip_stream = ZipStream(is_disconnected=lambda: client_disconnected(request))
+            try:
+                async for chunk in zip_stream.stream(files()):
+                    yield chunk
+            except ClientDisconnected:
+                logger.info(
+                    "Export for user %s aborted by the client after %d bytes.",
+                    user.pk,
+                    zip_stream.offset,
+                )
+
+        response = StreamingHttpResponse(archive(), content_type="application/zip")
+        response[
+            "Content-Disposition"
+        ] = f'attachment; filename="{slugify(user.username) or "images"}.zip"'
+        return response
+
+
+class ProgressEventsView(generics.GenericAPIView):
+    """
+    Stream the processing events of the user's images as server-sent events.
+
+    Query parameters:
+        image: Only send the events of this image ID; may be repeated.
+
+    Events are ``received`` once an upload is stored, ``variant`` each time a
+    thumbnail variant is written (with ``variant`` set to ``Basic`` or
+    ``Premium``) and ``failed`` when processing an upload fails;
+    ``interrupted`` means events may have been lost. Events are not
+    replayed, so open the stream before uploading. A comment is sent
+    every ``PROGRESS_EVENTS["HEARTBEAT"]`` seconds while idle, so proxies keep
+    the connection open and a vanished client is noticed.
+    """
+
+    permission_classes = [IsAuthenticated]
+
+    def perform_content_negotiation(self, request, force=False):
+        # No renderer offers text/event-stream; the response bypasses them.
+        return super().perform_content_negotiation(request, force=True)
+
+    def get(self, request, *args, **kwargs):
+        """
+        Open the event stream.
+
+        Raises:
+            ValidationError: If an image ID is not a number.
+        """
+        try:
+            images = {int(pk) for pk in request.GET.getlist("image")}
+        except ValueError:
+            raise ValidationError({"image": "Expected image IDs."})
+        user_id = request.user.pk
+        heartbeat = settings.PROGRESS_EVENTS["HEARTBEAT"]
+        backend = events.get_backend()
+
+        async def stream():
+            try:
+                async with backend.subscribe(user_id) as subscription:
+                    metrics.set_gauge(
+                        "imagecraft_event_streams", backend.broker.subscriber_count()
+                    )
+                    yield f"retry: {EVENTS_RETRY_MS}\n\n".encode()
+                    while not client_disconnected(request):
+                        event = await subscription.get(heartbeat)
+                        if event is None:
+                            yield b": keepalive\n\n"
+                        elif (
+                            "image" not in event
+                            or not images
+                            or event["image"] in images
+                        ):
+                            yield events.format_event(event)
+            finally:
+                metrics.set_gauge(
+                    "imagecraft_event_streams", backend.broker.subscriber_count()
+                )
+
+        response = StreamingHttpResponse(stream(), content_type="text/event-stream")
+        response["Cache-Control"] = "no-cache"
+        # Tell nginx to pass events through as they are written.
+        response["X-Accel-Buffering"] = "no"
+        return response
+
+
+class MetricsView(generics.GenericAPIView):
+    """
+    Expose the application metrics of all worker processes to Prometheus.
+    """
+
+    permission_classes = [IsAdminUser]
+
+    def get(self, request, *args, **kwargs):
+        """
+        Render the metrics in the Prometheus text exposition format.
+        """
+        return HttpResponse(
+            metrics.render(), content_type="text/plain; version=0.0.4; charset=utf-8"
+        )
@@ -0,0 +1,245 @@
+import os
+import struct
+import zlib
+from datetime import datetime
+from asgiref.sync import sync_to_async
+
+# Sizes, offsets and entry counts at or above these need ZIP64 records.
+ZIP64_LIMIT = 0xFFFFFFFF
+ZIP64_COUNT_LIMIT = 0xFFFF
+# Values stored in the classic fields when the real one is in a ZIP64 record.
+ZIP64_MARKER = 0xFFFFFFFF
+ZIP64_COUNT_MARKER = 0xFFFF
+
+ZIP_VERSION = 20
+ZIP64_VERSION = 45
+# Bit 3: sizes and CRC follow the data. Bit 11: names are UTF-8.
+ZIP_FLAGS = 0x0808
+CHUNK_SIZE = 256 * 1024
+# The earliest timestamp a ZIP entry can carry.
+ZIP_EPOCH = datetime(1980, 1, 1)
+
+
+class ClientDisconnected(Exception):
+    """
+    Raised when the client went away while an archive was being streamed.
+    """
+
+
+def _dos_datetime(moment):
+    date = (moment.year - 1980) << 9 | moment.month << 5 | moment.day
+    time = moment.hour << 11 | moment.minute << 5 | moment.second // 2
+    return time, date
+
+
+class ZipEntry:
+    """
+    A file written to the archive, recorded for the central directory.
+    """
+
+    def __init__(self, name, modified, size, offset):
+        self.name = name.encode("utf-8")
+        self.time, self.date = _dos_datetime(
+            max(modified.replace(tzinfo=None), ZIP_EPOCH)
+        )
+        self.size = size
+        self.offset = offset
+        self.crc = 0
+        self.zip64 = size >= ZIP64_LIMIT
+
+    def local_header(self):
+        if self.zip64:
+            extra = struct.pack("<HHQQ", 0x0001, 16, 0, 0)
+            sizes = ZIP64_MARKER
+        else:
+            extra = b""
+            sizes = 0
+        return (
+            struct.pack(
+                "<IHHHHHIIIHH",
+                0x04034B50,
+                ZIP64_VERSION if self.zip64 else ZIP_VERSION,
+                ZIP_FLAGS,
+                0,  # Stored, no compression.
+                self.time,
+                self.date,
+                0,
+                sizes,
+                sizes,
+                len(self.name),
+                len(extra),
+            )
+            + self.name
+            + extra
+        )
+
+    def data_descriptor(self):
+        if self.zip64:
+            return struct.pack("<IIQQ", 0x08074B50, self.crc, self.size, self.size)
+        return struct.pack("<IIII", 0x08074B50, self.crc, self.size, self.size)
+
+    def central_directory_header(self):
+        zip64_fields = []
+        size = self.size
+        offset = self.offset
+        if size >= ZIP64_LIMIT:
+            zip64_fields += [size, size]
+            size = ZIP64_MARKER
+        if offset >= ZIP64_LIMIT:
+            zip64_fields.append(offset)
+            offset = ZIP64_MARKER
+        extra = b""
+        if zip64_fields:
+            extra = struct.pack(
+                f"<HH{len(zip64_fields)}Q",
+                0x0001,
+                8 * len(zip64_fields),
+                *zip64_fields,
+            )
+        version = ZIP64_VERSION if zip64_fields else ZIP_VERSION
+        return (
+            struct.pack(
+                "<IHHHHHHIIIHHHHHII",
+                0x02014B50,
+                version,
+                version,
+                ZIP_FLAGS,
+                0,
+                self.time,
+                self.date,
+                self.crc,
+                size,
+                size,
+                len(self.name),
+                len(extra),
+                0,
+                0,
+                0,
+                0o100644 << 16,
+                offset,
+            )
+            + self.name
+            + extra
+        )
+
+
+class ZipStream:
+    """
+    Write a stored (uncompressed) ZIP archive as a stream of byte chunks.
+
+    Entries are never buffered: every file is read and emitted chunk by chunk
+    with its CRC computed on the fly and written in a trailing data descriptor,
+    so memory use does not depend on file or archive size. ZIP64 records are
+    emitted only for the files, offsets and entry counts that need them.
+    """
+
+    def __init__(self, chunk_size=CHUNK_SIZE, is_disconnected=None):
+        """
+        Args:
+            chunk_size (int): The number of bytes read from a file at a time.
+            is_disconnected (callable, optional): Returns True once the client
+                went away; checked before every chunk.
+        """
+        self.chunk_size = chunk_size
+        self.is_disconnected = is_disconnected or (lambda: False)
+        self.entries = []
+        self.offset = 0
+
+    def _emit(self, data):
+        self.offset += len(data)
+        return data
+
+    def _check_connection(self):
+        if self.is_disconnected():
+            raise ClientDisconnected()
+
+    async def stream(self, files):
+        """
+        Stream the archive.
+
+        Args:
+            files: An async iterable of ``(name, path, modified)`` tuples, where
+                ``modified`` is a datetime. Files that disappeared before being
+                read are skipped.
+
+        Yields:
+            bytes: The next chunk of the archive.
+
+        Raises:
+            ClientDisconnected: If the client went away mid-stream.
+        """
+        async for name, path, modified in files:
+            self._check_connection()
+            try:
+                source = await sync_to_async(open, thread_sensitive=False)(path, "rb")
+            except FileNotFoundError:
+                continue
+            try:
+                size = (
+                    await sync_to_async(os.fstat, thread_sensitive=False)(
+                        source.fileno()
+                    )
+                ).st_size
+                entry = ZipEntry(name, modified, size, self.offset)
+                yield self._emit(entry.local_header())
+                crc = 0
+                written = 0
+                while True:
+                    self._check_connection()
+                    chunk = await sync_to_async(source.read, thread_sensitive=False)(
+                        self.chunk_size
+                    )
+                    if not chunk:
+                        break
+                    crc = zlib.crc32(chunk, crc)
+                    written += len(chunk)
+                    yield self._emit(chunk)
+            finally:
+                source.close()
+            entry.crc = crc
+            entry.size = written
+            self.entries.append(entry)
+            yield self._emit(entry.data_descriptor())
+
+        yield self.central_directory()
+
+    def central_directory(self):
+        """
+        Build the central directory and end-of-archive records.
+
+        Returns:
+            bytes: The records closing the archive.
+        """
+        start = self.offset
+        directory = b"".join(entry.central_directory_header() for entry in self.entries)
+        size = len(directory)
+        count = len(self.entries)
+        records = [directory]
+        if count >= ZIP64_COUNT_LIMIT or size >= ZIP64_LIMIT or start >= ZIP64_LIMIT:
+            zip64_end = start + size
+            records.append(
+                struct.pack(
+                    "<IQHHIIQQQQ",
+                    0x06064B50,
+                    44,
+                    ZIP64_VERSION,
+                    ZIP64_VERSION,
+                    0,
+                    0,
+                    count,
+                    count,
+                    size,
+                    start,
+                )
+            )
+            records.append(struct.pack("<IIQI", 0x07064B50, 0, zip64_end, 1))
+            if count >= ZIP64_COUNT_LIMIT:
+                count = ZIP64_COUNT_MARKER
+            if size >= ZIP64_LIMIT:
+                size = ZIP64_MARKER
+            if start >= ZIP64_LIMIT:
+                start = ZIP64_MARKER
+        records.append(
+            struct.pack("<IHHHHIIH", 0x06054B50, 0, 0, count, count, size, start, 0)
+        )
+        return self._emit(b"".join(records))
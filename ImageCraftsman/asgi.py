@@ -17,3 +17,10 @@ application = ASGIStaticFilesHandler(get_asgi_application())
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "ImageCraftsman.settings")
 
 application = get_asgi_application()
+
+from ImageCraftApp.middleware import (  # noqa: E402
+    ClientDisconnectMiddleware,
+    LoopMonitorMiddleware,
+)
+
+application = LoopMonitorMiddleware(ClientDisconnectMiddleware(application))
@@ -0,0 +1,115 @@
+"""
+Per-worker memory watchdog for gunicorn.
+
+Decoding large images makes glibc's heap grow in ways it rarely gives back,
+so long-lived workers creep towards the OOM killer. The watchdog samples the
+worker's RSS; past the soft limit it asks malloc to return free memory to the
+OS, and past the hard limit it sends the worker SIGTERM, which uvicorn treats
+as a graceful shutdown: it stops accepting connections, drains in-flight
+requests and exits, and the gunicorn master starts a fresh worker.
+"""
+
+import ctypes
+import ctypes.util
+import logging
+import os
+import signal
+import threading
+
+logger = logging.getLogger(__name__)
+
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+
+def current_rss():
+    """
+    Get the resident set size of the current process.
+
+    Returns:
+        int: The RSS in bytes, or 0 where /proc is unavailable.
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * PAGE_SIZE
+    except (OSError, IndexError, ValueError):
+        return 0
+
+
+def trim_heap():
+    """
+    Ask glibc to return free heap memory to the operating system.
+
+    Returns:
+        bool: True if malloc_trim is available and released memory.
+    """
+    libc_name = ctypes.util.find_library("c")
+    if not libc_name:
+        return False
+    try:
+        return bool(ctypes.CDLL(libc_name).malloc_trim(0))
+    except (OSError, AttributeError):
+        return False
+
+
+class MemoryWatchdog(threading.Thread):
+    """
+    Daemon thread recycling its worker once RSS passes a high-water mark.
+    """
+
+    def __init__(self, soft_limit, hard_limit, interval=10.0):
+        """
+        Args:
+            soft_limit (int): RSS in bytes above which the heap is trimmed.
+            hard_limit (int): RSS in bytes above which the worker is recycled.
+            interval (float): Seconds between samples.
+        """
+        super().__init__(name="memory-watchdog", daemon=True)
+        self.soft_limit = soft_limit
+        self.hard_limit = hard_limit
+        self.interval = interval
+        self.stopped = threading.Event()
+
+    def check(self):
+        """
+        Sample RSS once and act on it.
+
+        Returns:
+            bool: True if the worker is being recycled.
+        """
+        # Imported here: the watchdog module is loaded by gunicorn_config.py
+        # before Django is set up.
+        from ImageCraftApp.metrics import metrics
+
+        rss = current_rss()
+        if rss > self.soft_limit and trim_heap():
+            metrics.inc("imagecraft_worker_heap_trims_total")
+            rss = current_rss()
+        metrics.set_gauge("imagecraft_worker_rss_bytes", rss)
+        if rss > self.hard_limit:
+            logger.warning(
+                "Worker %s RSS %d MiB is above %d MiB, recycling.",
+                os.getpid(),
+                rss // 2**20,
+                self.hard_limit // 2**20,
+            )
+            metrics.inc("imagecraft_worker_recycles_total", reason="rss")
+            metrics.flush()
+            self.recycle()
+            return True
+        metrics.flush()
+        return False
+
+    def recycle(self):
+        """
+        Shut the worker down gracefully; the master replaces it.
+        """
+        self.stopped.set()
+        os.kill(os.getpid(), signal.SIGTERM)
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                if self.check():
+                    return
+            except Exception:
+                logger.exception("Memory watchdog check failed.")
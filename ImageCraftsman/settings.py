@@ -49,12 +49,15 @@ INSTALLED_APPS = [
     "django.contrib.staticfiles",
     "rest_framework",
     "ImageCraftApp",
-    "debug_toolbar",
 ]
 
 REST_FRAMEWORK = {
     "DEFAULT_PAGINATION_CLASS": "rest_framework.pagination.PageNumberPagination",
     "PAGE_SIZE": 10,
+    "DEFAULT_RENDERER_CLASSES": [
+        "ImageCraftApp.renderers.ORJSONRenderer",
+        "rest_framework.renderers.BrowsableAPIRenderer",
+    ],
 }
 
 MIDDLEWARE = [
@@ -63,18 +66,22 @@ MIDDLEWARE = [
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
     "django.contrib.auth.middleware.AuthenticationMiddleware",
+    "ImageCraftApp.middleware.ProfilingMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
-    "debug_toolbar.middleware.DebugToolbarMiddleware",
 ]
 
-DEBUG_TOOLBAR_CONFIG = {
-    "SHOW_TOOLBAR_CALLBACK": lambda request: DEBUG,
-}
-
+# Development-only components; production profiles never load them.
 if DEBUG:
     import socket  # only if you haven't already imported this
 
+    INSTALLED_APPS.append("debug_toolbar")
+    MIDDLEWARE.append("debug_toolbar.middleware.DebugToolbarMiddleware")
+
+    DEBUG_TOOLBAR_CONFIG = {
+        "SHOW_TOOLBAR_CALLBACK": lambda request: DEBUG,
+    }
+
     hostname, _, ips = socket.gethostbyname_ex(socket.gethostname())
     INTERNAL_IPS = [ip[: ip.rfind(".")] + ".1" for ip in ips] + [
         "127.0.0.1",
@@ -88,6 +95,75 @@ CACHES = {
     }
 }
 
+# Per-process admission control for CPU-bound thumbnail rendering. Uploads
+# beyond these limits get 503 with Retry-After; serving is never queued.
+# Thumbnails missing since a plan upgrade are rendered on first serve in one
+# of MAX_LAZY separate slots; with none free, the Basic thumbnail is served.
+RENDER_ADMISSION = {
+    "MAX_CONCURRENT": env.int("RENDER_MAX_CONCURRENT", default=1),
+    "MAX_QUEUED": env.int("RENDER_MAX_QUEUED", default=4),
+    "QUEUE_TIMEOUT": env.float("RENDER_QUEUE_TIMEOUT", default=10.0),
+    "RETRY_AFTER": env.int("RENDER_RETRY_AFTER", default=5),
+    "MAX_LAZY": env.int("RENDER_MAX_LAZY", default=1),
+}
+# Per-image processing events streamed at /upload/events/. The in-process
+# backend only reaches streams served by the publishing worker; with several
+# workers use ImageCraftApp.events.PostgresBackend. Each stream buffers at
+# most QUEUE_SIZE events and sends a keepalive every HEARTBEAT seconds.
+PROGRESS_EVENTS = {
+    "BACKEND": env(
+        "PROGRESS_EVENTS_BACKEND", default="ImageCraftApp.events.InProcessBackend"
+    ),
+    "QUEUE_SIZE": env.int("PROGRESS_EVENTS_QUEUE_SIZE", default=16),
+    "HEARTBEAT": env.int("PROGRESS_EVENTS_HEARTBEAT", default=15),
+}
+# What uploads do about near-duplicates already in the user's library: "allow",
+# "warn" (list them in the response) or "reject" (409). Images count as
+# near-duplicates within DUPLICATE_DISTANCE differing bits of their 64-bit
+# perceptual hashes.
+DUPLICATE_UPLOADS = env("DUPLICATE_UPLOADS", default="warn")
+DUPLICATE_DISTANCE = env.int("DUPLICATE_DISTANCE", default=4)
+# "pillow" or "vips" (needs pyvips and libvips; falls back to Pillow without).
+THUMBNAIL_ENGINE = env("THUMBNAIL_ENGINE", default="pillow")
+# Uploads with more pixels than this are rejected unless their plan sets its
+# own max_pixels. While thumbnailing, a worker holds at most
+# THUMBNAIL_DECODE_PIXELS pixels (4 bytes each at most) of an original in memory
+# per render with Pillow; larger originals must be JPEG or uncompressed, or be
+# decodable by libvips with pyvips installed, or they are rejected at upload.
+MAX_IMAGE_PIXELS = env.int("MAX_IMAGE_PIXELS", default=100_000_000)
+THUMBNAIL_DECODE_PIXELS = env.int("THUMBNAIL_DECODE_PIXELS", default=16_000_000)
+# Animated thumbnails keep at most this many frames; longer animations are
+# decimated, keeping their playback speed.
+THUMBNAIL_MAX_FRAMES = env.int("THUMBNAIL_MAX_FRAMES", default=50)
+# Directory where each worker process publishes its metrics so any worker can
+# serve /metrics/ for all of them. Unset, only the current process is reported.
+METRICS_DIR = env("METRICS_DIR", default=None)
+# Event loop and executor monitoring; see ImageCraftApp.loop_monitor. The loop
+# is checked every INTERVAL seconds, and the stack of whatever holds it for
+# longer than BLOCKED_THRESHOLD seconds is logged.
+LOOP_MONITOR = {
+    "ENABLED": env.bool("LOOP_MONITOR_ENABLED", default=True),
+    "INTERVAL": env.float("LOOP_MONITOR_INTERVAL", default=0.25),
+    "BLOCKED_THRESHOLD": env.float("LOOP_MONITOR_BLOCKED_THRESHOLD", default=0.1),
+}
+# On-demand request profiling; see ImageCraftApp.profiling. Staff request a
+# profile with a token from `manage.py profile_token`; SAMPLE_RATE also profiles
+# that fraction of all requests, keeping those slower than MIN_DURATION seconds.
+# Collapsed stacks are written to DIR, which keeps the newest MAX_FILES.
+PROFILER = {
+    "DIR": env("PROFILER_DIR", default=os.path.join(BASE_DIR, "profiles")),
+    "INTERVAL": env.float("PROFILER_INTERVAL", default=0.005),
+    "SAMPLE_RATE": env.float("PROFILER_SAMPLE_RATE", default=0.0),
+    "MIN_DURATION": env.float("PROFILER_MIN_DURATION", default=1.0),
+    "MAX_FILES": env.int("PROFILER_MAX_FILES", default=100),
+    "MAX_ACTIVE": env.int("PROFILER_MAX_ACTIVE", default=2),
+    "TOKEN_MAX_AGE": env.int("PROFILER_TOKEN_MAX_AGE", default=3600),
+}
+# Longest time nginx may cache a serve-image response; shorter when the link
+# expires sooner. EDGE_CACHE_PURGE_URL points at an nginx location running
+# ngx_cache_purge; unset, stale entries are only dropped by versioned URLs.
+SERVE_CACHE_MAX_TTL = env.int("SERVE_CACHE_MAX_TTL", default=300)
+EDGE_CACHE_PURGE_URL = env("EDGE_CACHE_PURGE_URL", default=None)
 
 ROOT_URLCONF = "ImageCraftsman.urls"
 
@@ -135,6 +211,27 @@ DATABASES = {
     }
 }
 
+# Read replicas, as a space-separated list of hosts sharing the primary's
+# name, credentials and port; each becomes a "replica_<n>" alias. Serve-image,
+# transform and image-detail requests read from a healthy one; see
+# ImageCraftApp.db_router. Users are pinned to the primary for PIN_SECONDS
+# after a write. Replicas are checked every HEALTH_CHECK_INTERVAL seconds and
+# skipped while unreachable or more than MAX_LAG seconds behind.
+for index, host in enumerate(env("DATABASE_REPLICA_HOSTS", default="").split()):
+    DATABASES[f"replica_{index}"] = {
+        **DATABASES["default"],
+        "HOST": host,
+        # Tests read the test database through the replica aliases.
+        "TEST": {"MIRROR": "default"},
+    }
+READ_REPLICAS = {
+    "ALIASES": [alias for alias in DATABASES if alias != "default"],
+    "PIN_SECONDS": env.int("READ_REPLICA_PIN_SECONDS", default=10),
+    "HEALTH_CHECK_INTERVAL": env.float("READ_REPLICA_CHECK_INTERVAL", default=5.0),
+    "MAX_LAG": env.float("READ_REPLICA_MAX_LAG", default=5.0),
+}
+DATABASE_ROUTERS = ["ImageCraftApp.db_router.ReplicaRouter"]
+
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
 
@@ -174,6 +271,21 @@ STATICFILES_DIRS = [os.path.join(BASE_DIR, "static")]
 STATIC_ROOT = os.path.join(BASE_DIR, "staticfiles")
 MEDIA_URL = "/media/"
 MEDIA_ROOT = os.path.join(BASE_DIR, "media")
+# Hot/cold tiering of originals; see ImageCraftApp.tiering. Serve-image hits
+# are written every FLUSH_INTERVAL seconds, and sooner once FLUSH_SIZE images
+# have been hit. `manage.py tier_media` moves originals not served for
+# COLD_AFTER_DAYS days to COLD_ROOT, a slower volume; serving one moves it back.
+STORAGE_TIERS = {
+    "COLD_ROOT": env("COLD_MEDIA_ROOT", default=os.path.join(BASE_DIR, "media-cold")),
+    "COLD_AFTER_DAYS": env.int("COLD_AFTER_DAYS", default=7),
+    "FLUSH_INTERVAL": env.float("ACCESS_FLUSH_INTERVAL", default=10.0),
+    "FLUSH_SIZE": env.int("ACCESS_FLUSH_SIZE", default=1000),
+}
+# Image files are stored in a sharded layout; see ImageCraftApp.storage.
+STORAGES = {
+    "default": {"BACKEND": "ImageCraftApp.storage.ShardedStorage"},
+    "staticfiles": {"BACKEND": "django.contrib.staticfiles.storage.StaticFilesStorage"},
+}
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.2/ref/settings/#default-auto-field
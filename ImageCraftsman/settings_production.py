@@ -0,0 +1,39 @@
+"""
+Production settings for ImageCraftsman.
+
+Extends the base settings with DEBUG forced off, so none of the
+development-only components (debug toolbar, INTERNAL_IPS DNS lookup) are
+loaded, and with settings that keep startup and per-request work down.
+
+Select it with DJANGO_SETTINGS_MODULE=ImageCraftsman.settings_production.
+"""
+
+import os
+
+# Must be set before the base settings read it from the environment.
+os.environ["DEBUG"] = "False"
+
+from .settings import *  # noqa: E402,F401,F403
+
+DEBUG = False
+
+# Reuse database connections across requests instead of reconnecting. These
+# are per-database options, so they are set on the replicas too.
+for database in DATABASES.values():
+    database["CONN_MAX_AGE"] = env.int("CONN_MAX_AGE", default=60)
+    database["CONN_HEALTH_CHECKS"] = True
+
+# JSON only: the browsable API pulls in templates and forms on first use.
+REST_FRAMEWORK = {
+    **REST_FRAMEWORK,
+    "DEFAULT_RENDERER_CLASSES": ["ImageCraftApp.renderers.ORJSONRenderer"],
+}
+
+# Gunicorn runs several workers, so progress events must cross processes.
+if "postgresql" in DATABASES["default"]["ENGINE"] and not os.environ.get(
+    "PROGRESS_EVENTS_BACKEND"
+):
+    PROGRESS_EVENTS = {
+        **PROGRESS_EVENTS,
+        "BACKEND": "ImageCraftApp.events.PostgresBackend",
+    }
@@ -23,8 +23,10 @@ urlpatterns = (
     [
         path("admin/", admin.site.urls),
         path("", include("ImageCraftApp.urls")),
-        path("__debug__/", include("debug_toolbar.urls")),
     ]
     + static(settings.STATIC_URL, document_root=settings.STATIC_ROOT)
     + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
 )
+
+if "debug_toolbar" in settings.INSTALLED_APPS:
+    urlpatterns.append(path("__debug__/", include("debug_toolbar.urls")))
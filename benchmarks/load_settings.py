@@ -0,0 +1,36 @@
+"""
+Stand-in settings for running the load test without the docker-compose stack.
+
+Extends the production settings with SQLite and the local-memory cache in
+place of PostgreSQL and Memcached. The database and media files live in
+LOAD_TEST_DIR, which ``benchmarks/load_test.py`` creates for each run.
+Numbers measured this way compare builds of the app on one machine; they
+say little about what the full stack sustains.
+"""
+
+import os
+
+LOAD_TEST_DIR = os.environ.get("LOAD_TEST_DIR", "load-test")
+
+# Read by the base settings, which require them.
+os.environ.setdefault("DJANGO_SECRET_KEY", "load-test")
+os.environ.setdefault("DJANGO_ALLOWED_HOSTS", "localhost 127.0.0.1")
+os.environ.setdefault("CSRF_TRUSTED_ORIGINS", "http://localhost")
+os.environ.setdefault("CSRF_COOKIE_DOMAIN", "localhost")
+os.environ.setdefault("DATABASE_ENGINE", "django.db.backends.sqlite3")
+for name in ("NAME", "USERNAME", "PASSWORD", "HOST", "PORT"):
+    os.environ.setdefault(f"DATABASE_{name}", "")
+
+from ImageCraftsman.settings_production import *  # noqa: E402,F401,F403
+
+DATABASES = {
+    "default": {
+        "ENGINE": "django.db.backends.sqlite3",
+        "NAME": os.path.join(LOAD_TEST_DIR, "db.sqlite3"),
+        # Concurrent uploads wait for the write lock instead of failing.
+        "OPTIONS": {"timeout": 30},
+    }
+}
+READ_REPLICAS = {**READ_REPLICAS, "ALIASES": []}  # noqa: F405
+CACHES = {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+MEDIA_ROOT = os.path.join(LOAD_TEST_DIR, "media")
@@ -0,0 +1,474 @@
+"""
+Load test for ImageCraftsman with a Basic/Premium/Enterprise traffic mix.
+
+Seeds users on every subscription plan (``manage.py seed_load_users``), then
+concurrent clients send a weighted mix of uploads, serve-image requests for
+valid and for expired links, and image-detail requests for a fixed duration.
+Reports throughput, error rate and p50/p95/p99 latency per endpoint, checks
+them against thresholds and exits with status 1 if any fails.
+
+Without ``--url`` the app is started locally under uvicorn with SQLite and
+the local-memory cache (benchmarks/load_settings.py) in a temporary
+directory. To test the docker-compose stack, seed it and pass the output:
+
+Usage:
+    python benchmarks/load_test.py --duration 60 --concurrency 16
+    python benchmarks/load_test.py --mix upload=1,serve=20,detail=4,expired=1 \\
+        --plans Basic=6,Premium=3,Enterprise=1 --max-p95 serve=50,upload=2000
+
+    docker-compose exec web python manage.py seed_load_users > seed.json
+    python benchmarks/load_test.py --url http://localhost --seed seed.json
+
+Clients run closed-loop: each sends its next request as soon as the previous
+one completes, so raise ``--concurrency`` until throughput stops growing to
+find what the deployment sustains. Uploads refused with 503 by admission
+control count as errors.
+"""
+
+import argparse
+import base64
+import http.client
+import io
+import json
+import math
+import os
+import random
+import shutil
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+import uuid
+from collections import Counter
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SETTINGS = "benchmarks.load_settings"
+
+ENDPOINTS = ("upload", "serve", "expired", "detail")
+
+
+def weights(value):
+    """
+    Parse ``name=weight`` pairs separated by commas.
+
+    Returns:
+        dict: Mapping of name to number.
+    """
+    try:
+        pairs = [item.split("=") for item in value.split(",") if item]
+        return {name.strip(): float(number) for name, number in pairs}
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Expected name=number pairs: {value!r}")
+
+
+def percentile(values, fraction):
+    """
+    Get a percentile of sorted values by the nearest-rank method.
+    """
+    if not values:
+        return float("nan")
+    return values[max(math.ceil(fraction * len(values)) - 1, 0)]
+
+
+def make_upload(size):
+    """
+    Encode a JPEG of random pixels, so that no two uploads look alike.
+
+    Returns:
+        bytes: The encoded image.
+    """
+    from PIL import Image
+
+    image = Image.frombytes("RGB", size, os.urandom(size[0] * size[1] * 3))
+    buffer = io.BytesIO()
+    image.save(buffer, "JPEG", quality=85)
+    return buffer.getvalue()
+
+
+def multipart(fields, content):
+    """
+    Encode an upload form with the image under ``image``.
+
+    Returns:
+        tuple: The body and the Content-Type header.
+    """
+    boundary = uuid.uuid4().hex
+    parts = [
+        f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n'
+        f"{value}\r\n".encode()
+        for name, value in fields.items()
+    ]
+    parts.append(
+        f'--{boundary}\r\nContent-Disposition: form-data; name="image"; '
+        f'filename="load.jpg"\r\nContent-Type: image/jpeg\r\n\r\n'.encode()
+        + content
+        + b"\r\n"
+    )
+    parts.append(f"--{boundary}--\r\n".encode())
+    return b"".join(parts), f"multipart/form-data; boundary={boundary}"
+
+
+class Client:
+    """
+    One keep-alive HTTP connection, reopened after errors.
+    """
+
+    def __init__(self, url, timeout):
+        parts = urllib.parse.urlsplit(url)
+        self.connection_class = (
+            http.client.HTTPSConnection
+            if parts.scheme == "https"
+            else http.client.HTTPConnection
+        )
+        self.netloc = parts.netloc
+        self.prefix = parts.path.rstrip("/")
+        self.timeout = timeout
+        self.connection = None
+
+    def request(self, method, path, headers, body=None):
+        """
+        Send a request and read the whole response.
+
+        Returns:
+            int: The status, or 0 if the connection failed.
+        """
+        if self.connection is None:
+            self.connection = self.connection_class(self.netloc, timeout=self.timeout)
+        try:
+            self.connection.request(method, self.prefix + path, body, headers)
+            response = self.connection.getresponse()
+            response.read()
+        except (OSError, http.client.HTTPException):
+            self.connection.close()
+            self.connection = None
+            return 0
+        if response.will_close:
+            self.connection.close()
+            self.connection = None
+        return response.status
+
+
+def credentials(user, auth):
+    """
+    Get the headers authenticating a seeded user.
+
+    With ``session`` the user's session cookie is sent, with a CSRF cookie and
+    header for uploads. With ``basic`` every request carries the password,
+    which the server hashes each time, as API clients using Basic auth do.
+
+    Returns:
+        dict: The headers.
+    """
+    if auth == "basic":
+        token = base64.b64encode(f"{user['username']}:{user['password']}".encode())
+        return {"Authorization": f"Basic {token.decode()}"}
+    csrf_token = uuid.uuid4().hex
+    return {
+        "Cookie": f"sessionid={user['session']}; csrftoken={csrf_token}",
+        "X-CSRFToken": csrf_token,
+    }
+
+
+class Traffic:
+    """
+    Picks the next request of the mix: a user by plan weight, then an endpoint.
+    """
+
+    def __init__(self, users, plans, mix, uploads, auth):
+        self.users = {}
+        for user in users:
+            user["headers"] = credentials(user, auth)
+            self.users.setdefault(user["plan"], []).append(user)
+        missing = set(plans) - set(self.users)
+        if missing:
+            raise SystemExit(f"No seeded users on plans: {', '.join(sorted(missing))}")
+        unknown = set(mix) - set(ENDPOINTS)
+        if unknown:
+            raise SystemExit(f"Unknown endpoints: {', '.join(sorted(unknown))}")
+        self.plans = [plan for plan, weight in plans.items() if weight > 0]
+        self.plan_weights = [plans[plan] for plan in self.plans]
+        self.endpoints = [name for name, weight in mix.items() if weight > 0]
+        self.endpoint_weights = [mix[name] for name in self.endpoints]
+        self.uploads = uploads
+
+    def next(self, rng):
+        """
+        Pick the next request.
+
+        Returns:
+            tuple: The endpoint, method, path, headers, body and the statuses
+            that count as success.
+        """
+        plan = rng.choices(self.plans, self.plan_weights)[0]
+        user = rng.choice(self.users[plan])
+        endpoint = rng.choices(self.endpoints, self.endpoint_weights)[0]
+        headers = {**user["headers"], "Accept": "*/*"}
+        if endpoint == "upload":
+            body, headers["Content-Type"] = multipart(
+                {"title": "load", "link_expiration_time": 300},
+                rng.choice(self.uploads),
+            )
+            return endpoint, "POST", "/upload/", headers, body, (201,)
+        if endpoint == "serve":
+            pk, variant = rng.choice(user["images"]), rng.choice(user["variants"])
+            path = f"/serve-image/{pk}/{variant}/"
+            return endpoint, "GET", path, headers, None, (200,)
+        if endpoint == "expired":
+            path = f"/serve-image/{rng.choice(user['expired_images'])}/Basic/"
+            return endpoint, "GET", path, headers, None, (user["expired_status"],)
+        path = f"/image_detail/{rng.choice(user['images'])}/"
+        return endpoint, "GET", path, headers, None, (200,)
+
+
+def run_client(url, traffic, timeout, measure_from, deadline, samples):
+    rng = random.Random()
+    client = Client(url, timeout)
+    while time.monotonic() < deadline:
+        endpoint, method, path, headers, body, expected = traffic.next(rng)
+        started = time.monotonic()
+        status = client.request(method, path, headers, body)
+        if started >= measure_from:
+            samples.append(
+                (endpoint, status, time.monotonic() - started, status in expected)
+            )
+
+
+def run_load(url, traffic, concurrency, duration, warmup, timeout):
+    """
+    Drive the traffic from ``concurrency`` clients.
+
+    Returns:
+        list: ``(endpoint, status, seconds, ok)`` tuples of the requests sent
+        after the warmup.
+    """
+    measure_from = time.monotonic() + warmup
+    deadline = measure_from + duration
+    per_client = [[] for _ in range(concurrency)]
+    threads = [
+        threading.Thread(
+            target=run_client,
+            args=(url, traffic, timeout, measure_from, deadline, samples),
+            daemon=True,
+        )
+        for samples in per_client
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return [sample for samples in per_client for sample in samples]
+
+
+def summarize(samples, duration):
+    """
+    Compute throughput, error rate and latency percentiles per endpoint.
+
+    Returns:
+        dict: Mapping of endpoint (and ``total``) to its statistics, with
+        latencies in milliseconds.
+    """
+    groups = {}
+    for sample in samples:
+        groups.setdefault(sample[0], []).append(sample)
+        groups.setdefault("total", []).append(sample)
+    summary = {}
+    for name, group in groups.items():
+        latencies = sorted(seconds * 1000 for _, _, seconds, _ in group)
+        errors = sum(not ok for *_, ok in group)
+        summary[name] = {
+            "requests": len(group),
+            "rps": len(group) / duration,
+            "error_rate": errors / len(group),
+            "p50": percentile(latencies, 0.50),
+            "p95": percentile(latencies, 0.95),
+            "p99": percentile(latencies, 0.99),
+            "statuses": Counter(status for _, status, _, _ in group),
+        }
+    return summary
+
+
+def check(summary, max_error_rate, max_p95, max_p99, min_rps):
+    """
+    Check the summary against the thresholds.
+
+    Returns:
+        list: A description of every threshold that failed.
+    """
+    failures = []
+    for name, stats in summary.items():
+        if stats["error_rate"] > max_error_rate:
+            failures.append(
+                f"{name}: error rate {stats['error_rate']:.2%} > {max_error_rate:.2%}"
+            )
+    for key, limits in (("p95", max_p95), ("p99", max_p99)):
+        for name, limit in limits.items():
+            value = summary.get(name, {}).get(key)
+            if value is not None and value > limit:
+                failures.append(f"{name}: {key} {value:.1f} ms > {limit:g} ms")
+    for name, limit in min_rps.items():
+        value = summary.get(name, {}).get("rps", 0)
+        if value < limit:
+            failures.append(f"{name}: {value:.1f} req/s < {limit:g} req/s")
+    return failures
+
+
+def print_report(summary, duration):
+    print(f"Measured for {duration:.0f} s")
+    print(
+        f"{'endpoint':<9} {'requests':>9} {'req/s':>8} {'errors':>7} "
+        f"{'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}  statuses"
+    )
+    for name in (*ENDPOINTS, "total"):
+        if name not in summary:
+            continue
+        stats = summary[name]
+        statuses = " ".join(
+            f"{status or 'conn'}:{count}"
+            for status, count in sorted(stats["statuses"].items())
+        )
+        print(
+            f"{name:<9} {stats['requests']:>9} {stats['rps']:>8.1f} "
+            f"{stats['error_rate']:>7.2%} {stats['p50']:>8.1f} {stats['p95']:>8.1f} "
+            f"{stats['p99']:>8.1f}  {statuses}"
+        )
+
+
+def manage(env, *args):
+    return subprocess.run(
+        [sys.executable, "manage.py", *args],
+        cwd=BASE_DIR,
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout
+
+
+def start_local(directory, args):
+    """
+    Migrate and seed a fresh SQLite database and start uvicorn on it.
+
+    Returns:
+        tuple: The server process, its URL and the seeded users.
+    """
+    env = {**os.environ, "DJANGO_SETTINGS_MODULE": SETTINGS, "LOAD_TEST_DIR": directory}
+    manage(env, "migrate", "--verbosity", "0")
+    # WAL lets readers proceed while an upload holds the write lock.
+    with sqlite3.connect(os.path.join(directory, "db.sqlite3")) as connection:
+        connection.execute("PRAGMA journal_mode=WAL")
+    seed = manage(
+        env,
+        "seed_load_users",
+        "--users-per-plan",
+        str(args.users_per_plan),
+        "--images",
+        str(args.images),
+    )
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        port = probe.getsockname()[1]
+    server = subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "uvicorn",
+            "ImageCraftsman.asgi:application",
+            "--port",
+            str(port),
+            "--workers",
+            str(args.workers),
+            "--log-level",
+            "warning",
+            "--no-access-log",
+        ],
+        cwd=BASE_DIR,
+        env=env,
+    )
+    url = f"http://127.0.0.1:{port}"
+    for _ in range(300):
+        if server.poll() is not None:
+            raise SystemExit("The server exited during startup.")
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            break
+        except OSError:
+            time.sleep(0.1)
+    return server, url, json.loads(seed)["users"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--url", help="A running deployment; local if omitted.")
+    parser.add_argument(
+        "--seed", help="Output of `manage.py seed_load_users`, with --url."
+    )
+    parser.add_argument("--duration", type=float, default=30)
+    parser.add_argument("--warmup", type=float, default=5)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--timeout", type=float, default=30)
+    parser.add_argument(
+        "--mix", type=weights, default="upload=1,serve=12,detail=4,expired=1"
+    )
+    parser.add_argument(
+        "--plans", type=weights, default="Basic=6,Premium=3,Enterprise=1"
+    )
+    parser.add_argument("--auth", choices=["session", "basic"], default="session")
+    parser.add_argument("--upload-size", default="1280x960")
+    parser.add_argument("--max-error-rate", type=float, default=0.01)
+    parser.add_argument("--max-p95", type=weights, default={}, help="ms, e.g. serve=50")
+    parser.add_argument("--max-p99", type=weights, default={}, help="ms")
+    parser.add_argument(
+        "--min-rps", type=weights, default={}, help="e.g. upload=2,total=100"
+    )
+    parser.add_argument("--workers", type=int, default=1, help="Local server only.")
+    parser.add_argument("--users-per-plan", type=int, default=2, help="Local only.")
+    parser.add_argument("--images", type=int, default=5, help="Local only.")
+    parser.add_argument("--keep", action="store_true", help="Keep the local data.")
+    args = parser.parse_args()
+    if args.url and not args.seed:
+        parser.error("--url needs --seed")
+
+    size = tuple(int(value) for value in args.upload_size.split("x"))
+    uploads = [make_upload(size) for _ in range(4)]
+    server = directory = None
+    try:
+        if args.url:
+            url = args.url
+            with open(args.seed) as seed:
+                users = json.load(seed)["users"]
+        else:
+            directory = tempfile.mkdtemp(prefix="imagecraft-load-")
+            server, url, users = start_local(directory, args)
+        traffic = Traffic(users, args.plans, args.mix, uploads, args.auth)
+        print(f"Target: {url}, {args.concurrency} clients, {len(users)} users")
+        samples = run_load(
+            url, traffic, args.concurrency, args.duration, args.warmup, args.timeout
+        )
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+        if directory is not None:
+            if args.keep:
+                print(f"Local data kept in {directory}")
+            else:
+                shutil.rmtree(directory, ignore_errors=True)
+
+    summary = summarize(samples, args.duration)
+    print_report(summary, args.duration)
+    failures = check(
+        summary, args.max_error_rate, args.max_p95, args.max_p99, args.min_rps
+    )
+    print()
+    for failure in failures:
+        print(f"FAIL {failure}")
+    print("FAIL" if failures else "PASS")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
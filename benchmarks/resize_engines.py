@@ -0,0 +1,127 @@
+"""
+Resize engine benchmark for ImageCraftsman.
+
+Renders the 400 and 200 pixel thumbnails of synthetic originals with every
+resize engine, each in a fresh interpreter process, and reports the median
+render time and the peak memory added by rendering.
+
+Usage:
+    python benchmarks/resize_engines.py
+    python benchmarks/resize_engines.py --dimensions 4000x3000,12000x9000 --runs 5
+
+Engines whose libraries are not installed are reported as unavailable.
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+FORMATS = {"jpeg": "JPEG", "png": "PNG", "tiff": "TIFF"}
+
+RENDER = """
+import re, statistics, sys, time
+from ImageCraftApp import resize_engines
+
+def peak_kib():
+    with open("/proc/self/status") as f:
+        return int(re.search(r"VmHWM:\\s+(\\d+)", f.read())[1])
+
+engine_name, path, runs, decode_pixels = sys.argv[1:]
+try:
+    if engine_name == "pillow":
+        engine = resize_engines.PillowEngine(int(decode_pixels))
+    else:
+        engine = resize_engines.ENGINES[engine_name]()
+except (ImportError, OSError):
+    print("unavailable")
+    sys.exit()
+before = peak_kib()
+durations = []
+for _ in range(int(runs)):
+    started = time.perf_counter()
+    engine.render(path, [400, 200])
+    durations.append(time.perf_counter() - started)
+print(statistics.median(durations), peak_kib() - before)
+"""
+
+
+def make_original(directory, dimensions, extension):
+    """
+    Write a gradient original of the given size and format.
+
+    Returns:
+        str: The file path of the original.
+    """
+    from PIL import Image
+
+    width, height = dimensions
+    path = os.path.join(directory, f"{width}x{height}.{extension}")
+    Image.linear_gradient("L").resize((width, height)).convert("RGB").save(
+        path, FORMATS[extension]
+    )
+    return path
+
+
+def render(engine, path, runs, decode_pixels):
+    """
+    Benchmark one engine on one original in a fresh process.
+
+    Returns:
+        tuple: Median seconds per render and peak KiB added, or None if the
+        engine is unavailable.
+    """
+    result = subprocess.run(
+        [sys.executable, "-c", RENDER, engine, path, str(runs), str(decode_pixels)],
+        cwd=BASE_DIR,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    if result.stdout.strip() == "unavailable":
+        return None
+    seconds, peak_kib = result.stdout.split()
+    return float(seconds), int(peak_kib)
+
+
+def main():
+    from ImageCraftApp.resize_engines import ENGINES
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--dimensions", default="2000x1500,8000x6000")
+    parser.add_argument("--formats", default=",".join(FORMATS))
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument(
+        "--decode-pixels",
+        type=int,
+        default=10**9,
+        help="Pillow's THUMBNAIL_DECODE_PIXELS; the default disables the budget.",
+    )
+    args = parser.parse_args()
+
+    print(f"{'original':<18}{'engine':<8}{'median ms':>11}{'peak MiB':>10}")
+    with tempfile.TemporaryDirectory() as directory:
+        for dimensions in args.dimensions.split(","):
+            for extension in args.formats.split(","):
+                path = make_original(
+                    directory, tuple(map(int, dimensions.split("x"))), extension
+                )
+                label = os.path.basename(path)
+                for engine in ENGINES:
+                    measured = render(engine, path, args.runs, args.decode_pixels)
+                    if measured is None:
+                        print(f"{label:<18}{engine:<8}{'unavailable':>21}")
+                        continue
+                    seconds, peak_kib = measured
+                    print(
+                        f"{label:<18}{engine:<8}{seconds * 1000:>11.1f}"
+                        f"{peak_kib / 1024:>10.1f}"
+                    )
+
+
+if __name__ == "__main__":
+    sys.path.insert(0, BASE_DIR)
+    main()
@@ -0,0 +1,136 @@
+"""
+Serialization benchmark for ImageCraftsman image responses.
+
+Serializes a page of images with ImageSerializer and renders it to JSON, once
+the way responses were produced before (``build_absolute_uri`` per URL, DRF's
+JSONRenderer) and once with the current path (one base URL per request, URL
+template, ORJSONRenderer), and reports the median time of each.
+
+Usage:
+    python benchmarks/serialization.py
+    python benchmarks/serialization.py --images 1000 --runs 20
+
+Runs against unsaved model instances, so no database or environment is needed.
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import time
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def setup_django():
+    import django
+    from django.conf import settings
+
+    settings.configure(
+        INSTALLED_APPS=[
+            "django.contrib.contenttypes",
+            "django.contrib.auth",
+            "rest_framework",
+            "ImageCraftApp",
+        ],
+        DATABASES={"default": {"ENGINE": "django.db.backends.sqlite3"}},
+        ALLOWED_HOSTS=["testserver"],
+        MEDIA_ROOT="/srv/media",
+        SERVE_CACHE_MAX_TTL=300,
+        EDGE_CACHE_PURGE_URL=None,
+    )
+    django.setup()
+
+
+def legacy_representation(serializer, instance, plan):
+    """
+    The representation as built before URL templates: three absolute URI
+    lookups per image.
+    """
+    request = serializer.context["request"]
+    if not plan.original_file:
+        return {
+            "thumbnail_Basic": request.build_absolute_uri(
+                f"/serve-image/{instance.pk}/?q={instance.thumbnail_Basic.path}"
+                f"&v={instance.cache_version}"
+            ),
+            "placeholder": instance.placeholder,
+        }
+    return {
+        "thumbnail_Basic": request.build_absolute_uri(
+            f"/serve-image/{instance.pk}/?q={instance.thumbnail_Basic.path}"
+            f"&v={instance.cache_version}"
+        ),
+        "thumbnail_premium_url": request.build_absolute_uri(
+            f"/serve-image/{instance.pk}/?q={instance.thumbnail_Premium.path}"
+            f"&v={instance.cache_version}"
+        ),
+        "original_image": request.build_absolute_uri(
+            f"/serve-image/{instance.pk}/?q={instance.image.path}"
+            f"&v={instance.cache_version}"
+        ),
+        "placeholder": instance.placeholder,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--images", type=int, default=500)
+    parser.add_argument("--runs", type=int, default=10)
+    args = parser.parse_args()
+
+    setup_django()
+    from unittest import mock
+    from rest_framework.renderers import JSONRenderer
+    from rest_framework.test import APIRequestFactory
+    from ImageCraftApp.models import CustomSubscriptionPlan, Image
+    from ImageCraftApp.renderers import ORJSONRenderer
+    from ImageCraftApp.serializers import ImageSerializer
+
+    plan = CustomSubscriptionPlan(
+        pk=1, name="Premium", thumbnail_size=200, premium_thumbnail_size=400
+    )
+    plan.original_file = True
+    images = [
+        Image(
+            pk=pk,
+            user_id=1,
+            title=f"image {pk}",
+            image=f"images/photo_{pk}.jpg",
+            thumbnail_Basic=f"images/thumbnail_200_{pk}.jpeg",
+            thumbnail_Premium=f"images/thumbnail_400_{pk}.jpeg",
+            placeholder="data:image/webp;base64,UklGRg==",
+        )
+        for pk in range(1, args.images + 1)
+    ]
+
+    def render(renderer, representation=None):
+        request = APIRequestFactory().get("/images/")
+        serializer = ImageSerializer(images, many=True, context={"request": request})
+        if representation:
+            serializer.child.to_representation = lambda instance: representation(
+                serializer.child, instance, plan
+            )
+        return renderer.render(serializer.data)
+
+    timings = {}
+    with mock.patch.object(ImageSerializer, "get_subscription_plan", return_value=plan):
+        for label, renderer, representation in (
+            ("before", JSONRenderer(), legacy_representation),
+            ("current", ORJSONRenderer(), None),
+        ):
+            durations = []
+            for _ in range(args.runs):
+                started = time.perf_counter()
+                render(renderer, representation)
+                durations.append(time.perf_counter() - started)
+            timings[label] = statistics.median(durations)
+
+    for label, seconds in timings.items():
+        print(f"{label:<8} {seconds * 1000:>9.2f} ms per {args.images} images")
+    print(f"speedup  {timings['before'] / timings['current']:>9.2f}x")
+
+
+if __name__ == "__main__":
+    sys.path.insert(0, BASE_DIR)
+    main()
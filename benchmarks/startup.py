@@ -0,0 +1,129 @@
+"""
+Cold-start benchmark for ImageCraftsman.
+
+Measures, in fresh interpreter processes, how long it takes from interpreter
+start to the first response served by the ASGI application, and which modules
+dominate import time (via ``python -X importtime``).
+
+Usage:
+    python benchmarks/startup.py --settings ImageCraftsman.settings_production
+    python benchmarks/startup.py --settings ImageCraftsman.settings --runs 5 --top 30
+
+The environment must provide whatever the chosen settings module reads
+(DJANGO_SECRET_KEY, DATABASE_*, ...). The first request goes to a URL that
+needs no database access, so no database has to be running.
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+FIRST_REQUEST = """
+import asyncio, time
+started = time.perf_counter()
+from ImageCraftsman.asgi import application
+imported = time.perf_counter()
+
+async def first_request():
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1",
+        "method": "GET", "scheme": "http", "path": PATH, "raw_path": PATH.encode(),
+        "query_string": b"", "root_path": "", "headers": [(b"host", b"localhost")],
+        "client": ("127.0.0.1", 50000), "server": ("localhost", 80),
+    }
+    messages = [{"type": "http.request", "body": b"", "more_body": False}]
+    status = []
+
+    async def receive():
+        if messages:
+            return messages.pop()
+        await asyncio.Event().wait()
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            status.append(message["status"])
+
+    await application(scope, receive, send)
+    return status[0]
+
+status = asyncio.run(first_request())
+print(imported - started, time.perf_counter() - started, status)
+"""
+
+
+def run_python(code, settings, *flags):
+    env = {**os.environ, "DJANGO_SETTINGS_MODULE": settings}
+    return subprocess.run(
+        [sys.executable, *flags, "-c", code],
+        cwd=BASE_DIR,
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+
+
+def time_to_first_request(settings, path, runs):
+    """
+    Time interpreter start to the first ASGI response, ``runs`` times.
+
+    Returns:
+        tuple: Lists of import and time-to-first-response durations in seconds.
+    """
+    imports, firsts = [], []
+    for _ in range(runs):
+        result = run_python(f"PATH = {path!r}\n{FIRST_REQUEST}", settings)
+        imported, first, status = result.stdout.split()
+        imports.append(float(imported))
+        firsts.append(float(first))
+    return imports, firsts, int(status)
+
+
+def import_times(settings, path):
+    """
+    Collect ``-X importtime`` data for the application and first request.
+
+    Returns:
+        list: ``(cumulative_us, self_us, module)`` tuples, slowest first.
+    """
+    result = run_python(
+        f"PATH = {path!r}\n{FIRST_REQUEST}", settings, "-X", "importtime"
+    )
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        self_us, cumulative_us, module = line[len("import time:") :].split("|")
+        rows.append((int(cumulative_us), int(self_us), module.rstrip()))
+    return sorted(rows, reverse=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--settings", default="ImageCraftsman.settings_production")
+    parser.add_argument("--path", default="/metrics/")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=20)
+    args = parser.parse_args()
+
+    imports, firsts, status = time_to_first_request(args.settings, args.path, args.runs)
+    print(f"Settings: {args.settings}")
+    print(f"First request: GET {args.path} -> {status}")
+    print(f"Import application: median {statistics.median(imports) * 1000:.1f} ms")
+    print(f"Time to first response: median {statistics.median(firsts) * 1000:.1f} ms")
+    print(f"  min {min(firsts) * 1000:.1f} ms, max {max(firsts) * 1000:.1f} ms")
+    print()
+    print(f"Slowest imports (cumulative, top {args.top}):")
+    print(f"{'cumulative ms':>14} {'self ms':>9}  module")
+    for cumulative_us, self_us, module in import_times(args.settings, args.path)[
+        : args.top
+    ]:
+        print(f"{cumulative_us / 1000:>14.1f} {self_us / 1000:>9.1f}  {module}")
+
+
+if __name__ == "__main__":
+    main()
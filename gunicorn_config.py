@@ -1,3 +1,114 @@
+import logging
+import os
+import shutil
+
 bind = "0.0.0.0:8080"
-workers = 4
 worker_class = "uvicorn.workers.UvicornWorker"
+
+MiB = 2**20
+
+# Memory one worker may use before it is recycled, and the fraction of that at
+# which it first tries to hand free heap memory back to the OS.
+WORKER_MAX_RSS = int(os.environ.get("GUNICORN_WORKER_MAX_RSS_MB", 768)) * MiB
+WORKER_SOFT_RSS = int(WORKER_MAX_RSS * 0.8)
+WORKER_RSS_CHECK_INTERVAL = float(os.environ.get("GUNICORN_RSS_CHECK_INTERVAL", 10))
+
+os.environ.setdefault("METRICS_DIR", "/tmp/imagecraft-metrics")
+
+
+def _read_first_line(path):
+    try:
+        with open(path) as f:
+            return f.readline().strip()
+    except OSError:
+        return None
+
+
+def available_cpus():
+    """
+    Count the CPUs this container may use, honouring affinity and cgroup quotas.
+    """
+    cpus = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else 1
+    quota = _read_first_line("/sys/fs/cgroup/cpu.max")
+    if quota and not quota.startswith("max"):
+        limit, period = map(int, quota.split())
+        cpus = min(cpus, max(1, limit // period))
+    return cpus
+
+
+def available_memory():
+    """
+    Get the memory available to this container in bytes, honouring cgroup limits.
+    """
+    limit = _read_first_line("/sys/fs/cgroup/memory.max")
+    if limit and limit != "max":
+        return int(limit)
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def default_workers():
+    """
+    Size the worker pool from the cores and memory available.
+
+    Thumbnail rendering is CPU-bound, so one worker per core plus one; capped
+    so that every worker can reach its RSS limit without exhausting memory.
+    """
+    workers = available_cpus() + 1
+    memory = available_memory()
+    if memory:
+        workers = min(workers, max(1, memory // WORKER_MAX_RSS))
+    return workers
+
+
+workers = int(os.environ.get("WEB_CONCURRENCY", 0)) or default_workers()
+
+# Load Django once in the master so workers share its pages copy-on-write.
+preload_app = True
+graceful_timeout = 30
+# Backstop for leaks the RSS watchdog does not catch.
+max_requests = 5000
+max_requests_jitter = 500
+
+
+def on_starting(server):
+    shutil.rmtree(os.environ["METRICS_DIR"], ignore_errors=True)
+
+
+def post_worker_init(worker):
+    from ImageCraftsman.memory_watchdog import MemoryWatchdog
+
+    MemoryWatchdog(
+        soft_limit=WORKER_SOFT_RSS,
+        hard_limit=WORKER_MAX_RSS,
+        interval=WORKER_RSS_CHECK_INTERVAL,
+    ).start()
+
+    from ImageCraftApp.tiering import start_flusher
+
+    start_flusher()
+
+
+def worker_exit(server, worker):
+    from ImageCraftApp.tiering import access_log
+
+    if access_log.flusher is not None:
+        access_log.flusher.stop()
+        access_log.flusher.join(timeout=graceful_timeout)
+    else:
+        access_log.flush(final=True)
+
+
+def child_exit(server, worker):
+    from ImageCraftApp.metrics import mark_process_dead
+
+    try:
+        mark_process_dead(worker.pid, os.environ["METRICS_DIR"])
+    except OSError:
+        logging.getLogger(__name__).exception("Could not archive worker metrics.")